@@ -0,0 +1,355 @@
+"""Пакетное прогнозирование рисков по всему регистру пациентов без графического интерфейса
+
+Пример запуска:
+    python3 batch_predict.py --output predictions.csv
+    python3 batch_predict.py --from-id 1000 --to-id 2000 --format jsonl --output -
+    python3 batch_predict.py --output predictions.csv --checkpoint predictions.ckpt
+    python3 batch_predict.py --format store --model model.npz
+    python3 batch_predict.py --format store --model builtin
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+from database import configure, get_connection, get_db_path
+from migrations import migrate
+from model_registry import model_registry
+from neural_network import DEFAULT_SEED, FACTOR_NAMES, NeuralNetworkPredictor
+from prediction_store import STALE_CONDITION, STALE_JOIN, PredictionStore
+from scoring_pipeline import DEFAULT_SHARD_SIZE, Checkpoint, ProgressReporter, ScoringPipeline, plan_shards
+
+OUTPUT_FORMATS = ['csv', 'jsonl', 'sqlite', 'store']
+OUTPUT_COLUMNS = ['patient_id', 'network', 'disease', 'risk_percentage', 'risk_level', 'imputed_factors']
+
+
+def select_patient_ids(conn, ids=None, from_id=None, to_id=None, limit=None, stale_for_model=None):
+    """Выбор идентификаторов пациентов по списку, диапазону и ограничению количества
+
+    Если задан stale_for_model, выбираются только пациенты без сохраненного
+    прогноза этой версии модели или с изменившимися с момента расчета данными.
+    """
+    query = "SELECT pt.id FROM patients pt"
+    conditions = []
+    params = []
+    if stale_for_model is not None:
+        query += " " + STALE_JOIN
+        conditions.append(STALE_CONDITION)
+        params.append(stale_for_model)
+    if ids:
+        conditions.append(f"pt.id IN ({', '.join('?' for _ in ids)})")
+        params.extend(ids)
+    if from_id is not None:
+        conditions.append("pt.id >= ?")
+        params.append(from_id)
+    if to_id is not None:
+        conditions.append("pt.id <= ?")
+        params.append(to_id)
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY pt.id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    return [row[0] for row in conn.execute(query, params)]
+
+
+class ResultWriter:
+    """Базовый класс записи результатов: одна строка на пару пациент-заболевание"""
+
+    def __init__(self):
+        self.predictor = NeuralNetworkPredictor()
+
+    def write_cohort(self, cohort):
+        """Запись результатов сегмента, полученных от конвейера"""
+        self.write(self.iter_records(cohort))
+
+    def iter_records(self, cohort):
+        """Строки результата для части когорты"""
+        networks = cohort['networks']
+        diseases = [self.predictor.networks[network]['name'] for network in networks]
+        network_factors = [[FACTOR_NAMES.index(factor) for factor in self.predictor.networks[network]['factors']]
+                           for network in networks]
+        for patient_id, patient_risks, imputed in zip(cohort['patient_ids'].tolist(), cohort['risks'].tolist(),
+                                                      cohort['imputed'].tolist()):
+            for network, disease, risk, factors in zip(networks, diseases, patient_risks, network_factors):
+                # Факторы сети, предположенные без данных пациента, через ';'
+                imputed_factors = ';'.join(FACTOR_NAMES[i] for i in factors if imputed[i])
+                yield (patient_id, network, disease, round(risk * 100, 1), self.predictor.get_risk_level(risk),
+                       imputed_factors)
+
+
+class StreamResultWriter(ResultWriter):
+    """Запись в текстовый файл или stdout; позиция для контрольной точки - смещение в файле"""
+
+    def __init__(self, output, position=None):
+        super().__init__()
+        if output == '-':
+            self.stream = sys.stdout
+        elif position is not None:
+            # Возобновление: отбрасываем строки, записанные после последней контрольной точки
+            self.stream = open(output, 'r+', encoding='utf-8', newline='')
+            self.stream.seek(position)
+            self.stream.truncate()
+        else:
+            self.stream = open(output, 'w', encoding='utf-8', newline='')
+
+    def commit(self):
+        self.stream.flush()
+        if self.stream is sys.stdout:
+            return None
+        os.fsync(self.stream.fileno())
+        return self.stream.tell()
+
+    def close(self):
+        if self.stream is sys.stdout:
+            self.stream.flush()
+        else:
+            self.stream.close()
+
+
+class CsvResultWriter(StreamResultWriter):
+    """Запись результатов в CSV"""
+
+    def __init__(self, output, position=None):
+        super().__init__(output, position)
+        self.writer = csv.writer(self.stream)
+        if not position:
+            self.writer.writerow(OUTPUT_COLUMNS)
+
+    def write(self, records):
+        self.writer.writerows(records)
+
+
+class JsonlResultWriter(StreamResultWriter):
+    """Запись результатов в JSONL: один объект на строку"""
+
+    def write(self, records):
+        self.stream.writelines(json.dumps(dict(zip(OUTPUT_COLUMNS, record)), ensure_ascii=False) + '\n'
+                               for record in records)
+
+
+class SqliteResultWriter(ResultWriter):
+    """Запись результатов в таблицу batch_predictions отдельной базы SQLite"""
+
+    def __init__(self, output, position=None):
+        super().__init__()
+        if output == '-':
+            raise ValueError("Формат sqlite требует путь к файлу в --output")
+        self.conn = sqlite3.connect(output)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_predictions (
+                patient_id INTEGER,
+                network TEXT,
+                disease TEXT,
+                risk_percentage REAL,
+                risk_level TEXT,
+                imputed_factors TEXT,
+                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (patient_id, network)
+            )
+        """)
+
+    def write(self, records):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO batch_predictions "
+            "(patient_id, network, disease, risk_percentage, risk_level, imputed_factors) VALUES (?, ?, ?, ?, ?, ?)",
+            records)
+
+    def commit(self):
+        # Каждый сегмент фиксируется одной транзакцией; повторная запись сегмента
+        # после возобновления заменяет строки, поэтому позиция не нужна
+        self.conn.commit()
+        return None
+
+    def close(self):
+        self.conn.close()
+
+
+class StoreResultWriter:
+    """Запись результатов в таблицу predictions основной базы данных"""
+
+    def __init__(self, model_version):
+        self.store = PredictionStore(model_version)
+        self.conn = get_connection()
+
+    def write_cohort(self, cohort):
+        self.store.save_cohort(self.conn, cohort)
+
+    def commit(self):
+        # Повторное сохранение сегмента заменяет прогнозы, поэтому позиция не нужна
+        self.conn.commit()
+        return None
+
+    def close(self):
+        self.conn.close()
+
+
+WRITERS = {
+    'csv': CsvResultWriter,
+    'jsonl': JsonlResultWriter,
+    'sqlite': SqliteResultWriter
+}
+
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(
+        description="Пакетный прогноз рисков заболеваний для пациентов из базы данных")
+    parser.add_argument('--db', help="путь к базе данных (по умолчанию MEDICAL_DB_PATH или medical_system.db)")
+    parser.add_argument('--output', '-o', help="файл результатов или '-' для stdout")
+    parser.add_argument('--format', '-f', choices=OUTPUT_FORMATS,
+                        help="формат результатов (по умолчанию по расширению файла, иначе csv); "
+                             "store - таблица predictions основной базы, --output не нужен")
+    parser.add_argument('--ids', help="список идентификаторов пациентов через запятую")
+    parser.add_argument('--from-id', type=int, help="минимальный идентификатор пациента")
+    parser.add_argument('--to-id', type=int, help="максимальный идентификатор пациента")
+    parser.add_argument('--limit', type=int, help="максимальное количество пациентов")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help=f"seed детерминированного расчета (по умолчанию {DEFAULT_SEED})")
+    parser.add_argument('--model', help="файл модели .npz, версия из реестра моделей или builtin - веса сетей "
+                                        "(по умолчанию активная версия реестра; ее смена применяется "
+                                        "со следующего сегмента)")
+    parser.add_argument('--random', action='store_true',
+                        help="прежний недетерминированный расчет: новые случайные допущения при каждом запуске")
+    parser.add_argument('--incremental', action='store_true',
+                        help="только пациенты без сохраненного прогноза или с изменившимися данными")
+    parser.add_argument('--workers', '-j', type=int, default=os.cpu_count(),
+                        help="количество рабочих процессов (по умолчанию число ядер)")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help="количество пациентов в одном сегменте")
+    parser.add_argument('--checkpoint',
+                        help="файл контрольной точки; прерванный запуск с теми же параметрами продолжается")
+    parser.add_argument('--quiet', '-q', action='store_true', help="не выводить прогресс")
+    args = parser.parse_args(argv)
+    if args.random:
+        args.seed = None
+
+    if args.output is None:
+        if args.format != 'store':
+            parser.error("--output обязателен, кроме формата store")
+        args.output = ''
+    if args.format is None:
+        extension = os.path.splitext(args.output)[1].lower().lstrip('.')
+        args.format = {'jsonl': 'jsonl', 'db': 'sqlite', 'sqlite': 'sqlite'}.get(extension, 'csv')
+    if args.ids:
+        try:
+            args.ids = [int(value) for value in args.ids.split(',') if value.strip()]
+        except ValueError:
+            parser.error("--ids должен содержать целые числа через запятую")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers должен быть положительным")
+    if args.shard_size < 1:
+        parser.error("--shard-size должен быть положительным")
+    if args.checkpoint and args.output == '-':
+        parser.error("--checkpoint требует файл результатов в --output")
+    return args
+
+
+def prepare_run(args, model_version):
+    """План сегментов и контрольная точка: продолжение прерванного запуска или новый план"""
+    settings = {
+        'db': os.path.abspath(get_db_path()),
+        'output': os.path.abspath(args.output) if args.output not in ('', '-') else args.output,
+        'format': args.format,
+        'ids': args.ids,
+        'from_id': args.from_id,
+        'to_id': args.to_id,
+        'limit': args.limit,
+        'incremental': args.incremental,
+        'model_version': model_version,
+        'shard_size': args.shard_size
+    }
+    if args.checkpoint:
+        checkpoint = Checkpoint.load(args.checkpoint, settings)
+        if checkpoint is not None:
+            return checkpoint.shards, checkpoint, True
+
+    conn = get_connection()
+    # Таблица predictions и версии данных появляются в миграции 4
+    migrate(conn)
+    stale_for_model = model_version if args.incremental else None
+    patient_ids = select_patient_ids(conn, args.ids, args.from_id, args.to_id, args.limit, stale_for_model)
+    conn.close()
+    # При инкрементальном запуске в диапазоне есть пациенты с актуальным
+    # прогнозом, поэтому сегменты несут явный список пациентов
+    shards = plan_shards(patient_ids, args.shard_size, explicit=bool(args.ids) or args.incremental)
+
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, shards, settings)
+        checkpoint.save()
+    return shards, checkpoint, False
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db:
+        configure(args.db)
+
+    # Версия модели на момент запуска: по ней выбираются устаревшие прогнозы
+    predictor = NeuralNetworkPredictor(args.seed)
+    conn = get_connection()
+    try:
+        migrate(conn)
+        if args.model:
+            predictor.set_model(model_registry.resolve(conn, args.model))
+        else:
+            model_registry.sync(predictor, conn)
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        print(f"Ошибка загрузки модели: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    model_version = predictor.model_version
+    shards, checkpoint, resumed = prepare_run(args, model_version)
+    if not shards:
+        if args.incremental:
+            print("Сохраненные прогнозы актуальны, пересчет не нужен", file=sys.stderr)
+            return 0
+        print("Пациенты не найдены", file=sys.stderr)
+        return 1
+    if resumed and not args.quiet:
+        print(f"Продолжение с контрольной точки: завершено {len(checkpoint.completed)} "
+              f"из {len(shards)} сегментов", file=sys.stderr)
+
+    try:
+        if args.format == 'store':
+            writer = StoreResultWriter(model_version)
+        else:
+            position = checkpoint.position if resumed else None
+            writer = WRITERS[args.format](args.output, position)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Ошибка открытия файла результатов: {e}", file=sys.stderr)
+        return 1
+
+    pipeline = ScoringPipeline(args.workers, args.seed, model_spec=args.model)
+    progress = ProgressReporter(sys.stderr) if not args.quiet else None
+    try:
+        scored = pipeline.run(shards, writer, checkpoint, progress)
+    except KeyboardInterrupt:
+        if progress:
+            sys.stderr.write("\n")
+        message = "Прервано"
+        if checkpoint is not None:
+            message += f"; для продолжения повторите запуск с --checkpoint {args.checkpoint}"
+        print(message, file=sys.stderr)
+        return 130
+    finally:
+        writer.close()
+
+    if progress:
+        sys.stderr.write("\n")
+    if checkpoint is not None:
+        checkpoint.remove()
+    if not args.quiet:
+        print(f"Готово: {scored} пациентов", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""Пакетный экспорт отчетов о пациентах в один архив ZIP или файл JSONL
+
+Пример запуска:
+    python3 bulk_export.py --output reports.zip
+    python3 bulk_export.py --ids 1,2,3 --output reports.jsonl
+    python3 bulk_export.py --search "Иванов" --report full --output ivanov.zip
+"""
+import argparse
+import itertools
+import json
+import os
+import signal
+import sys
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from batch_predict import select_patient_ids
+from database import configure, get_connection, get_db_path
+from migrations import migrate
+from patient_snapshot import load_snapshots
+from report_writer import (PRINT_MAPPINGS, full_name, iter_export_report, iter_full_report, iter_medical_data,
+                           iter_patient_card, render, snapshot_report_data)
+from scoring_pipeline import ProgressReporter, plan_shards
+
+# Пациентов в одном сегменте: снимки сегмента читаются из базы одним пакетом
+DEFAULT_SHARD_SIZE = 500
+
+EXPORT_FORMATS = ['zip', 'jsonl']
+
+# Виды отчетов: имя -> генератор report_writer
+REPORTS = {
+    'export': iter_export_report,
+    'full': iter_full_report,
+    'card': iter_patient_card,
+    'medical': iter_medical_data
+}
+
+
+def parse_id_spec(text):
+    """Разбор списка пациентов вида "1, 5, 10-20": (отдельные id, диапазоны (от, до))"""
+    ids = []
+    ranges = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            ranges.append((int(first), int(last)))
+        else:
+            ids.append(int(part))
+    return ids, ranges
+
+
+def select_ids_by_spec(conn, ids, ranges, limit=None):
+    """Существующие пациенты из списка и диапазонов в порядке id"""
+    # Диапазон выбирается запросом, а не раскрывается в список параметров IN
+    selected = set(select_patient_ids(conn, ids)) if ids else set()
+    for first, last in ranges:
+        selected.update(select_patient_ids(conn, from_id=first, to_id=last))
+    patient_ids = sorted(selected)
+    return patient_ids[:limit] if limit is not None else patient_ids
+
+
+def search_patient_ids(conn, text, limit=None):
+    """Пациенты, найденные поиском по ФИО и номерам документов, как в окне выбора пациента"""
+    # Модуль окна выбора импортирует tkinter, поэтому загружается только при поиске
+    from patient_picker import search_patients
+
+    patient_ids = []
+    after_id = 0
+    while after_id is not None and (limit is None or len(patient_ids) < limit):
+        records, after_id = search_patients(conn, text, after_id)
+        patient_ids.extend(record.id for record in records)
+    # Пациент, найденный по ID, стоит первым; сегменты строятся по возрастанию id
+    patient_ids = sorted(set(patient_ids))
+    return patient_ids[:limit] if limit is not None else patient_ids
+
+
+def _init_worker(db_path=None):
+    """Инициализация рабочего процесса: собственное соединение только для чтения"""
+    if db_path is not None:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        configure(db_path, read_only=True)
+
+
+def _render_shard(shard, report='export'):
+    """Отчеты пациентов сегмента: список (patient_id, card_number, ФИО, текст)"""
+    index, first_id, last_id, patient_ids = shard
+    build = REPORTS[report]
+    conn = get_connection()
+    try:
+        snapshots = load_snapshots(conn, patient_ids, PRINT_MAPPINGS)
+    finally:
+        conn.close()
+
+    reports = []
+    for patient_id in patient_ids:
+        snapshot = snapshots.get(patient_id)
+        if snapshot is None:
+            continue
+        data = snapshot_report_data(snapshot)
+        patient = data['patient']
+        reports.append((patient_id, patient.card_number, full_name(patient).strip(), render(build(data))))
+    return index, reports
+
+
+class ZipReportWriter:
+    """Архив ZIP: отдельный текстовый файл на каждого пациента"""
+
+    def __init__(self, output):
+        self.archive = zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, reports):
+        for patient_id, card_number, name, text in reports:
+            self.archive.writestr(f"patient_{patient_id:06d}.txt", text)
+
+    def close(self):
+        self.archive.close()
+
+
+class JsonlReportWriter:
+    """Файл JSONL: один объект на пациента"""
+
+    def __init__(self, output):
+        self.stream = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+
+    def write(self, reports):
+        self.stream.writelines(
+            json.dumps({'patient_id': patient_id, 'card_number': card_number, 'full_name': name, 'report': text},
+                       ensure_ascii=False) + '\n'
+            for patient_id, card_number, name, text in reports)
+
+    def close(self):
+        if self.stream is sys.stdout:
+            self.stream.flush()
+        else:
+            self.stream.close()
+
+
+WRITERS = {
+    'zip': ZipReportWriter,
+    'jsonl': JsonlReportWriter
+}
+
+
+class BulkExporter:
+    """Сборка отчетов по сегментам в пуле процессов; пишет результаты один процесс
+
+    Отчеты сегмента пишутся сразу по готовности, а число сегментов в работе
+    ограничено, поэтому в памяти одновременно находятся отчеты лишь нескольких сегментов.
+    """
+
+    def __init__(self, report='export', workers=None, max_pending=None, mp_context=None):
+        if report not in REPORTS:
+            raise ValueError(f"Неизвестный вид отчета: {report}")
+        self.report = report
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        # Из графического интерфейса процессы запускаются через spawn: fork
+        # многопоточного процесса с Tk небезопасен
+        self.mp_context = mp_context
+
+    def iter_results(self, shards):
+        """Отчеты сегментов в порядке готовности: (номер сегмента, отчеты)"""
+        if self.workers == 1 or len(shards) <= 1:
+            for shard in shards:
+                yield _render_shard(shard, self.report)
+            return
+
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context,
+                                       initializer=_init_worker, initargs=(get_db_path(),))
+        queue = iter(shards)
+        pending = {executor.submit(_render_shard, shard, self.report)
+                   for shard in itertools.islice(queue, self.max_pending)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                pending.update(executor.submit(_render_shard, shard, self.report)
+                               for shard in itertools.islice(queue, len(done)))
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    def run(self, patient_ids, writer, shard_size=DEFAULT_SHARD_SIZE, progress=None):
+        """Экспорт отчетов пациентов; progress(готово сегментов, всего) вызывается после каждого сегмента
+
+        Возвращает число выгруженных отчетов.
+        """
+        shards = plan_shards(patient_ids, shard_size, explicit=True)
+        total = len(shards)
+        done = 0
+        exported = 0
+        if progress:
+            progress(done, total)
+
+        for index, reports in self.iter_results(shards):
+            writer.write(reports)
+            done += 1
+            exported += len(reports)
+            if progress:
+                progress(done, total)
+        return exported
+
+
+def export_reports(patient_ids, output, export_format, report='export', workers=None,
+                   shard_size=DEFAULT_SHARD_SIZE, progress=None, mp_context=None):
+    """Экспорт отчетов в файл; незавершенный файл удаляется при ошибке или прерывании
+
+    progress может прервать экспорт исключением (например, отменой задачи).
+    """
+    writer = WRITERS[export_format](output)
+    try:
+        exported = BulkExporter(report, workers, mp_context=mp_context).run(patient_ids, writer, shard_size, progress)
+    except BaseException:
+        writer.close()
+        if output != '-':
+            try:
+                os.remove(output)
+            except OSError:
+                pass
+        raise
+    writer.close()
+    return exported
+
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Пакетный экспорт отчетов о пациентах в ZIP или JSONL")
+    parser.add_argument('--db', help="путь к базе данных (по умолчанию MEDICAL_DB_PATH или medical_system.db)")
+    parser.add_argument('--output', '-o', required=True, help="файл архива/JSONL или '-' для stdout (только jsonl)")
+    parser.add_argument('--format', '-f', choices=EXPORT_FORMATS,
+                        help="формат (по умолчанию по расширению файла, иначе zip)")
+    parser.add_argument('--report', '-r', choices=sorted(REPORTS), default='export',
+                        help="вид отчета (по умолчанию export - как при экспорте в файл из окна печати)")
+    parser.add_argument('--ids', help="идентификаторы и диапазоны пациентов через запятую, например 1,5,10-20")
+    parser.add_argument('--search', help="поиск пациентов по ФИО, номеру карты, полиса или СНИЛС")
+    parser.add_argument('--from-id', type=int, help="минимальный идентификатор пациента")
+    parser.add_argument('--to-id', type=int, help="максимальный идентификатор пациента")
+    parser.add_argument('--limit', type=int, help="максимальное количество пациентов")
+    parser.add_argument('--workers', '-j', type=int, default=os.cpu_count(),
+                        help="количество рабочих процессов (по умолчанию число ядер)")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help="количество пациентов в одном сегменте")
+    parser.add_argument('--quiet', '-q', action='store_true', help="не выводить прогресс")
+    args = parser.parse_args(argv)
+
+    if args.format is None:
+        extension = os.path.splitext(args.output)[1].lower().lstrip('.')
+        args.format = 'jsonl' if extension == 'jsonl' or args.output == '-' else 'zip'
+    if args.format == 'zip' and args.output == '-':
+        parser.error("формат zip требует путь к файлу в --output")
+    args.ranges = []
+    if args.ids:
+        try:
+            args.ids, args.ranges = parse_id_spec(args.ids)
+        except ValueError:
+            parser.error("--ids должен содержать целые числа и диапазоны через запятую")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers должен быть положительным")
+    if args.shard_size < 1:
+        parser.error("--shard-size должен быть положительным")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db:
+        configure(args.db)
+
+    conn = get_connection()
+    migrate(conn)
+    limit = None if args.search else args.limit
+    if args.ranges:
+        patient_ids = [patient_id for patient_id in select_ids_by_spec(conn, args.ids, args.ranges)
+                       if (args.from_id is None or patient_id >= args.from_id) and
+                       (args.to_id is None or patient_id <= args.to_id)][:limit]
+    else:
+        patient_ids = select_patient_ids(conn, args.ids, args.from_id, args.to_id, limit)
+    if args.search:
+        found = set(search_patient_ids(conn, args.search))
+        patient_ids = [patient_id for patient_id in patient_ids if patient_id in found][:args.limit]
+    conn.close()
+    if not patient_ids:
+        print("Пациенты не найдены", file=sys.stderr)
+        return 1
+
+    progress = ProgressReporter(sys.stderr) if not args.quiet else None
+    try:
+        exported = export_reports(patient_ids, args.output, args.format, args.report, args.workers,
+                                  args.shard_size, progress)
+    except KeyboardInterrupt:
+        if progress:
+            sys.stderr.write("\n")
+        print("Прервано", file=sys.stderr)
+        return 130
+    except OSError as e:
+        print(f"Ошибка записи файла: {e}", file=sys.stderr)
+        return 1
+
+    if progress:
+        sys.stderr.write("\n")
+    if not args.quiet:
+        print(f"Готово: {exported} отчетов", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
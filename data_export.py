@@ -0,0 +1,262 @@
+"""Выгрузка данных пациентов для анализа: таблица в файл CSV, JSONL или Parquet
+
+Пример запуска:
+    python3 data_export.py --output export/
+    python3 data_export.py --output export/ --format csv --from-id 1000 --to-id 2000
+
+Каждая таблица пишется в отдельный файл порциями по CHUNK_SIZE строк, поэтому
+память не зависит от размера базы. Рядом записывается manifest.json со
+столбцами и числом строк каждой таблицы.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import datetime
+
+from database import configure, get_connection
+from migrations import PATIENT_TABLES, get_schema_version, migrate
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Строк в одной порции чтения и записи
+CHUNK_SIZE = 10000
+
+EXPORT_FORMATS = ['jsonl', 'csv'] + (['parquet'] if pa is not None else [])
+
+# Таблицы выгрузки: (таблица, столбец пациента, порядок строк)
+EXPORT_TABLES = ([('patients', 'id', 'id')] +
+                 [(table, 'patient_id', 'id') for table in PATIENT_TABLES] +
+                 [('predictions', 'patient_id', 'patient_id, model_version')])
+
+
+def table_columns(conn, table):
+    """Столбцы таблицы и их объявленные типы; пустой список, если таблицы нет"""
+    return [(row[1], row[2].upper()) for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def iter_chunks(conn, table, key, order, from_id=None, to_id=None, chunk_size=CHUNK_SIZE):
+    """Строки таблицы порциями; курсор SQLite читает строки по мере выборки"""
+    conditions = []
+    params = []
+    if from_id is not None:
+        conditions.append(f"{key} >= ?")
+        params.append(from_id)
+    if to_id is not None:
+        conditions.append(f"{key} <= ?")
+        params.append(to_id)
+    query = f"SELECT * FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {order}"
+
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+class JsonlTableWriter:
+    """JSONL: объект на строку таблицы; риски прогноза - вложенный объект, а не строка JSON"""
+
+    extension = 'jsonl'
+
+    def __init__(self, path, columns):
+        self.names = [name for name, declared_type in columns]
+        self.json_columns = {self.names.index('risks')} if 'risks' in self.names else set()
+        self.stream = open(path, 'w', encoding='utf-8', newline='')
+
+    def write(self, rows):
+        names = self.names
+        json_columns = self.json_columns
+        lines = []
+        for row in rows:
+            if json_columns:
+                row = [json.loads(value) if i in json_columns and value else value for i, value in enumerate(row)]
+            lines.append(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n')
+        self.stream.writelines(lines)
+
+    def close(self):
+        self.stream.close()
+
+
+class CsvTableWriter:
+    """CSV с заголовком из имен столбцов"""
+
+    extension = 'csv'
+
+    def __init__(self, path, columns):
+        self.stream = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow([name for name, declared_type in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.stream.close()
+
+
+class ParquetTableWriter:
+    """Parquet (требует pyarrow): каждая порция - группа строк файла"""
+
+    extension = 'parquet'
+
+    def __init__(self, path, columns):
+        self.names = [name for name, declared_type in columns]
+        self.schema = pa.schema([(name, self.arrow_type(declared_type)) for name, declared_type in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    @staticmethod
+    def arrow_type(declared_type):
+        """Тип столбца по объявленному типу SQLite"""
+        if 'INT' in declared_type:
+            return pa.int64()
+        if 'REAL' in declared_type or 'FLOA' in declared_type or 'DOUB' in declared_type:
+            return pa.float64()
+        return pa.string()
+
+    @staticmethod
+    def coerce(value, arrow_type):
+        """Значение под тип столбца; SQLite допускает, например, текст в столбце REAL"""
+        if value is None:
+            return None
+        try:
+            if arrow_type == pa.int64():
+                return int(value)
+            if arrow_type == pa.float64():
+                return float(value)
+        except (TypeError, ValueError):
+            return None
+        return value if isinstance(value, str) else str(value)
+
+    def write(self, rows):
+        arrays = []
+        for i, field in enumerate(self.schema):
+            arrays.append(pa.array([self.coerce(row[i], field.type) for row in rows], type=field.type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {
+    'jsonl': JsonlTableWriter,
+    'csv': CsvTableWriter,
+    'parquet': ParquetTableWriter
+}
+
+
+def export_tables(conn, output_dir, export_format='jsonl', from_id=None, to_id=None,
+                  chunk_size=CHUNK_SIZE, progress=None):
+    """Выгрузка всех таблиц пациентов в каталог; возвращает манифест выгрузки
+
+    progress(таблица, выгружено строк таблицы) вызывается после каждой порции
+    и может прервать выгрузку исключением.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Формат {export_format} недоступен" +
+                         (" (нужен пакет pyarrow)" if export_format == 'parquet' else ""))
+    writer_class = WRITERS[export_format]
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {
+        'format': export_format,
+        'schema_version': get_schema_version(conn),
+        'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'from_id': from_id,
+        'to_id': to_id,
+        'tables': []
+    }
+    # Все таблицы читаются в одной транзакции: выгрузка согласована, даже если
+    # во время нее в базу пишет другая рабочая станция
+    in_transaction = conn.in_transaction
+    if not in_transaction:
+        conn.execute("BEGIN")
+    try:
+        for table, key, order in EXPORT_TABLES:
+            columns = table_columns(conn, table)
+            if not columns:
+                continue
+            filename = f"{table}.{writer_class.extension}"
+            writer = writer_class(os.path.join(output_dir, filename), columns)
+            count = 0
+            try:
+                for rows in iter_chunks(conn, table, key, order, from_id, to_id, chunk_size):
+                    writer.write(rows)
+                    count += len(rows)
+                    if progress:
+                        progress(table, count)
+            finally:
+                writer.close()
+            manifest['tables'].append({'table': table, 'file': filename, 'rows': count,
+                                       'columns': [{'name': name, 'type': declared_type}
+                                                   for name, declared_type in columns]})
+    finally:
+        if not in_transaction:
+            conn.rollback()
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(
+        description="Выгрузка пациентов, медицинских данных и прогнозов в CSV, JSONL или Parquet")
+    parser.add_argument('--db', help="путь к базе данных (по умолчанию MEDICAL_DB_PATH или medical_system.db)")
+    parser.add_argument('--output', '-o', required=True, help="каталог для файлов выгрузки")
+    parser.add_argument('--format', '-f', choices=['jsonl', 'csv', 'parquet'], default='jsonl',
+                        help="формат файлов (по умолчанию jsonl; parquet требует pyarrow)")
+    parser.add_argument('--from-id', type=int, help="минимальный идентификатор пациента")
+    parser.add_argument('--to-id', type=int, help="максимальный идентификатор пациента")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="строк в одной порции")
+    parser.add_argument('--quiet', '-q', action='store_true', help="не выводить прогресс")
+    args = parser.parse_args(argv)
+    if args.format not in EXPORT_FORMATS:
+        parser.error("формат parquet требует пакет pyarrow (pip install pyarrow)")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size должен быть положительным")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db:
+        configure(args.db)
+
+    def progress(table, count):
+        sys.stderr.write(f"\r{table}: {count} строк".ljust(60))
+        sys.stderr.flush()
+
+    conn = get_connection()
+    try:
+        migrate(conn)
+        manifest = export_tables(conn, args.output, args.format, args.from_id, args.to_id, args.chunk_size,
+                                 None if args.quiet else progress)
+    except KeyboardInterrupt:
+        print("\nПрервано", file=sys.stderr)
+        return 130
+    except OSError as e:
+        print(f"\nОшибка записи файлов: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    if not args.quiet:
+        sys.stderr.write("\n")
+        for table in manifest['tables']:
+            print(f"{table['file']}: {table['rows']} строк", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
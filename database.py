@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+
+# Путь к базе данных по умолчанию; переопределяется переменной окружения или configure()
+DEFAULT_DB_PATH = 'medical_system.db'
+DB_PATH_ENV = 'MEDICAL_DB_PATH'
+
+# Режим журнала по умолчанию. WAL позволяет читать во время записи, но требует
+# разделяемой памяти; для файла на сетевом диске задайте, например, DELETE
+DEFAULT_JOURNAL_MODE = 'WAL'
+JOURNAL_MODE_ENV = 'MEDICAL_DB_JOURNAL_MODE'
+
+
+class PooledConnection:
+    """Соединение, выданное пулом; close() возвращает его в пул, а не закрывает"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Соединение уже возвращено в пул")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        """Возврат соединения в пул"""
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+    def __del__(self):
+        # Соединение, не закрытое явно (например, при раннем return), тоже возвращается в пул
+        self.close()
+
+
+class ConnectionPool:
+    """Пул соединений SQLite: одно долгоживущее соединение на поток"""
+
+    def __init__(self, path, timeout=30.0, cached_statements=256, journal_mode=DEFAULT_JOURNAL_MODE,
+                 read_only=False):
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.journal_mode = journal_mode
+        self.read_only = read_only
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        # Процесс-владелец: соединения, унаследованные дочерним процессом при fork,
+        # в нем не используются и не закрываются
+        self._pid = os.getpid()
+
+    def _open(self):
+        """Открытие и настройка нового соединения"""
+        if self.read_only:
+            uri = 'file:' + os.path.abspath(self.path).replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+            conn = sqlite3.connect(uri, timeout=self.timeout, cached_statements=self.cached_statements,
+                                   uri=True)
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   cached_statements=self.cached_statements)
+            if self.journal_mode:
+                conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self):
+        """Выдача соединения текущего потока"""
+        local = self._local
+        if getattr(local, 'conn', None) is None:
+            local.conn = self._open()
+            local.depth = 0
+        local.depth += 1
+        return PooledConnection(self, local.conn)
+
+    def release(self, conn):
+        """Возврат соединения в пул; незавершенная транзакция откатывается"""
+        local = self._local
+        if getattr(local, 'conn', None) is not conn:
+            return
+        local.depth -= 1
+        # Вложенные выдачи в одном потоке делят соединение: откатываем только
+        # когда его вернул последний пользователь
+        if local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+    def close_thread_connection(self):
+        """Закрытие соединения текущего потока: для потоков, которые завершаются после работы"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            return
+        local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def close_all(self):
+        """Закрытие всех соединений пула"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        if os.getpid() != self._pid:
+            # Закрытие копии соединения в дочернем процессе может повредить
+            # блокировки и журнал базы в родительском
+            connections = []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Соединение другого потока закрывается при завершении этого потока
+                pass
+        self._local = threading.local()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path=None, **options):
+    """Настройка пути к базе данных и параметров пула"""
+    global _pool
+    if path is None:
+        path = os.environ.get(DB_PATH_ENV, DEFAULT_DB_PATH)
+    options.setdefault('journal_mode', os.environ.get(JOURNAL_MODE_ENV, DEFAULT_JOURNAL_MODE))
+
+    with _pool_lock:
+        old_pool, _pool = _pool, ConnectionPool(path, **options)
+    if old_pool is not None:
+        old_pool.close_all()
+    return _pool
+
+
+def get_pool():
+    """Текущий пул соединений (создается при первом обращении)"""
+    if _pool is None:
+        configure()
+    return _pool
+
+
+def get_db_path():
+    """Путь к используемой базе данных"""
+    return get_pool().path
+
+
+def get_connection():
+    """Соединение с базой данных из пула текущего потока"""
+    return get_pool().connection()
@@ -1,13 +1,21 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import sqlite3
-from neural_network import NeuralNetworkPredictor
+from database import get_connection
+from model_registry import model_registry
+from neural_network import DEFAULT_SEED, MODEL_VERSION, NeuralNetworkPredictor
+from patient_picker import PatientPicker
+from prediction_cache import prediction_cache
+from prediction_store import PredictionStore
 
 class DiseasePrediction:
     def __init__(self, parent_app):
         self.parent_app = parent_app
         self.root = parent_app.root
-        self.predictor = NeuralNetworkPredictor()
+        # Детерминированный режим: повторный расчет по тем же данным дает тот же прогноз
+        self.predictor = NeuralNetworkPredictor(seed=DEFAULT_SEED)
+        self.prediction_store = PredictionStore(self.predictor.model_version)
+        # Текущий фоновый расчет прогноза
+        self.prediction_task = None
         
     def show_prediction_window(self):
         """Отображение окна прогноза заболеваемости"""
@@ -37,12 +45,10 @@ class DiseasePrediction:
         tk.Label(patient_frame, text="Выберите пациента:", 
                 font=('Arial', 16, 'bold')).pack(anchor='w')
         
-        # Комбобокс для выбора пациента
-        self.patient_combo = ttk.Combobox(patient_frame, font=('Arial', 14), width=50)
-        self.patient_combo.pack(pady=10, anchor='w')
-        
-        # Загрузка списка пациентов
-        self.load_patients()
+        # Поиск пациента: список читается из базы по страницам по мере прокрутки
+        self.patient_picker = PatientPicker(patient_frame, self.parent_app.task_runner,
+                                            on_choose=lambda patient_id: self.make_prediction(), height=6)
+        self.patient_picker.frame.pack(pady=10, anchor='w', fill='x')
         
         # Кнопка прогнозирования
         predict_button = tk.Button(patient_frame, text="Получить прогноз заболеваемости", 
@@ -51,69 +57,153 @@ class DiseasePrediction:
                                   command=self.make_prediction)
         predict_button.pack(pady=20, anchor='w')
         
+        # Счетчики кэша прогнозов (для настройки размера и времени жизни кэша)
+        self.cache_stats_label = tk.Label(patient_frame, font=('Arial', 10), fg='gray')
+        self.cache_stats_label.pack(anchor='w')
+        self.update_cache_stats()
+        
+        # Версия модели прогноза: переключается без перезапуска программы
+        model_frame = tk.Frame(patient_frame)
+        model_frame.pack(anchor='w', pady=(10, 0))
+        tk.Label(model_frame, text="Модель прогноза:", font=('Arial', 12)).pack(side='left')
+        self.model_var = tk.StringVar()
+        self.model_combo = ttk.Combobox(model_frame, textvariable=self.model_var, state='readonly',
+                                        font=('Arial', 12), width=45)
+        self.model_combo.pack(side='left', padx=5)
+        tk.Button(model_frame, text="Применить", font=('Arial', 12),
+                 command=self.activate_model).pack(side='left')
+        # Подписи списка моделей -> версии реестра (None - веса сетей)
+        self.model_choices = {}
+        self.load_model_versions()
+        
         # Область для результатов
         self.results_frame = tk.Frame(main_frame)
         self.results_frame.pack(fill='both', expand=True, padx=20, pady=10)
         
-    def load_patients(self):
-        """Загрузка списка пациентов"""
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id, surname, name, patronymic FROM patients")
-            patients = cursor.fetchall()
-            
-            patient_list = []
-            for patient in patients:
-                full_name = f"{patient[1]} {patient[2]} {patient[3] or ''}".strip()
-                patient_list.append(f"{patient[0]} - {full_name}")
-            
-            self.patient_combo['values'] = patient_list
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки пациентов: {e}")
-    
     def make_prediction(self):
         """Выполнение прогнозирования"""
-        if not self.patient_combo.get():
+        patient_id = self.patient_picker.get_patient_id()
+        if patient_id is None:
             messagebox.showwarning("Предупреждение", "Выберите пациента")
             return
         
-        try:
-            # Получение ID пациента
-            patient_id = int(self.patient_combo.get().split(' - ')[0])
-            
+        # Прогноз по ранее выбранному пациенту больше не нужен
+        if self.prediction_task is not None:
+            self.prediction_task.cancel()
+        
+        def predict(task):
             # Проверка наличия диагностических данных
             diagnostic_data = self.check_diagnostic_data(patient_id)
-            
             if not diagnostic_data['has_data']:
-                self.show_no_diagnostic_data_warning(diagnostic_data)
-                return
-            
-            # Очистка предыдущих результатов
-            for widget in self.results_frame.winfo_children():
-                widget.destroy()
-            
-            # Получение прогноза
-            predictions = self.predictor.predict_disease_risk(patient_id)
-            
-            if not predictions:
-                messagebox.showerror("Ошибка", "Не удалось получить данные пациента")
-                return
+                return diagnostic_data, None
             
-            # Отображение результатов
-            self.display_predictions(predictions, diagnostic_data)
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка прогнозирования: {e}")
+            task.check_cancelled()
+            # Активную версию могли сменить на другой рабочей станции или из командной строки
+            model_registry.sync(self.predictor)
+            # Получение прогноза (из кэша или сохраненного, если данные пациента не менялись)
+            return diagnostic_data, self.get_prediction(patient_id)
+        
+        self.prediction_task = self.parent_app.task_runner.submit(
+            predict, "Расчет прогноза", on_success=self.show_prediction_result,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка прогнозирования: {e}"),
+            owner=self.results_frame, indicator_parent=self.results_frame.master)
+    
+    def show_prediction_result(self, result):
+        """Отображение результата фонового расчета прогноза (в главном потоке)"""
+        diagnostic_data, predictions = result
+        self.prediction_task = None
+        self.update_cache_stats()
+        
+        if not diagnostic_data['has_data']:
+            self.show_no_diagnostic_data_warning(diagnostic_data)
+            return
+        
+        # Очистка предыдущих результатов
+        for widget in self.results_frame.winfo_children():
+            widget.destroy()
+        
+        if not predictions:
+            messagebox.showerror("Ошибка", "Не удалось получить данные пациента")
+            return
+        
+        # Отображение результатов
+        self.display_predictions(predictions, diagnostic_data)
+    
+    def get_prediction(self, patient_id):
+        """Прогноз пациента: кэш процесса, затем таблица predictions, затем новый расчет"""
+        # Модель и версия берутся один раз: замена модели во время расчета не смешивает версии
+        active = self.predictor.active
+        model_version = active[1]
+        predictions = prediction_cache.get(patient_id, model_version)
+        if predictions is None:
+            predictions = self.prediction_store.predict(self.predictor, patient_id, active)
+            if predictions is not None:
+                prediction_cache.put(patient_id, model_version, predictions)
+        return predictions
+    
+    def load_model_versions(self):
+        """Заполнение списка моделей версиями реестра; предиктор переключается на активную"""
+        def load(task):
+            conn = get_connection()
+            try:
+                model_registry.sync(self.predictor, conn)
+                return model_registry.list_versions(conn)
+            finally:
+                conn.close()
+        
+        self.parent_app.task_runner.submit(
+            load, "Загрузка списка моделей", on_success=self.show_model_versions,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка загрузки модели: {e}"),
+            owner=self.model_combo, show_progress=False)
+    
+    def show_model_versions(self, versions):
+        """Список моделей с отметкой текущей (в главном потоке)"""
+        self.model_choices = {f"Веса сетей ({MODEL_VERSION})": None}
+        for version, description, created_date, active in versions:
+            label = f"{version} от {(created_date or '')[:10]}"
+            if description:
+                label += f" - {description}"
+            self.model_choices[label] = version
+        self.model_combo['values'] = list(self.model_choices)
+        
+        model = self.predictor.model
+        current = model.version if model is not None else None
+        for label, version in self.model_choices.items():
+            if version == current:
+                self.model_var.set(label)
+    
+    def activate_model(self):
+        """Назначение выбранной модели активной для всех рабочих мест и переключение без перезапуска"""
+        label = self.model_var.get()
+        if label not in self.model_choices:
+            return
+        version = self.model_choices[label]
+        
+        def activate(task):
+            conn = get_connection()
+            try:
+                model_registry.activate(conn, version)
+                model_registry.sync(self.predictor, conn)
+                return model_registry.list_versions(conn)
+            finally:
+                conn.close()
+        
+        self.parent_app.task_runner.submit(
+            activate, "Переключение модели", on_success=self.show_model_versions,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Не удалось переключить модель: {e}"),
+            owner=self.model_combo)
+    
+    def update_cache_stats(self):
+        """Обновление строки со счетчиками кэша прогнозов"""
+        stats = prediction_cache.stats()
+        self.cache_stats_label.config(
+            text=f"Кэш прогнозов: {stats['size']}/{stats['max_size']} записей, "
+                 f"попаданий {stats['hits']}, промахов {stats['misses']} "
+                 f"({stats['hit_rate'] * 100:.0f}%), вытеснено {stats['evictions']}, "
+                 f"сброшено {stats['invalidations']}")
     
     def check_diagnostic_data(self, patient_id):
         """Проверка наличия диагностических данных для пациента"""
-        import sqlite3
-        
         diagnostic_data = {
             'has_data': False,
             'available_data': [],
@@ -121,7 +211,7 @@ class DiseasePrediction:
         }
         
         try:
-            conn = sqlite3.connect('medical_system.db')
+            conn = get_connection()
             cursor = conn.cursor()
             
             # Проверяем наличие различных типов диагностических данных
@@ -136,10 +226,11 @@ class DiseasePrediction:
             
             for table_name, display_name in data_types:
                 try:
-                    cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE patient_id = ?", (patient_id,))
-                    count = cursor.fetchone()[0]
+                    # EXISTS останавливается на первой строке и не читает всю историю визитов
+                    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table_name} WHERE patient_id = ?)", (patient_id,))
+                    has_rows = cursor.fetchone()[0]
                     
-                    if count > 0:
+                    if has_rows:
                         diagnostic_data['available_data'].append(display_name)
                     else:
                         diagnostic_data['missing_data'].append(display_name)
@@ -308,6 +399,15 @@ class DiseasePrediction:
                                  font=('Arial', 14),
                                  fg=self.get_risk_color(risk_data['risk_percentage']))
             level_label.pack(anchor='w', padx=20)
+            
+            # Отметка факторов, предположенных без данных пациента
+            if risk_data.get('imputed_factors'):
+                imputed_label = tk.Label(risk_frame,
+                                       text=f"Факторов без данных пациента (учтены предположительно): "
+                                            f"{len(risk_data['imputed_factors'])}",
+                                       font=('Arial', 11),
+                                       fg='gray')
+                imputed_label.pack(anchor='w', padx=20)
         
         # Полная таблица всех рисков
         all_risks_frame = tk.LabelFrame(self.results_frame,
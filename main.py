@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import sqlite3
+from database import get_connection, get_pool
+from migrations import migrate
 import os
 from datetime import datetime
 import random
@@ -10,6 +11,7 @@ from patient_card import PatientCard
 from patient_survey import PatientSurvey
 from print_module import PrintModule
 from disease_prediction import DiseasePrediction
+from task_runner import TaskRunner
 
 class MedicalSystemApp:
     def __init__(self, root):
@@ -24,6 +26,9 @@ class MedicalSystemApp:
         # Текущий пациент
         self.current_patient_id = None
         
+        # Работа с базой данных и прогнозы выполняются вне главного потока
+        self.task_runner = TaskRunner(self.root)
+        
         # Инициализация модулей
         self.patient_card = PatientCard(self)
         self.patient_survey = PatientSurvey(self)
@@ -35,197 +40,11 @@ class MedicalSystemApp:
         
     def init_database(self):
         """Инициализация базы данных"""
-        conn = sqlite3.connect('medical_system.db')
-        cursor = conn.cursor()
-        
-        # Таблица пациентов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                card_number TEXT UNIQUE,
-                policy_number TEXT,
-                surname TEXT,
-                name TEXT,
-                patronymic TEXT,
-                birth_date TEXT,
-                gender TEXT,
-                address TEXT,
-                phone TEXT,
-                passport TEXT,
-                series TEXT,
-                number TEXT,
-                issued_by TEXT,
-                snils TEXT,
-                workplace TEXT,
-                disability_group TEXT,
-                blood_group TEXT,
-                created_date TEXT
-            )
-        ''')
-        
-        # Таблица анамнеза
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS anamnesis (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                covid19 INTEGER DEFAULT 0,
-                severity INTEGER DEFAULT 0,
-                fatigue INTEGER DEFAULT 0,
-                glucose INTEGER DEFAULT 0,
-                creatinine INTEGER DEFAULT 0,
-                hemoglobin INTEGER DEFAULT 0,
-                erythrocytes INTEGER DEFAULT 0,
-                thrombocytes INTEGER DEFAULT 0,
-                leukocytes INTEGER DEFAULT 0,
-                soe INTEGER DEFAULT 0,
-                alat INTEGER DEFAULT 0,
-                asat INTEGER DEFAULT 0,
-                urea INTEGER DEFAULT 0,
-                srb INTEGER DEFAULT 0,
-                total_protein INTEGER DEFAULT 0,
-                FOREIGN KEY (patient_id) REFERENCES patients (id)
-            )
-        ''')
-        
-        # Таблица коморбидных состояний
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS comorbidities (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                spinal_diseases INTEGER DEFAULT 0,
-                atherosclerosis INTEGER DEFAULT 0,
-                gastric_diseases INTEGER DEFAULT 0,
-                stenosis INTEGER DEFAULT 0,
-                thyroid_diseases INTEGER DEFAULT 0,
-                chronic_heart_failure INTEGER DEFAULT 0,
-                respiratory_failure INTEGER DEFAULT 0,
-                obesity INTEGER DEFAULT 0,
-                cardiovascular_diseases INTEGER DEFAULT 0,
-                joint_diseases INTEGER DEFAULT 0,
-                iht INTEGER DEFAULT 0,
-                cerebrovascular_diseases INTEGER DEFAULT 0,
-                brain_diseases INTEGER DEFAULT 0,
-                muscle_diseases INTEGER DEFAULT 0,
-                pneumonia INTEGER DEFAULT 0,
-                pathology_stage INTEGER DEFAULT 0,
-                other_pathologies INTEGER DEFAULT 0,
-                FOREIGN KEY (patient_id) REFERENCES patients (id)
-            )
-        ''')
-        
-        # Таблица анализов крови
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS blood_tests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                erythrocytes REAL,
-                leukocytes REAL,
-                hemoglobin REAL,
-                soe REAL,
-                lymphocytes REAL,
-                srb_normal INTEGER DEFAULT 0,
-                srb_elevated INTEGER DEFAULT 0,
-                d_dimer_normal INTEGER DEFAULT 0,
-                d_dimer_elevated INTEGER DEFAULT 0,
-                thrombocytes_normal INTEGER DEFAULT 0,
-                thrombocytes_low INTEGER DEFAULT 0,
-                FOREIGN KEY (patient_id) REFERENCES patients (id)
-            )
-        ''')
-        
-        # Таблица анализов мочи
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS urine_tests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                analysis_not_performed INTEGER DEFAULT 0,
-                transparent_urine INTEGER DEFAULT 0,
-                cloudy_urine INTEGER DEFAULT 0,
-                light_yellow_urine INTEGER DEFAULT 0,
-                dark_yellow_urine INTEGER DEFAULT 0,
-                protein_presence REAL,
-                leukocytes_presence REAL,
-                FOREIGN KEY (patient_id) REFERENCES patients (id)
-            )
-        ''')
+        conn = get_connection()
         
-        # Таблица ЭКГ
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ecg_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                g1_deviation INTEGER DEFAULT 0,
-                g2_lzh_deviation INTEGER DEFAULT 0,
-                g3_deviation INTEGER DEFAULT 0,
-                g3_lzh_deviation INTEGER DEFAULT 0,
-                g6_lzh_deviation INTEGER DEFAULT 0,
-                g7_deviation INTEGER DEFAULT 0,
-                g9_deviation INTEGER DEFAULT 0,
-                pulse INTEGER DEFAULT 0,
-                qrs_deviation INTEGER DEFAULT 0,
-                qt_deviation INTEGER DEFAULT 0,
-                pq_deviation INTEGER DEFAULT 0,
-                p_deviation INTEGER DEFAULT 0,
-                t_normal INTEGER DEFAULT 0,
-                bcp_deviation INTEGER DEFAULT 0,
-                FOREIGN KEY (patient_id) REFERENCES patients (id)
-            )
-        ''')
+        # Схема создается и обновляется версионированными миграциями
+        migrate(conn)
         
-        # Таблица ЭХО-КГ
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS echo_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                aorta REAL,
-                left_atrium REAL,
-                lv_kdr REAL,
-                lv_ksr REAL,
-                tmgp REAL,
-                tzsgl REAL,
-                fv REAL,
-                right_atrium REAL,
-                rv REAL,
-                stla REAL,
-                FOREIGN KEY (patient_id) REFERENCES patients (id)
-            )
-        ''')
-        
-        # Удаляем старую таблицу anamnesis_extended и создаем новую с правильными полями
-        cursor.execute('DROP TABLE IF EXISTS anamnesis_extended')
-        
-        # Расширенная таблица анамнеза
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS anamnesis_extended (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                weakness INTEGER DEFAULT 0,
-                fatigue INTEGER DEFAULT 0,
-                weight_loss INTEGER DEFAULT 0,
-                pallor INTEGER DEFAULT 0,
-                temperature INTEGER DEFAULT 0,
-                runny_nose INTEGER DEFAULT 0,
-                sweating INTEGER DEFAULT 0,
-                cough INTEGER DEFAULT 0,
-                sputum INTEGER DEFAULT 0,
-                purulent_sputum INTEGER DEFAULT 0,
-                bloody_sputum INTEGER DEFAULT 0,
-                mucous_sputum INTEGER DEFAULT 0,
-                covid19 INTEGER DEFAULT 0,
-                covid_severity TEXT DEFAULT '',
-                hemoptysis INTEGER DEFAULT 0,
-                vomiting INTEGER DEFAULT 0,
-                headache INTEGER DEFAULT 0,
-                constipation INTEGER DEFAULT 0,
-                diarrhea INTEGER DEFAULT 0,
-                chest_pain INTEGER DEFAULT 0,
-                blood_in_stool INTEGER DEFAULT 0,
-                dyspnea INTEGER DEFAULT 0,
-                FOREIGN KEY (patient_id) REFERENCES patients (id)
-            )
-        ''')
-        
-        conn.commit()
         conn.close()
     
     def create_main_window(self):
@@ -284,6 +103,16 @@ class MedicalSystemApp:
                              command=self.print_module.print_patient_data)
         btn_print.pack(pady=8)
         
+        btn_bulk_export = tk.Button(right_frame, text="Пакетный экспорт отчетов", 
+                                   font=('Arial', 14), width=30, height=2,
+                                   command=self.print_module.bulk_export)
+        btn_bulk_export.pack(pady=8)
+        
+        btn_data_export = tk.Button(right_frame, text="Выгрузка данных для анализа", 
+                                   font=('Arial', 14), width=30, height=2,
+                                   command=self.print_module.export_data)
+        btn_data_export.pack(pady=8)
+        
         btn_manual = tk.Button(right_frame, text="Руководство пользователя", 
                               font=('Arial', 14), width=30, height=2,
                               command=self.show_user_manual)
@@ -386,4 +215,6 @@ class MedicalSystemApp:
 if __name__ == "__main__":
     root = tk.Tk()
     app = MedicalSystemApp(root)
-    root.mainloop() 
\ No newline at end of file
+    root.mainloop()
+    app.task_runner.shutdown()
+    get_pool().close_all()
@@ -1,13 +1,95 @@
 import tkinter as tk
 from tkinter import messagebox
-import sqlite3
+from database import get_connection
+from prediction_cache import invalidate_patient
+from migrations import upsert_sql
+from row_mapping import RecordMapping, fetch_patient_record
 from datetime import datetime
 
+# Поля карты пациента по именам столбцов таблиц
+ANAMNESIS_FIELDS = ['weakness', 'fatigue', 'weight_loss', 'pallor', 'temperature',
+                    'runny_nose', 'sweating', 'cough', 'sputum', 'purulent_sputum',
+                    'bloody_sputum', 'mucous_sputum', 'covid19', 'hemoptysis', 'vomiting',
+                    'headache', 'constipation', 'diarrhea', 'chest_pain',
+                    'blood_in_stool', 'dyspnea']
+COMORBIDITIES_FIELDS = ['spinal_diseases', 'atherosclerosis', 'gastric_diseases', 'stenosis',
+                        'thyroid_diseases', 'chronic_heart_failure', 'respiratory_failure',
+                        'obesity', 'cardiovascular_diseases', 'joint_diseases', 'iht',
+                        'cerebrovascular_diseases', 'brain_diseases', 'muscle_diseases',
+                        'pneumonia', 'pathology_stage', 'other_pathologies']
+BLOOD_VALUE_FIELDS = ['erythrocytes', 'leukocytes', 'hemoglobin', 'soe', 'lymphocytes']
+BLOOD_CHECKBOX_FIELDS = ['srb_normal', 'srb_elevated', 'd_dimer_normal', 'd_dimer_elevated',
+                         'thrombocytes_normal', 'thrombocytes_low']
+BLOOD_ADDITIONAL_VALUE_FIELDS = ['srb_normal_value', 'srb_elevated_value', 'd_dimer_normal_value',
+                                 'd_dimer_elevated_value', 'thrombocytes_normal_value', 'thrombocytes_low_value']
+ECG_CHECKBOX_FIELDS = ['g1_deviation', 'g2_lzh_deviation', 'g3_deviation', 'g3_lzh_deviation',
+                       'g6_lzh_deviation', 'g7_deviation', 'g9_deviation',
+                       'qrs_deviation', 'qt_deviation', 'pq_deviation', 'p_deviation',
+                       't_normal', 'bcp_deviation']
+ECHO_FIELDS = ['aorta', 'left_atrium', 'lv_kdr', 'lv_ksr', 'tmgp',
+               'tzsgl', 'fv', 'right_atrium', 'rv', 'stla']
+
+# Записи, которые читают методы загрузки: только нужные столбцы по именам
+ANAMNESIS_MAPPING = RecordMapping('anamnesis_extended', ANAMNESIS_FIELDS + ['covid_severity', 'ad_value'])
+COMORBIDITIES_MAPPING = RecordMapping('comorbidities', COMORBIDITIES_FIELDS)
+BLOOD_TESTS_MAPPING = RecordMapping('blood_tests_extended', BLOOD_VALUE_FIELDS + BLOOD_CHECKBOX_FIELDS +
+                                    BLOOD_ADDITIONAL_VALUE_FIELDS)
+URINE_TESTS_MAPPING = RecordMapping('urine_tests_new',
+                                    ['transparency', 'color', 'status', 'protein_value', 'leukocytes_value'])
+ECG_MAPPING = RecordMapping('ecg_data', ECG_CHECKBOX_FIELDS + ['pulse'])
+ECHO_MAPPING = RecordMapping('echo_data', ECHO_FIELDS)
+
+# Сохранение вкладок: строка визита (пациент и дата визита) обновляется на месте,
+# сохранение в новую дату добавляет визит в историю
+VISIT_KEY = ['patient_id', 'visit_date']
+BLOOD_TESTS_UPSERT = upsert_sql('blood_tests_extended', VISIT_KEY,
+                                BLOOD_VALUE_FIELDS + BLOOD_CHECKBOX_FIELDS + BLOOD_ADDITIONAL_VALUE_FIELDS)
+URINE_TESTS_UPSERT = upsert_sql('urine_tests_new', VISIT_KEY,
+                                ['transparency', 'color', 'status', 'protein_value', 'leukocytes_value'])
+ECG_UPSERT = upsert_sql('ecg_data', VISIT_KEY, ECG_CHECKBOX_FIELDS[:7] + ['pulse'] + ECG_CHECKBOX_FIELDS[7:])
+ECHO_UPSERT = upsert_sql('echo_data', VISIT_KEY, ECHO_FIELDS)
+ANAMNESIS_UPSERT = upsert_sql('anamnesis_extended', VISIT_KEY, ANAMNESIS_FIELDS + ['covid_severity', 'ad_value'])
+# Коморбидные состояния не зависят от визита: одна строка на пациента
+COMORBIDITIES_UPSERT = upsert_sql('comorbidities', ['patient_id'], COMORBIDITIES_FIELDS)
+
 class MedicalDataManager:
     def __init__(self, parent_card):
         self.parent_card = parent_card
         self.parent_app = parent_card.parent_app
     
+    def run_save(self, write, subject, success_message, per_visit=True):
+        """Запись в базу данных в рабочем потоке; значения полей собираются заранее в главном потоке
+
+        write(cursor, patient_id, visit_date); per_visit - данные относятся
+        к визиту с датой из заголовка карты пациента.
+        """
+        patient_id = self.parent_app.current_patient_id
+        visit_date = None
+        if per_visit:
+            visit_date = self.parent_card.get_visit_date()
+            if visit_date is None:
+                return
+            success_message = f"{success_message}\nДата визита: {visit_date}"
+        
+        def save(task):
+            conn = get_connection()
+            try:
+                write(conn.cursor(), patient_id, visit_date)
+                conn.commit()
+            finally:
+                conn.close()
+            invalidate_patient(patient_id)
+        
+        def show(result):
+            if per_visit:
+                # Сохранение в новую дату добавило визит в список
+                self.parent_card.load_visit_dates()
+            messagebox.showinfo("Успех", success_message)
+        
+        self.parent_app.task_runner.submit(
+            save, f"Сохранение {subject}", on_success=show,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка при сохранении {subject}: {str(e)}"))
+    
     def save_blood_test_data(self):
         """Сохранение данных анализа крови"""
         if not self.parent_app.current_patient_id:
@@ -15,12 +97,6 @@ class MedicalDataManager:
             return
         
         try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Удаляем старые данные если есть
-            cursor.execute("DELETE FROM blood_tests WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            
             # Получаем данные из полей ввода
             blood_data = {}
             if hasattr(self.parent_card, 'blood_entries'):
@@ -39,10 +115,7 @@ class MedicalDataManager:
             
             # Получаем значения из дополнительных полей ввода
             additional_values = {}
-            additional_fields = ['srb_normal_value', 'srb_elevated_value', 'd_dimer_normal_value',
-                               'd_dimer_elevated_value', 'thrombocytes_normal_value', 'thrombocytes_low_value']
-            
-            for field_name in additional_fields:
+            for field_name in BLOOD_ADDITIONAL_VALUE_FIELDS:
                 if hasattr(self.parent_card, 'blood_entries') and field_name in self.parent_card.blood_entries:
                     try:
                         value = self.parent_card.blood_entries[field_name].get().strip()
@@ -51,47 +124,19 @@ class MedicalDataManager:
                         additional_values[field_name] = None
                 else:
                     additional_values[field_name] = None
-
-            # Обновляем структуру таблицы если нужно
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS blood_tests_extended (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    erythrocytes REAL,
-                    leukocytes REAL,
-                    hemoglobin REAL,
-                    soe REAL,
-                    lymphocytes REAL,
-                    srb_normal INTEGER DEFAULT 0,
-                    srb_elevated INTEGER DEFAULT 0,
-                    d_dimer_normal INTEGER DEFAULT 0,
-                    d_dimer_elevated INTEGER DEFAULT 0,
-                    thrombocytes_normal INTEGER DEFAULT 0,
-                    thrombocytes_low INTEGER DEFAULT 0,
-                    srb_normal_value REAL,
-                    srb_elevated_value REAL,
-                    d_dimer_normal_value REAL,
-                    d_dimer_elevated_value REAL,
-                    thrombocytes_normal_value REAL,
-                    thrombocytes_low_value REAL,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )
-            """)
             
-            # Удаляем старые данные
-            cursor.execute("DELETE FROM blood_tests_extended WHERE patient_id=?", (self.parent_app.current_patient_id,))
-
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка при сохранении анализа крови: {str(e)}")
+            return
+        
+        def write(cursor, patient_id, visit_date):
+            # Строка старой таблицы анализов крови заменяется расширенной
+            cursor.execute("DELETE FROM blood_tests WHERE patient_id=?", (patient_id,))
+            
             # Сохраняем в БД
-            cursor.execute("""
-                INSERT INTO blood_tests_extended (
-                    patient_id, erythrocytes, leukocytes, hemoglobin, soe, lymphocytes,
-                    srb_normal, srb_elevated, d_dimer_normal, d_dimer_elevated,
-                    thrombocytes_normal, thrombocytes_low,
-                    srb_normal_value, srb_elevated_value, d_dimer_normal_value,
-                    d_dimer_elevated_value, thrombocytes_normal_value, thrombocytes_low_value
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                self.parent_app.current_patient_id,
+            cursor.execute(BLOOD_TESTS_UPSERT, (
+                patient_id,
+                visit_date,
                 blood_data.get('erythrocytes'),
                 blood_data.get('leukocytes'), 
                 blood_data.get('hemoglobin'),
@@ -110,13 +155,8 @@ class MedicalDataManager:
                 additional_values.get('thrombocytes_normal_value'),
                 additional_values.get('thrombocytes_low_value')
             ))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Успех", "Анализ крови сохранен!")
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении анализа крови: {str(e)}")
+        
+        self.run_save(write, "анализа крови", "Анализ крови сохранен!")
     
     def save_urine_test_data(self):
         """Сохранение данных анализа мочи"""
@@ -124,75 +164,47 @@ class MedicalDataManager:
             messagebox.showwarning("Предупреждение", "Сначала сохраните данные пациента!")
             return
         
+        # Получаем данные из выпадающих списков
+        transparency = None
+        color = None
+        status = None
+        
+        if hasattr(self.parent_card, 'urine_combos'):
+            transparency = self.parent_card.urine_combos['transparency'].get()
+            color = self.parent_card.urine_combos['color'].get()
+            status = self.parent_card.urine_combos['status'].get()
+            
+            # Заменяем "Не выбрано" на None
+            if transparency == 'Не выбрано':
+                transparency = None
+            if color == 'Не выбрано':
+                color = None
+        
+        # Получаем данные из полей ввода
+        protein_value = None
+        leukocytes_value = None
+        
         try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Создаем обновленную таблицу для анализа мочи если нужно
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS urine_tests_new (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    transparency TEXT,
-                    color TEXT,
-                    status TEXT,
-                    protein_value REAL,
-                    leukocytes_value REAL,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )
-            ''')
-            
-            # Удаляем старые данные если есть
-            cursor.execute("DELETE FROM urine_tests_new WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            
-            # Получаем данные из выпадающих списков
-            transparency = None
-            color = None
-            status = None
-            
-            if hasattr(self.parent_card, 'urine_combos'):
-                transparency = self.parent_card.urine_combos['transparency'].get()
-                color = self.parent_card.urine_combos['color'].get()
-                status = self.parent_card.urine_combos['status'].get()
-                
-                # Заменяем "Не выбрано" на None
-                if transparency == 'Не выбрано':
-                    transparency = None
-                if color == 'Не выбрано':
-                    color = None
-            
-            # Получаем данные из полей ввода
-            protein_value = None
-            leukocytes_value = None
-            
-            try:
-                if hasattr(self.parent_card, 'protein_entry') and self.parent_card.protein_entry.get().strip():
-                    protein_value = float(self.parent_card.protein_entry.get())
-                if hasattr(self.parent_card, 'leukocytes_urine_entry') and self.parent_card.leukocytes_urine_entry.get().strip():
-                    leukocytes_value = float(self.parent_card.leukocytes_urine_entry.get())
-            except ValueError:
-                pass
-            
+            if hasattr(self.parent_card, 'protein_entry') and self.parent_card.protein_entry.get().strip():
+                protein_value = float(self.parent_card.protein_entry.get())
+            if hasattr(self.parent_card, 'leukocytes_urine_entry') and self.parent_card.leukocytes_urine_entry.get().strip():
+                leukocytes_value = float(self.parent_card.leukocytes_urine_entry.get())
+        except ValueError:
+            pass
+        
+        def write(cursor, patient_id, visit_date):
             # Сохраняем в БД
-            cursor.execute("""
-                INSERT INTO urine_tests_new (
-                    patient_id, transparency, color, status, protein_value, leukocytes_value
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                self.parent_app.current_patient_id,
+            cursor.execute(URINE_TESTS_UPSERT, (
+                patient_id,
+                visit_date,
                 transparency,
                 color,
                 status,
                 protein_value,
                 leukocytes_value
             ))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Успех", "Анализ мочи сохранен!")
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении анализа мочи: {str(e)}")
+        
+        self.run_save(write, "анализа мочи", "Анализ мочи сохранен!")
     
     def save_ecg_data(self):
         """Сохранение данных ЭКГ"""
@@ -200,54 +212,32 @@ class MedicalDataManager:
             messagebox.showwarning("Предупреждение", "Сначала сохраните данные пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Удаляем старые данные если есть
-            cursor.execute("DELETE FROM ecg_data WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            
-            # Получаем данные из чекбоксов (без пульса)
-            ecg_checkbox_fields = ['g1_deviation', 'g2_lzh_deviation', 'g3_deviation', 'g3_lzh_deviation',
-                                  'g6_lzh_deviation', 'g7_deviation', 'g9_deviation',
-                                  'qrs_deviation', 'qt_deviation', 'pq_deviation', 'p_deviation',
-                                  't_normal', 'bcp_deviation']
-            
-            ecg_values = []
-            if hasattr(self.parent_card, 'ecg_vars'):
-                for field_name in ecg_checkbox_fields:
-                    if field_name in self.parent_card.ecg_vars:
-                        ecg_values.append(1 if self.parent_card.ecg_vars[field_name].get() else 0)
-                    else:
-                        ecg_values.append(0)
-            else:
-                ecg_values = [0] * len(ecg_checkbox_fields)
-            
-            # Получаем значение пульса
-            pulse_value = None
-            if hasattr(self.parent_card, 'pulse_entry'):
-                try:
-                    pulse_text = self.parent_card.pulse_entry.get().strip()
-                    if pulse_text:
-                        pulse_value = int(pulse_text)
-                except ValueError:
-                    pulse_value = None
-            
+        # Получаем данные из чекбоксов (без пульса)
+        ecg_values = []
+        if hasattr(self.parent_card, 'ecg_vars'):
+            for field_name in ECG_CHECKBOX_FIELDS:
+                if field_name in self.parent_card.ecg_vars:
+                    ecg_values.append(1 if self.parent_card.ecg_vars[field_name].get() else 0)
+                else:
+                    ecg_values.append(0)
+        else:
+            ecg_values = [0] * len(ECG_CHECKBOX_FIELDS)
+        
+        # Получаем значение пульса
+        pulse_value = None
+        if hasattr(self.parent_card, 'pulse_entry'):
+            try:
+                pulse_text = self.parent_card.pulse_entry.get().strip()
+                if pulse_text:
+                    pulse_value = int(pulse_text)
+            except ValueError:
+                pulse_value = None
+        
+        def write(cursor, patient_id, visit_date):
             # Сохраняем в БД
-            cursor.execute("""
-                INSERT INTO ecg_data (
-                    patient_id, g1_deviation, g2_lzh_deviation, g3_deviation, g3_lzh_deviation,
-                    g6_lzh_deviation, g7_deviation, g9_deviation, pulse, qrs_deviation,
-                    qt_deviation, pq_deviation, p_deviation, t_normal, bcp_deviation
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, tuple([self.parent_app.current_patient_id] + ecg_values[:7] + [pulse_value] + ecg_values[7:]))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Успех", "Данные ЭКГ сохранены!")
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении ЭКГ: {str(e)}")
+            cursor.execute(ECG_UPSERT, tuple([patient_id, visit_date] + ecg_values[:7] + [pulse_value] + ecg_values[7:]))
+        
+        self.run_save(write, "ЭКГ", "Данные ЭКГ сохранены!")
     
     def save_echo_data(self):
         """Сохранение данных ЭХО-КГ"""
@@ -255,85 +245,47 @@ class MedicalDataManager:
             messagebox.showwarning("Предупреждение", "Сначала сохраните данные пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Создаем таблицу для ЭХО-КГ если её нет
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS echo_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    aorta REAL,
-                    left_atrium REAL,
-                    lv_kdr REAL,
-                    lv_ksr REAL,
-                    tmgp REAL,
-                    tzsgl REAL,
-                    fv REAL,
-                    right_atrium REAL,
-                    rv REAL,
-                    stla REAL,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )
-            ''')
-            
-            # Удаляем старые данные если есть
-            cursor.execute("DELETE FROM echo_data WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            
-            # Получаем данные из полей ввода
-            echo_values = []
-            # Соответствие полей в интерфейсе и базе данных
-            field_mapping = {
-                'aorta_diameter': 'aorta',
-                'la_diameter': 'left_atrium', 
-                'lv_edd': 'lv_kdr',
-                'lv_esd': 'lv_ksr',
-                'ivs_thickness': 'tmgp',
-                'lv_pw_thickness': 'tzsgl',
-                'lv_ef': 'fv',
-                'la_diameter': 'right_atrium',  # Это может быть неправильно, но пока оставим
-                'rv_diameter': 'rv',
-                'pa_systolic_pressure': 'stla'
-            }
-            
-            db_fields = ['aorta', 'left_atrium', 'lv_kdr', 'lv_ksr', 'tmgp',
-                        'tzsgl', 'fv', 'right_atrium', 'rv', 'stla']
-            
-            if hasattr(self.parent_card, 'echo_fields'):
-                for db_field in db_fields:
-                    # Ищем соответствующее поле в интерфейсе
-                    interface_field = None
-                    for interface_name, db_name in field_mapping.items():
-                        if db_name == db_field and interface_name in self.parent_card.echo_fields:
-                            interface_field = interface_name
-                            break
-                    
-                    if interface_field:
-                        try:
-                            value = float(self.parent_card.echo_fields[interface_field].get()) if self.parent_card.echo_fields[interface_field].get().strip() else None
-                            echo_values.append(value)
-                        except ValueError:
-                            echo_values.append(None)
-                    else:
+        # Получаем данные из полей ввода
+        echo_values = []
+        # Соответствие полей в интерфейсе и базе данных
+        field_mapping = {
+            'aorta_diameter': 'aorta',
+            'la_diameter': 'left_atrium', 
+            'lv_edd': 'lv_kdr',
+            'lv_esd': 'lv_ksr',
+            'ivs_thickness': 'tmgp',
+            'lv_pw_thickness': 'tzsgl',
+            'lv_ef': 'fv',
+            'la_diameter': 'right_atrium',  # Это может быть неправильно, но пока оставим
+            'rv_diameter': 'rv',
+            'pa_systolic_pressure': 'stla'
+        }
+        
+        if hasattr(self.parent_card, 'echo_fields'):
+            for db_field in ECHO_FIELDS:
+                # Ищем соответствующее поле в интерфейсе
+                interface_field = None
+                for interface_name, db_name in field_mapping.items():
+                    if db_name == db_field and interface_name in self.parent_card.echo_fields:
+                        interface_field = interface_name
+                        break
+                
+                if interface_field:
+                    try:
+                        value = float(self.parent_card.echo_fields[interface_field].get()) if self.parent_card.echo_fields[interface_field].get().strip() else None
+                        echo_values.append(value)
+                    except ValueError:
                         echo_values.append(None)
-            else:
-                echo_values = [None] * len(db_fields)
-            
+                else:
+                    echo_values.append(None)
+        else:
+            echo_values = [None] * len(ECHO_FIELDS)
+        
+        def write(cursor, patient_id, visit_date):
             # Сохраняем в БД
-            cursor.execute("""
-                INSERT INTO echo_data (
-                    patient_id, aorta, left_atrium, lv_kdr, lv_ksr, tmgp,
-                    tzsgl, fv, right_atrium, rv, stla
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, tuple([self.parent_app.current_patient_id] + echo_values))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Успех", "Данные ЭХО-КГ сохранены!")
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении ЭХО-КГ: {str(e)}")
+            cursor.execute(ECHO_UPSERT, tuple([patient_id, visit_date] + echo_values))
+        
+        self.run_save(write, "ЭХО-КГ", "Данные ЭХО-КГ сохранены!")
     
     def save_anamnesis_data(self):
         """Сохранение данных анамнеза"""
@@ -341,91 +293,35 @@ class MedicalDataManager:
             messagebox.showwarning("Предупреждение", "Сначала сохраните данные пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Удаляем старые данные если есть
-            cursor.execute("DELETE FROM anamnesis WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            
-            # Получаем данные из чекбоксов анамнеза
-            anamnesis_values = []
-            anamnesis_fields = ['weakness', 'fatigue', 'weight_loss', 'pallor', 'temperature', 
-                               'runny_nose', 'sweating', 'cough', 'sputum', 'purulent_sputum',
-                               'bloody_sputum', 'mucous_sputum', 'covid19', 'hemoptysis', 'vomiting',
-                               'headache', 'constipation', 'diarrhea', 'chest_pain',
-                               'blood_in_stool', 'dyspnea']
-            
-            if hasattr(self.parent_card, 'anamnesis_vars'):
-                for field_name in anamnesis_fields:
-                    if field_name in self.parent_card.anamnesis_vars:
-                        anamnesis_values.append(1 if self.parent_card.anamnesis_vars[field_name].get() else 0)
-                    else:
-                        anamnesis_values.append(0)
-            else:
-                anamnesis_values = [0] * len(anamnesis_fields)
-            
-            # Создаем расширенную таблицу анамнеза если нужно
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS anamnesis_extended (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    weakness INTEGER DEFAULT 0,
-                    fatigue INTEGER DEFAULT 0,
-                    weight_loss INTEGER DEFAULT 0,
-                    pallor INTEGER DEFAULT 0,
-                    temperature INTEGER DEFAULT 0,
-                    runny_nose INTEGER DEFAULT 0,
-                    sweating INTEGER DEFAULT 0,
-                    cough INTEGER DEFAULT 0,
-                    sputum INTEGER DEFAULT 0,
-                    purulent_sputum INTEGER DEFAULT 0,
-                    bloody_sputum INTEGER DEFAULT 0,
-                    mucous_sputum INTEGER DEFAULT 0,
-                    covid19 INTEGER DEFAULT 0,
-                    covid_severity TEXT DEFAULT '',
-                    hemoptysis INTEGER DEFAULT 0,
-                    vomiting INTEGER DEFAULT 0,
-                    headache INTEGER DEFAULT 0,
-                    constipation INTEGER DEFAULT 0,
-                    diarrhea INTEGER DEFAULT 0,
-                    chest_pain INTEGER DEFAULT 0,
-                    blood_in_stool INTEGER DEFAULT 0,
-                    dyspnea INTEGER DEFAULT 0,
-                    ad_value TEXT DEFAULT '',
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )
-            ''')
-            
-            # Удаляем старые данные если есть
-            cursor.execute("DELETE FROM anamnesis_extended WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            
-            # Получаем тяжесть COVID-19
-            covid_severity = ""
-            if hasattr(self.parent_card, 'covid_severity_var'):
-                covid_severity = self.parent_card.covid_severity_var.get()
-            
-            # Получаем значение АД
-            ad_value = ""
-            if hasattr(self.parent_card, 'ad_entry'):
-                ad_value = self.parent_card.ad_entry.get()
+        # Получаем данные из чекбоксов анамнеза
+        anamnesis_values = []
+        if hasattr(self.parent_card, 'anamnesis_vars'):
+            for field_name in ANAMNESIS_FIELDS:
+                if field_name in self.parent_card.anamnesis_vars:
+                    anamnesis_values.append(1 if self.parent_card.anamnesis_vars[field_name].get() else 0)
+                else:
+                    anamnesis_values.append(0)
+        else:
+            anamnesis_values = [0] * len(ANAMNESIS_FIELDS)
+        
+        # Получаем тяжесть COVID-19
+        covid_severity = ""
+        if hasattr(self.parent_card, 'covid_severity_var'):
+            covid_severity = self.parent_card.covid_severity_var.get()
+        
+        # Получаем значение АД
+        ad_value = ""
+        if hasattr(self.parent_card, 'ad_entry'):
+            ad_value = self.parent_card.ad_entry.get()
+        
+        def write(cursor, patient_id, visit_date):
+            # Строка старой таблицы анамнеза заменяется расширенной
+            cursor.execute("DELETE FROM anamnesis WHERE patient_id=?", (patient_id,))
             
             # Сохраняем в БД
-            cursor.execute("""
-                INSERT INTO anamnesis_extended (
-                    patient_id, weakness, fatigue, weight_loss, pallor, temperature,
-                    runny_nose, sweating, cough, sputum, purulent_sputum,
-                    bloody_sputum, mucous_sputum, covid19, covid_severity, hemoptysis, vomiting, headache,
-                    constipation, diarrhea, chest_pain, blood_in_stool, dyspnea, ad_value
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, tuple([self.parent_app.current_patient_id] + anamnesis_values + [covid_severity, ad_value]))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Успех", "Данные анамнеза сохранены!")
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении анамнеза: {str(e)}")
+            cursor.execute(ANAMNESIS_UPSERT, tuple([patient_id, visit_date] + anamnesis_values + [covid_severity, ad_value]))
+        
+        self.run_save(write, "анамнеза", "Данные анамнеза сохранены!")
     
     def save_comorbidities_data(self):
         """Сохранение данных коморбидных состояний"""
@@ -433,46 +329,22 @@ class MedicalDataManager:
             messagebox.showwarning("Предупреждение", "Сначала сохраните данные пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Удаляем старые данные если есть
-            cursor.execute("DELETE FROM comorbidities WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            
-            # Получаем данные из чекбоксов коморбидных состояний
-            comorbidities_values = []
-            comorbidities_fields = ['spinal_diseases', 'atherosclerosis', 'gastric_diseases', 'stenosis',
-                                   'thyroid_diseases', 'chronic_heart_failure', 'respiratory_failure',
-                                   'obesity', 'cardiovascular_diseases', 'joint_diseases', 'iht',
-                                   'cerebrovascular_diseases', 'brain_diseases', 'muscle_diseases',
-                                   'pneumonia', 'pathology_stage', 'other_pathologies']
-            
-            if hasattr(self.parent_card, 'comorbidities_vars'):
-                for field_name in comorbidities_fields:
-                    if field_name in self.parent_card.comorbidities_vars:
-                        comorbidities_values.append(1 if self.parent_card.comorbidities_vars[field_name].get() else 0)
-                    else:
-                        comorbidities_values.append(0)
-            else:
-                comorbidities_values = [0] * len(comorbidities_fields)
-            
+        # Получаем данные из чекбоксов коморбидных состояний
+        comorbidities_values = []
+        if hasattr(self.parent_card, 'comorbidities_vars'):
+            for field_name in COMORBIDITIES_FIELDS:
+                if field_name in self.parent_card.comorbidities_vars:
+                    comorbidities_values.append(1 if self.parent_card.comorbidities_vars[field_name].get() else 0)
+                else:
+                    comorbidities_values.append(0)
+        else:
+            comorbidities_values = [0] * len(COMORBIDITIES_FIELDS)
+        
+        def write(cursor, patient_id, visit_date):
             # Сохраняем в БД
-            cursor.execute("""
-                INSERT INTO comorbidities (
-                    patient_id, spinal_diseases, atherosclerosis, gastric_diseases, stenosis,
-                    thyroid_diseases, chronic_heart_failure, respiratory_failure, obesity,
-                    cardiovascular_diseases, joint_diseases, iht, cerebrovascular_diseases,
-                    brain_diseases, muscle_diseases, pneumonia, pathology_stage, other_pathologies
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, tuple([self.parent_app.current_patient_id] + comorbidities_values))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Успех", "Данные коморбидных состояний сохранены!")
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении коморбидных состояний: {str(e)}")
+            cursor.execute(COMORBIDITIES_UPSERT, tuple([patient_id] + comorbidities_values))
+        
+        self.run_save(write, "коморбидных состояний", "Данные коморбидных состояний сохранены!", per_visit=False)
     
     def clear_anamnesis_data(self):
         """Очистка данных анамнеза"""
@@ -497,282 +369,191 @@ class MedicalDataManager:
         
         messagebox.showinfo("Информация", "Данные коморбидных состояний очищены")
     
-    def load_anamnesis_data(self):
+    def run_load(self, mapping, apply, subject, found_message, missing_message, quiet):
+        """Чтение записи пациента в рабочем потоке и заполнение полей вкладки в главном
+
+        quiet=True - загрузка при открытии вкладки: без сообщений о результате.
+        Читается последний визит не позже даты визита в заголовке карты.
+        """
+        patient_id = self.parent_app.current_patient_id
+        visit_date = self.parent_card.get_visit_date(quiet=True)
+        
+        def fetch(task):
+            conn = get_connection()
+            try:
+                return fetch_patient_record(conn, mapping, patient_id, visit_date=visit_date)
+            finally:
+                conn.close()
+        
+        def show(record):
+            if record:
+                apply(record)
+                if not quiet:
+                    messagebox.showinfo("Успех", found_message)
+            elif not quiet:
+                messagebox.showinfo("Информация", missing_message)
+        
+        self.parent_app.task_runner.submit(
+            fetch, f"Загрузка {subject}", on_success=show,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка при загрузке {subject}: {str(e)}"),
+            owner=getattr(self.parent_card, 'notebook', None))
+    
+    def load_anamnesis_data(self, quiet=False):
         """Загрузка данных анамнеза"""
         if not self.parent_app.current_patient_id:
-            messagebox.showwarning("Предупреждение", "Сначала загрузите данные пациента!")
+            if not quiet:
+                messagebox.showwarning("Предупреждение", "Сначала загрузите данные пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Ищем данные в расширенной таблице
-            cursor.execute("SELECT * FROM anamnesis_extended WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            data = cursor.fetchone()
-            
-            if data:
-                # Соответствие колонок полям интерфейса
-                field_mapping = {
-                    2: 'weakness', 3: 'fatigue', 4: 'weight_loss', 5: 'pallor',
-                    6: 'temperature', 7: 'runny_nose', 8: 'sweating', 9: 'cough',
-                    10: 'sputum', 11: 'purulent_sputum', 12: 'bloody_sputum',
-                    13: 'mucous_sputum', 14: 'covid19', 16: 'hemoptysis',
-                    17: 'vomiting', 18: 'headache', 19: 'constipation',
-                    20: 'diarrhea', 21: 'chest_pain', 22: 'blood_in_stool',
-                    23: 'dyspnea'
-                }
-                
-                # Загружаем чекбоксы
-                if hasattr(self.parent_card, 'anamnesis_vars'):
-                    for col_index, field_name in field_mapping.items():
-                        if field_name in self.parent_card.anamnesis_vars:
-                            self.parent_card.anamnesis_vars[field_name].set(bool(data[col_index]))
-                
-                # Загружаем тяжесть COVID-19
-                if hasattr(self.parent_card, 'covid_severity_var') and len(data) > 15:
-                    self.parent_card.covid_severity_var.set(data[15] or "")
-                
-                # Загружаем значение АД
-                if hasattr(self.parent_card, 'ad_entry') and len(data) > 24:
-                    self.parent_card.ad_entry.delete(0, tk.END)
-                    self.parent_card.ad_entry.insert(0, data[24] or "")
-                
-                messagebox.showinfo("Успех", "Данные анамнеза загружены!")
-            else:
-                messagebox.showinfo("Информация", "Данные анамнеза не найдены")
-                
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при загрузке анамнеза: {str(e)}")
+        # Ищем данные в расширенной таблице
+        self.run_load(ANAMNESIS_MAPPING, self.apply_anamnesis_data, "анамнеза",
+                      "Данные анамнеза загружены!", "Данные анамнеза не найдены", quiet)
     
-    def load_comorbidities_data(self):
+    def apply_anamnesis_data(self, data):
+        """Заполнение вкладки анамнеза"""
+        # Загружаем чекбоксы
+        if hasattr(self.parent_card, 'anamnesis_vars'):
+            for field_name in ANAMNESIS_FIELDS:
+                if field_name in self.parent_card.anamnesis_vars:
+                    self.parent_card.anamnesis_vars[field_name].set(bool(getattr(data, field_name)))
+        
+        # Загружаем тяжесть COVID-19
+        if hasattr(self.parent_card, 'covid_severity_var'):
+            self.parent_card.covid_severity_var.set(data.covid_severity or "")
+        
+        # Загружаем значение АД
+        if hasattr(self.parent_card, 'ad_entry'):
+            self.parent_card.ad_entry.delete(0, tk.END)
+            self.parent_card.ad_entry.insert(0, data.ad_value or "")
+    
+    def load_comorbidities_data(self, quiet=False):
         """Загрузка данных коморбидных состояний"""
         if not self.parent_app.current_patient_id:
-            messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
+            if not quiet:
+                messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM comorbidities WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            comorbidities_data = cursor.fetchone()
-            
-            if comorbidities_data:
-                comorbidities_fields = ['spinal_diseases', 'atherosclerosis', 'gastric_diseases', 'stenosis',
-                                       'thyroid_diseases', 'chronic_heart_failure', 'respiratory_failure',
-                                       'obesity', 'cardiovascular_diseases', 'joint_diseases', 'iht',
-                                       'cerebrovascular_diseases', 'brain_diseases', 'muscle_diseases',
-                                       'pneumonia', 'pathology_stage', 'other_pathologies']
-                
-                if hasattr(self.parent_card, 'comorbidities_vars'):
-                    for i, field_name in enumerate(comorbidities_fields):
-                        if field_name in self.parent_card.comorbidities_vars:
-                            self.parent_card.comorbidities_vars[field_name].set(bool(comorbidities_data[i+2]))
-                
-                messagebox.showinfo("Успех", "Данные коморбидных состояний загружены!")
-            else:
-                messagebox.showinfo("Информация", "Коморбидные состояния для данного пациента не найдены")
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при загрузке коморбидных состояний: {str(e)}")
+        self.run_load(COMORBIDITIES_MAPPING, self.apply_comorbidities_data, "коморбидных состояний",
+                      "Данные коморбидных состояний загружены!",
+                      "Коморбидные состояния для данного пациента не найдены", quiet)
+    
+    def apply_comorbidities_data(self, comorbidities_data):
+        """Заполнение вкладки коморбидных состояний"""
+        if hasattr(self.parent_card, 'comorbidities_vars'):
+            for field_name in COMORBIDITIES_FIELDS:
+                if field_name in self.parent_card.comorbidities_vars:
+                    self.parent_card.comorbidities_vars[field_name].set(bool(getattr(comorbidities_data, field_name)))
     
-    def load_blood_test_data(self):
+    def load_blood_test_data(self, quiet=False):
         """Загрузка данных анализов крови"""
         if not self.parent_app.current_patient_id:
-            messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
+            if not quiet:
+                messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Пробуем загрузить из расширенной таблицы
-            cursor.execute("SELECT * FROM blood_tests_extended WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            blood_data = cursor.fetchone()
-            
-            if blood_data:
-                # Загружаем основные числовые поля
-                basic_fields = ['erythrocytes', 'leukocytes', 'hemoglobin', 'soe', 'lymphocytes']
-                if hasattr(self.parent_card, 'blood_entries'):
-                    for i, field_name in enumerate(basic_fields):
-                        if field_name in self.parent_card.blood_entries:
-                            value = blood_data[i+2] if blood_data[i+2] is not None else ""
-                            self.parent_card.blood_entries[field_name].delete(0, tk.END)
-                            self.parent_card.blood_entries[field_name].insert(0, str(value))
-                
-                # Загружаем чекбоксы
-                blood_checkboxes = ['srb_normal', 'srb_elevated', 'd_dimer_normal', 'd_dimer_elevated', 
-                                   'thrombocytes_normal', 'thrombocytes_low']
-                if hasattr(self.parent_card, 'blood_test_vars'):
-                    for i, field_name in enumerate(blood_checkboxes):
-                        if field_name in self.parent_card.blood_test_vars:
-                            self.parent_card.blood_test_vars[field_name].set(bool(blood_data[i+7]))
-                
-                # Загружаем дополнительные поля со значениями
-                additional_value_fields = ['srb_normal_value', 'srb_elevated_value', 'd_dimer_normal_value',
-                                         'd_dimer_elevated_value', 'thrombocytes_normal_value', 'thrombocytes_low_value']
-                if hasattr(self.parent_card, 'blood_entries'):
-                    for i, field_name in enumerate(additional_value_fields):
-                        if field_name in self.parent_card.blood_entries:
-                            value = blood_data[i+13] if len(blood_data) > i+13 and blood_data[i+13] is not None else ""
-                            self.parent_card.blood_entries[field_name].delete(0, tk.END)
-                            self.parent_card.blood_entries[field_name].insert(0, str(value))
-                
-                messagebox.showinfo("Успех", "Данные анализов крови загружены!")
-            else:
-                messagebox.showinfo("Информация", "Анализы крови для данного пациента не найдены")
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при загрузке анализов крови: {str(e)}")
+        # Пробуем загрузить из расширенной таблицы
+        self.run_load(BLOOD_TESTS_MAPPING, self.apply_blood_test_data, "анализов крови",
+                      "Данные анализов крови загружены!",
+                      "Анализы крови для данного пациента не найдены", quiet)
     
-    def load_urine_test_data(self):
+    def apply_blood_test_data(self, blood_data):
+        """Заполнение вкладки анализов крови"""
+        # Загружаем числовые поля, включая дополнительные поля со значениями
+        if hasattr(self.parent_card, 'blood_entries'):
+            for field_name in BLOOD_VALUE_FIELDS + BLOOD_ADDITIONAL_VALUE_FIELDS:
+                if field_name in self.parent_card.blood_entries:
+                    value = getattr(blood_data, field_name)
+                    self.parent_card.blood_entries[field_name].delete(0, tk.END)
+                    self.parent_card.blood_entries[field_name].insert(0, str(value if value is not None else ""))
+        
+        # Загружаем чекбоксы
+        if hasattr(self.parent_card, 'blood_test_vars'):
+            for field_name in BLOOD_CHECKBOX_FIELDS:
+                if field_name in self.parent_card.blood_test_vars:
+                    self.parent_card.blood_test_vars[field_name].set(bool(getattr(blood_data, field_name)))
+    
+    def load_urine_test_data(self, quiet=False):
         """Загрузка данных анализов мочи"""
         if not self.parent_app.current_patient_id:
-            messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
+            if not quiet:
+                messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM urine_tests_new WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            urine_data = cursor.fetchone()
-            
-            if urine_data:
-                # Загружаем данные из выпадающих списков
-                if hasattr(self.parent_card, 'urine_combos'):
-                    # transparency, color, status находятся в позициях 2, 3, 4
-                    transparency = urine_data[2] if urine_data[2] else 'Не выбрано'
-                    color = urine_data[3] if urine_data[3] else 'Не выбрано'
-                    status = urine_data[4] if urine_data[4] else 'Проведен'
-                    
-                    self.parent_card.urine_combos['transparency'].set(transparency)
-                    self.parent_card.urine_combos['color'].set(color)
-                    self.parent_card.urine_combos['status'].set(status)
-                
-                # Загружаем числовые поля
-                if hasattr(self.parent_card, 'protein_entry'):
-                    protein_value = urine_data[5] if urine_data[5] is not None else ""
-                    self.parent_card.protein_entry.delete(0, tk.END)
-                    self.parent_card.protein_entry.insert(0, str(protein_value))
-                
-                if hasattr(self.parent_card, 'leukocytes_urine_entry'):
-                    leukocytes_value = urine_data[6] if urine_data[6] is not None else ""
-                    self.parent_card.leukocytes_urine_entry.delete(0, tk.END)
-                    self.parent_card.leukocytes_urine_entry.insert(0, str(leukocytes_value))
-                
-                messagebox.showinfo("Успех", "Данные анализов мочи загружены!")
-            else:
-                messagebox.showinfo("Информация", "Анализы мочи для данного пациента не найдены")
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при загрузке анализов мочи: {str(e)}")
+        self.run_load(URINE_TESTS_MAPPING, self.apply_urine_test_data, "анализов мочи",
+                      "Данные анализов мочи загружены!",
+                      "Анализы мочи для данного пациента не найдены", quiet)
+    
+    def apply_urine_test_data(self, urine_data):
+        """Заполнение вкладки анализов мочи"""
+        # Загружаем данные из выпадающих списков
+        if hasattr(self.parent_card, 'urine_combos'):
+            self.parent_card.urine_combos['transparency'].set(urine_data.transparency or 'Не выбрано')
+            self.parent_card.urine_combos['color'].set(urine_data.color or 'Не выбрано')
+            self.parent_card.urine_combos['status'].set(urine_data.status or 'Проведен')
+        
+        # Загружаем числовые поля
+        if hasattr(self.parent_card, 'protein_entry'):
+            protein_value = urine_data.protein_value if urine_data.protein_value is not None else ""
+            self.parent_card.protein_entry.delete(0, tk.END)
+            self.parent_card.protein_entry.insert(0, str(protein_value))
+        
+        if hasattr(self.parent_card, 'leukocytes_urine_entry'):
+            leukocytes_value = urine_data.leukocytes_value if urine_data.leukocytes_value is not None else ""
+            self.parent_card.leukocytes_urine_entry.delete(0, tk.END)
+            self.parent_card.leukocytes_urine_entry.insert(0, str(leukocytes_value))
     
-    def load_ecg_data(self):
+    def load_ecg_data(self, quiet=False):
         """Загрузка данных ЭКГ"""
         if not self.parent_app.current_patient_id:
-            messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
+            if not quiet:
+                messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM ecg_data WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            ecg_data = cursor.fetchone()
-            
-            if ecg_data:
-                # Загружаем чекбоксы ЭКГ (без пульса)
-                ecg_checkbox_fields = ['g1_deviation', 'g2_lzh_deviation', 'g3_deviation', 'g3_lzh_deviation',
-                                      'g6_lzh_deviation', 'g7_deviation', 'g9_deviation',
-                                      'qrs_deviation', 'qt_deviation', 'pq_deviation', 'p_deviation',
-                                      't_normal', 'bcp_deviation']
-                
-                if hasattr(self.parent_card, 'ecg_vars'):
-                    # Загружаем первые 7 чекбоксов
-                    for i in range(7):
-                        if i < len(ecg_checkbox_fields) and ecg_checkbox_fields[i] in self.parent_card.ecg_vars:
-                            self.parent_card.ecg_vars[ecg_checkbox_fields[i]].set(bool(ecg_data[i+2]))
-                    
-                    # Пропускаем поле пульса (индекс 8) и загружаем остальные чекбоксы
-                    for i in range(7, len(ecg_checkbox_fields)):
-                        if ecg_checkbox_fields[i] in self.parent_card.ecg_vars:
-                            self.parent_card.ecg_vars[ecg_checkbox_fields[i]].set(bool(ecg_data[i+3]))  # +3 потому что пропускаем пульс
-                
-                # Загружаем значение пульса
-                if hasattr(self.parent_card, 'pulse_entry'):
-                    pulse_value = ecg_data[9] if len(ecg_data) > 9 and ecg_data[9] is not None else ""  # пульс в позиции 9
-                    self.parent_card.pulse_entry.delete(0, tk.END)
-                    self.parent_card.pulse_entry.insert(0, str(pulse_value))
-                
-                messagebox.showinfo("Успех", "Данные ЭКГ загружены!")
-            else:
-                messagebox.showinfo("Информация", "Данные ЭКГ для данного пациента не найдены")
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при загрузке данных ЭКГ: {str(e)}")
+        self.run_load(ECG_MAPPING, self.apply_ecg_data, "данных ЭКГ", "Данные ЭКГ загружены!",
+                      "Данные ЭКГ для данного пациента не найдены", quiet)
+    
+    def apply_ecg_data(self, ecg_data):
+        """Заполнение вкладки ЭКГ"""
+        # Загружаем чекбоксы ЭКГ (без пульса)
+        if hasattr(self.parent_card, 'ecg_vars'):
+            for field_name in ECG_CHECKBOX_FIELDS:
+                if field_name in self.parent_card.ecg_vars:
+                    self.parent_card.ecg_vars[field_name].set(bool(getattr(ecg_data, field_name)))
+        
+        # Загружаем значение пульса
+        if hasattr(self.parent_card, 'pulse_entry'):
+            pulse_value = ecg_data.pulse if ecg_data.pulse is not None else ""
+            self.parent_card.pulse_entry.delete(0, tk.END)
+            self.parent_card.pulse_entry.insert(0, str(pulse_value))
     
-    def load_echo_data(self):
+    def load_echo_data(self, quiet=False):
         """Загрузка данных ЭХО-КГ"""
         if not self.parent_app.current_patient_id:
-            messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
+            if not quiet:
+                messagebox.showwarning("Предупреждение", "Сначала выберите пациента!")
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM echo_data WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            echo_data = cursor.fetchone()
-            
-            if echo_data:
-                # Загружаем поля ЭХО-КГ
-                field_mapping = {
-                    'aorta_diameter': 'aorta',
-                    'la_diameter': 'left_atrium', 
-                    'lv_edd': 'lv_kdr',
-                    'lv_esd': 'lv_ksr',
-                    'ivs_thickness': 'tmgp',
-                    'lv_pw_thickness': 'tzsgl',
-                    'lv_ef': 'fv',
-                    'la_diameter': 'right_atrium',
-                    'rv_diameter': 'rv',
-                    'pa_systolic_pressure': 'stla'
-                }
-                
-                db_fields = ['aorta', 'left_atrium', 'lv_kdr', 'lv_ksr', 'tmgp',
-                            'tzsgl', 'fv', 'right_atrium', 'rv', 'stla']
-                
-                if hasattr(self.parent_card, 'echo_fields'):
-                    for i, db_field in enumerate(db_fields):
-                        # Ищем соответствующее поле в интерфейсе
-                        interface_field = None
-                        for interface_name, db_name in field_mapping.items():
-                            if db_name == db_field and interface_name in self.parent_card.echo_fields:
-                                interface_field = interface_name
-                                break
-                        
-                        if interface_field:
-                            value = echo_data[i+2] if echo_data[i+2] is not None else ""
-                            self.parent_card.echo_fields[interface_field].delete(0, tk.END)
-                            self.parent_card.echo_fields[interface_field].insert(0, str(value))
-                
-                messagebox.showinfo("Успех", "Данные ЭХО-КГ загружены!")
-            else:
-                messagebox.showinfo("Информация", "Данные ЭХО-КГ для данного пациента не найдены")
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при загрузке данных ЭХО-КГ: {str(e)}")
\ No newline at end of file
+        self.run_load(ECHO_MAPPING, self.apply_echo_data, "данных ЭХО-КГ", "Данные ЭХО-КГ загружены!",
+                      "Данные ЭХО-КГ для данного пациента не найдены", quiet)
+    
+    def apply_echo_data(self, echo_data):
+        """Заполнение вкладки ЭХО-КГ"""
+        field_mapping = {
+            'aorta_diameter': 'aorta',
+            'la_diameter': 'left_atrium', 
+            'lv_edd': 'lv_kdr',
+            'lv_esd': 'lv_ksr',
+            'ivs_thickness': 'tmgp',
+            'lv_pw_thickness': 'tzsgl',
+            'lv_ef': 'fv',
+            'la_diameter': 'right_atrium',
+            'rv_diameter': 'rv',
+            'pa_systolic_pressure': 'stla'
+        }
+        
+        if hasattr(self.parent_card, 'echo_fields'):
+            for interface_field, db_field in field_mapping.items():
+                if interface_field in self.parent_card.echo_fields:
+                    value = getattr(echo_data, db_field)
+                    self.parent_card.echo_fields[interface_field].delete(0, tk.END)
+                    self.parent_card.echo_fields[interface_field].insert(0, str(value if value is not None else ""))
\ No newline at end of file
@@ -0,0 +1,539 @@
+import sqlite3
+import sys
+
+# Таблицы, хранящие данные пациента по столбцу patient_id
+PATIENT_TABLES = [
+    'anamnesis', 'anamnesis_extended', 'comorbidities',
+    'blood_tests', 'blood_tests_extended', 'urine_tests', 'urine_tests_new',
+    'ecg_data', 'echo_data'
+]
+
+# Версия 1: базовая схема (ранее создавалась в init_database и в методах сохранения)
+BASE_SCHEMA = [
+    # Таблица пациентов
+    '''
+    CREATE TABLE IF NOT EXISTS patients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        card_number TEXT UNIQUE,
+        policy_number TEXT,
+        surname TEXT,
+        name TEXT,
+        patronymic TEXT,
+        birth_date TEXT,
+        gender TEXT,
+        address TEXT,
+        phone TEXT,
+        passport TEXT,
+        series TEXT,
+        number TEXT,
+        issued_by TEXT,
+        snils TEXT,
+        workplace TEXT,
+        disability_group TEXT,
+        blood_group TEXT,
+        created_date TEXT
+    )
+    ''',
+    # Таблица анамнеза
+    '''
+    CREATE TABLE IF NOT EXISTS anamnesis (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        covid19 INTEGER DEFAULT 0,
+        severity INTEGER DEFAULT 0,
+        fatigue INTEGER DEFAULT 0,
+        glucose INTEGER DEFAULT 0,
+        creatinine INTEGER DEFAULT 0,
+        hemoglobin INTEGER DEFAULT 0,
+        erythrocytes INTEGER DEFAULT 0,
+        thrombocytes INTEGER DEFAULT 0,
+        leukocytes INTEGER DEFAULT 0,
+        soe INTEGER DEFAULT 0,
+        alat INTEGER DEFAULT 0,
+        asat INTEGER DEFAULT 0,
+        urea INTEGER DEFAULT 0,
+        srb INTEGER DEFAULT 0,
+        total_protein INTEGER DEFAULT 0,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Таблица коморбидных состояний
+    '''
+    CREATE TABLE IF NOT EXISTS comorbidities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        spinal_diseases INTEGER DEFAULT 0,
+        atherosclerosis INTEGER DEFAULT 0,
+        gastric_diseases INTEGER DEFAULT 0,
+        stenosis INTEGER DEFAULT 0,
+        thyroid_diseases INTEGER DEFAULT 0,
+        chronic_heart_failure INTEGER DEFAULT 0,
+        respiratory_failure INTEGER DEFAULT 0,
+        obesity INTEGER DEFAULT 0,
+        cardiovascular_diseases INTEGER DEFAULT 0,
+        joint_diseases INTEGER DEFAULT 0,
+        iht INTEGER DEFAULT 0,
+        cerebrovascular_diseases INTEGER DEFAULT 0,
+        brain_diseases INTEGER DEFAULT 0,
+        muscle_diseases INTEGER DEFAULT 0,
+        pneumonia INTEGER DEFAULT 0,
+        pathology_stage INTEGER DEFAULT 0,
+        other_pathologies INTEGER DEFAULT 0,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Таблица анализов крови
+    '''
+    CREATE TABLE IF NOT EXISTS blood_tests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        erythrocytes REAL,
+        leukocytes REAL,
+        hemoglobin REAL,
+        soe REAL,
+        lymphocytes REAL,
+        srb_normal INTEGER DEFAULT 0,
+        srb_elevated INTEGER DEFAULT 0,
+        d_dimer_normal INTEGER DEFAULT 0,
+        d_dimer_elevated INTEGER DEFAULT 0,
+        thrombocytes_normal INTEGER DEFAULT 0,
+        thrombocytes_low INTEGER DEFAULT 0,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Таблица анализов мочи
+    '''
+    CREATE TABLE IF NOT EXISTS urine_tests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        analysis_not_performed INTEGER DEFAULT 0,
+        transparent_urine INTEGER DEFAULT 0,
+        cloudy_urine INTEGER DEFAULT 0,
+        light_yellow_urine INTEGER DEFAULT 0,
+        dark_yellow_urine INTEGER DEFAULT 0,
+        protein_presence REAL,
+        leukocytes_presence REAL,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Таблица ЭКГ
+    '''
+    CREATE TABLE IF NOT EXISTS ecg_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        g1_deviation INTEGER DEFAULT 0,
+        g2_lzh_deviation INTEGER DEFAULT 0,
+        g3_deviation INTEGER DEFAULT 0,
+        g3_lzh_deviation INTEGER DEFAULT 0,
+        g6_lzh_deviation INTEGER DEFAULT 0,
+        g7_deviation INTEGER DEFAULT 0,
+        g9_deviation INTEGER DEFAULT 0,
+        pulse INTEGER DEFAULT 0,
+        qrs_deviation INTEGER DEFAULT 0,
+        qt_deviation INTEGER DEFAULT 0,
+        pq_deviation INTEGER DEFAULT 0,
+        p_deviation INTEGER DEFAULT 0,
+        t_normal INTEGER DEFAULT 0,
+        bcp_deviation INTEGER DEFAULT 0,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Таблица ЭХО-КГ
+    '''
+    CREATE TABLE IF NOT EXISTS echo_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        aorta REAL,
+        left_atrium REAL,
+        lv_kdr REAL,
+        lv_ksr REAL,
+        tmgp REAL,
+        tzsgl REAL,
+        fv REAL,
+        right_atrium REAL,
+        rv REAL,
+        stla REAL,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Расширенная таблица анамнеза
+    '''
+    CREATE TABLE IF NOT EXISTS anamnesis_extended (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        weakness INTEGER DEFAULT 0,
+        fatigue INTEGER DEFAULT 0,
+        weight_loss INTEGER DEFAULT 0,
+        pallor INTEGER DEFAULT 0,
+        temperature INTEGER DEFAULT 0,
+        runny_nose INTEGER DEFAULT 0,
+        sweating INTEGER DEFAULT 0,
+        cough INTEGER DEFAULT 0,
+        sputum INTEGER DEFAULT 0,
+        purulent_sputum INTEGER DEFAULT 0,
+        bloody_sputum INTEGER DEFAULT 0,
+        mucous_sputum INTEGER DEFAULT 0,
+        covid19 INTEGER DEFAULT 0,
+        covid_severity TEXT DEFAULT '',
+        hemoptysis INTEGER DEFAULT 0,
+        vomiting INTEGER DEFAULT 0,
+        headache INTEGER DEFAULT 0,
+        constipation INTEGER DEFAULT 0,
+        diarrhea INTEGER DEFAULT 0,
+        chest_pain INTEGER DEFAULT 0,
+        blood_in_stool INTEGER DEFAULT 0,
+        dyspnea INTEGER DEFAULT 0,
+        ad_value TEXT DEFAULT '',
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Расширенная таблица анализов крови
+    '''
+    CREATE TABLE IF NOT EXISTS blood_tests_extended (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        erythrocytes REAL,
+        leukocytes REAL,
+        hemoglobin REAL,
+        soe REAL,
+        lymphocytes REAL,
+        srb_normal INTEGER DEFAULT 0,
+        srb_elevated INTEGER DEFAULT 0,
+        d_dimer_normal INTEGER DEFAULT 0,
+        d_dimer_elevated INTEGER DEFAULT 0,
+        thrombocytes_normal INTEGER DEFAULT 0,
+        thrombocytes_low INTEGER DEFAULT 0,
+        srb_normal_value REAL,
+        srb_elevated_value REAL,
+        d_dimer_normal_value REAL,
+        d_dimer_elevated_value REAL,
+        thrombocytes_normal_value REAL,
+        thrombocytes_low_value REAL,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''',
+    # Обновленная таблица анализов мочи
+    '''
+    CREATE TABLE IF NOT EXISTS urine_tests_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        transparency TEXT,
+        color TEXT,
+        status TEXT,
+        protein_value REAL,
+        leukocytes_value REAL,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    '''
+]
+
+# Версия 2: индексы по patient_id. Индекс SQLite неявно содержит rowid (id),
+# поэтому поиск записей, MIN(id) и COUNT(*) по пациенту выполняются только по индексу
+PATIENT_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS idx_{table}_patient_id ON {table} (patient_id)"
+    for table in PATIENT_TABLES
+]
+
+
+def add_column_if_missing(table, column, definition):
+    """Шаг миграции: добавление столбца без пересоздания таблицы и потери данных"""
+    def step(conn):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+# Версия 3: столбец АД в anamnesis_extended. Раньше init_database удалял таблицу
+# при каждом запуске и создавал ее заново без этого столбца
+ANAMNESIS_AD_VALUE = [
+    add_column_if_missing('anamnesis_extended', 'ad_value', "TEXT DEFAULT ''")
+]
+
+# Таблицы, от которых зависит прогноз рисков: изменение любой из них делает
+# сохраненный прогноз пациента устаревшим
+PREDICTION_INPUT_TABLES = ['anamnesis_extended', 'comorbidities', 'blood_tests', 'blood_tests_extended']
+
+
+def data_version_trigger_name(table, event):
+    """Имя триггера версии данных для таблицы и события"""
+    return f"trg_{table}_{event.split()[0].lower()}_data_version"
+
+
+def data_version_trigger(table, event, row, key='patient_id'):
+    """Триггер, увеличивающий версию входных данных прогноза пациента"""
+    # Строка версии создается через NOT EXISTS, а не INSERT OR IGNORE: внутри
+    # триггера, вызванного INSERT ... ON CONFLICT, действует обработка
+    # конфликтов внешнего оператора, и OR IGNORE не сработал бы
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS {data_version_trigger_name(table, event)}
+    AFTER {event} ON {table}
+    BEGIN
+        INSERT INTO patient_data_versions (patient_id, data_version)
+        SELECT {row}.{key}, 0
+        WHERE NOT EXISTS (SELECT 1 FROM patient_data_versions WHERE patient_id = {row}.{key});
+        UPDATE patient_data_versions SET data_version = data_version + 1 WHERE patient_id = {row}.{key};
+    END
+    '''
+
+
+# Триггеры версии данных: (таблица, событие, строка, столбец id пациента).
+# Из данных карты пациента прогноз зависит только от даты рождения
+DATA_VERSION_TRIGGERS = ([(table, event, row, 'patient_id')
+                          for table in PREDICTION_INPUT_TABLES
+                          for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))] +
+                         [('patients', 'UPDATE OF birth_date', 'NEW', 'id')])
+
+
+# Версия 4: сохраненные прогнозы. Версия данных пациента увеличивается
+# триггерами, поэтому устаревший прогноз определяется без чтения самих данных
+PREDICTIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS patient_data_versions (
+        patient_id INTEGER PRIMARY KEY,
+        data_version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS predictions (
+        patient_id INTEGER NOT NULL,
+        model_version TEXT NOT NULL,
+        data_version INTEGER NOT NULL,
+        risks TEXT NOT NULL,
+        factors INTEGER NOT NULL DEFAULT 0,
+        created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (patient_id, model_version)
+    )
+    ''',
+    *[data_version_trigger(*spec) for spec in DATA_VERSION_TRIGGERS],
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_patients_delete_predictions
+    AFTER DELETE ON patients
+    BEGIN
+        DELETE FROM predictions WHERE patient_id = OLD.id;
+        DELETE FROM patient_data_versions WHERE patient_id = OLD.id;
+    END
+    '''
+]
+
+# Версия 5: маска факторов, предположенных без данных пациента
+PREDICTION_IMPUTED = [
+    add_column_if_missing('predictions', 'imputed', "INTEGER NOT NULL DEFAULT 0")
+]
+
+# Столбцы карты пациента, по которым ищет выбор пациента
+PATIENT_SEARCH_COLUMNS = ['surname', 'name', 'patronymic', 'card_number', 'policy_number', 'snils']
+
+
+def create_patient_search_index(conn):
+    """Полнотекстовый индекс FTS5 по ФИО и номерам документов пациента
+
+    Индекс хранит только словарь (content='patients'), сами значения читаются
+    из patients. Если SQLite собран без FTS5, шаг пропускается: поиск
+    пациентов тогда работает через LIKE.
+    """
+    columns = ', '.join(PATIENT_SEARCH_COLUMNS)
+    new_values = ', '.join(f'NEW.{column}' for column in PATIENT_SEARCH_COLUMNS)
+    old_values = ', '.join(f'OLD.{column}' for column in PATIENT_SEARCH_COLUMNS)
+    try:
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+                {columns}, content='patients', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        if 'fts5' not in str(e):
+            raise
+        return
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_insert
+        AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO patients_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_delete
+        AFTER DELETE ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+        END
+    """)
+    # Изменение других полей карты (адрес, телефон) индекс не трогает
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_update
+        AFTER UPDATE OF id, {columns} ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+            INSERT INTO patients_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+    """)
+    # Индекс по уже существующим пациентам
+    conn.execute("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')")
+
+
+# Версия 6: поиск пациентов по ФИО, номеру карты, полиса и СНИЛС
+PATIENT_SEARCH = [create_patient_search_index]
+
+def unique_patient_rows(conn):
+    """Не более одной строки на пациента в медицинских таблицах
+
+    Повторы, оставшиеся от старых версий программы, удаляются: методы
+    загрузки всегда показывали первую строку пациента, она и сохраняется.
+    Удаляемые строки копируются в таблицу <таблица>_removed_duplicates,
+    их число выводится в stderr. Неуникальный индекс по patient_id
+    заменяется уникальным, который служит и для поиска, и ключом
+    конфликта INSERT ... ON CONFLICT.
+    """
+    for table in PATIENT_TABLES:
+        duplicates = f"""
+            FROM {table}
+            WHERE patient_id IS NOT NULL
+              AND id > (SELECT MIN(d.id) FROM {table} d WHERE d.patient_id = {table}.patient_id)
+        """
+        count = conn.execute(f"SELECT COUNT(*) {duplicates}").fetchone()[0]
+        if count:
+            archive = f"{table}_removed_duplicates"
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {archive} AS SELECT * FROM {table} WHERE 0")
+            conn.execute(f"INSERT INTO {archive} SELECT * {duplicates}")
+            conn.execute(f"DELETE {duplicates}")
+            print(f"Миграция 7: из {table} удалено повторных строк: {count} (копии - в {archive})",
+                  file=sys.stderr)
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table}_patient_id")
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_patient_id ON {table} (patient_id)")
+
+
+def recreate_data_version_triggers(conn):
+    """Пересоздание триггеров версии данных, созданных версией 4 с INSERT OR IGNORE"""
+    for table, event, row, key in DATA_VERSION_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {data_version_trigger_name(table, event)}")
+        conn.execute(data_version_trigger(table, event, row, key))
+
+
+# Версия 7: одна строка медицинских данных на пациента; сохранение обновляет
+# строку на месте вместо DELETE и нового INSERT
+UNIQUE_PATIENT_ROWS = [unique_patient_rows, recreate_data_version_triggers]
+
+
+# Версия 8: поиск повторно заведенного пациента по СНИЛС (номер карты уже
+# уникален). Пустые значения хранятся как NULL и повтором не считаются
+PATIENT_SNILS_INDEX = [
+    "UPDATE patients SET card_number = NULL WHERE card_number = ''",
+    "UPDATE patients SET snils = NULL WHERE snils = ''",
+    "CREATE INDEX IF NOT EXISTS idx_patients_snils ON patients (snils)"
+]
+
+
+# Таблицы измерений, которые хранят историю визитов: строка на пациента и дату визита.
+# Коморбидные состояния и старая таблица анамнеза остаются одной строкой на пациента
+VISIT_TABLES = [
+    'anamnesis_extended', 'blood_tests', 'blood_tests_extended', 'urine_tests', 'urine_tests_new',
+    'ecg_data', 'echo_data'
+]
+
+
+def add_visit_dates(conn):
+    """Дата визита в таблицах измерений и уникальный индекс (patient_id, visit_date)
+
+    Уже сохраненным строкам назначается дата заведения карты пациента
+    (или текущая дата, если она не указана). Индекс отдает последний визит
+    пациента и визиты за период без чтения остальной истории.
+    """
+    for table in VISIT_TABLES:
+        add_column_if_missing(table, 'visit_date', 'TEXT')(conn)
+        conn.execute(f"""
+            UPDATE {table} SET visit_date = COALESCE(
+                (SELECT date(NULLIF(p.created_date, '')) FROM patients p WHERE p.id = {table}.patient_id),
+                date('now', 'localtime'))
+            WHERE visit_date IS NULL
+        """)
+        conn.execute(f"DROP INDEX IF EXISTS ux_{table}_patient_id")
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_visit ON {table} (patient_id, visit_date)")
+
+
+# Версия 9: история визитов в таблицах измерений
+VISIT_HISTORY = [add_visit_dates]
+
+# Версия 10: реестр обученных моделей. Артефакты лежат на диске (path -
+# каталог относительно каталога моделей), активная версия одна на базу
+MODEL_REGISTRY = [
+    '''
+    CREATE TABLE IF NOT EXISTS model_versions (
+        version TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        description TEXT,
+        active INTEGER NOT NULL DEFAULT 0,
+        created_date TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_model_versions_active ON model_versions (active) WHERE active = 1"
+]
+
+
+def upsert_sql(table, key_columns, columns):
+    """INSERT, обновляющий существующую строку с тем же ключом (ключ - уникальный индекс таблицы)
+
+    Параметры запроса: значения key_columns, затем columns.
+    """
+    insert_columns = list(key_columns) + list(columns)
+    return (f"INSERT INTO {table} ({', '.join(insert_columns)}) "
+            f"VALUES ({', '.join('?' for _ in insert_columns)}) "
+            f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET "
+            + ', '.join(f"{column} = excluded.{column}" for column in columns))
+
+
+# Список миграций: (номер версии, описание, шаги). Шаг - SQL-оператор или
+# функция от соединения. Номер версии хранится в PRAGMA user_version;
+# новые миграции добавляются только в конец
+MIGRATIONS = [
+    (1, "Базовая схема", BASE_SCHEMA),
+    (2, "Индексы по patient_id", PATIENT_INDEXES),
+    (3, "Столбец АД в расширенном анамнезе", ANAMNESIS_AD_VALUE),
+    (4, "Сохраненные прогнозы и версии данных пациентов", PREDICTIONS),
+    (5, "Отметка предположенных факторов в прогнозах", PREDICTION_IMPUTED),
+    (6, "Полнотекстовый поиск пациентов", PATIENT_SEARCH),
+    (7, "Одна строка медицинских данных на пациента", UNIQUE_PATIENT_ROWS),
+    (8, "Индекс по СНИЛС пациента", PATIENT_SNILS_INDEX),
+    (9, "История визитов в таблицах измерений", VISIT_HISTORY),
+    (10, "Реестр версий обученных моделей", MODEL_REGISTRY)
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Текущая версия схемы базы данных"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Применение только тех миграций, которых еще нет в базе данных"""
+    # Быстрый путь запуска: актуальная схема проверяется одним чтением
+    # заголовка базы, без DDL и без транзакции на запись
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return []
+
+    # Блокировка на запись берется сразу, а версия перечитывается под ней:
+    # если две рабочие станции стартуют одновременно, миграции применит одна
+    conn.execute("BEGIN IMMEDIATE")
+    applied = []
+    try:
+        version = get_schema_version(conn)
+        for number, description, steps in MIGRATIONS:
+            if number <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {number}")
+            applied.append((number, description))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+    return applied
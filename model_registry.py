@@ -0,0 +1,194 @@
+"""Реестр версий обученных моделей: артефакты на диске, активная версия в базе
+
+Пример запуска:
+    python3 model_registry.py list
+    python3 model_registry.py register model.npz --description "обучение за март" --activate
+    python3 model_registry.py activate nn-trained-mlp16-384dc003
+    python3 model_registry.py activate builtin
+
+Артефакт версии - каталог с массивами .npy (trained_model.save_artifact),
+которые при загрузке отображаются в память. Каталог публикуется под именем
+версии переименованием, поэтому читатели не видят его частично. Активная
+версия хранится в таблице model_versions: программа и пакетный прогноз
+сверяются с ней перед расчетом и переключаются на новую модель без
+перезапуска (NeuralNetworkPredictor.set_model).
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+
+from database import configure, get_connection, get_db_path
+from migrations import migrate
+from trained_model import TrainedModel
+
+# Каталог артефактов; по умолчанию - каталог models рядом с файлом базы
+MODELS_DIR_ENV = 'MEDICAL_MODELS_DIR'
+
+# Имя версии в командной строке для расчета по весам сетей
+BUILTIN_VERSION = 'builtin'
+
+
+def default_models_dir():
+    """Каталог артефактов моделей для текущей базы"""
+    return os.environ.get(MODELS_DIR_ENV) or os.path.join(os.path.dirname(os.path.abspath(get_db_path())), 'models')
+
+
+class ModelRegistry:
+    """Версии моделей в таблице model_versions и загруженные (отображенные в память) модели процесса"""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        # Загруженные модели по версиям: повторная активация версии не читает файлы
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get_directory(self):
+        """Каталог артефактов; база может быть выбрана после создания реестра"""
+        return self.directory or default_models_dir()
+
+    def list_versions(self, conn):
+        """Зарегистрированные версии: [(версия, описание, дата, активна)] от новых к старым"""
+        return conn.execute("SELECT version, description, created_date, active FROM model_versions "
+                            "ORDER BY created_date DESC, version").fetchall()
+
+    def active_version(self, conn):
+        """Активная версия или None (расчет по весам сетей)"""
+        row = conn.execute("SELECT version FROM model_versions WHERE active = 1").fetchone()
+        return row[0] if row else None
+
+    def register(self, conn, model, description=None, activate=False):
+        """Публикация артефакта модели и запись версии в реестр; возвращает версию"""
+        directory = self.get_directory()
+        path = os.path.join(directory, model.version)
+        if not os.path.isdir(path):
+            # Каталог пишется под временным именем и публикуется переименованием
+            temp_path = os.path.join(directory, f".{model.version}.{os.getpid()}.tmp")
+            shutil.rmtree(temp_path, ignore_errors=True)
+            model.save_artifact(temp_path)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Ту же версию (те же веса) одновременно опубликовал другой процесс
+                shutil.rmtree(temp_path, ignore_errors=True)
+                if not os.path.isdir(path):
+                    raise
+
+        conn.execute("INSERT OR IGNORE INTO model_versions (version, path, description) VALUES (?, ?, ?)",
+                     (model.version, model.version, description))
+        if activate:
+            self.activate(conn, model.version)
+        else:
+            conn.commit()
+        return model.version
+
+    def activate(self, conn, version):
+        """Назначение активной версии (None - веса сетей) одной транзакцией"""
+        try:
+            if version is not None and not conn.execute(
+                    "SELECT 1 FROM model_versions WHERE version = ?", (version,)).fetchone():
+                raise ValueError(f"Версия модели {version} не зарегистрирована")
+            conn.execute("UPDATE model_versions SET active = 0 WHERE active = 1")
+            if version is not None:
+                conn.execute("UPDATE model_versions SET active = 1 WHERE version = ?", (version,))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def load(self, conn, version):
+        """Модель версии из реестра; массивы артефакта отображаются в память один раз на процесс"""
+        with self._lock:
+            model = self._models.get(version)
+        if model is not None:
+            return model
+
+        row = conn.execute("SELECT path FROM model_versions WHERE version = ?", (version,)).fetchone()
+        if not row:
+            raise ValueError(f"Версия модели {version} не зарегистрирована")
+        model = TrainedModel.load_artifact(os.path.join(self.get_directory(), row[0]))
+        with self._lock:
+            return self._models.setdefault(version, model)
+
+    def resolve(self, conn, spec):
+        """Модель по файлу .npz, версии реестра или BUILTIN_VERSION (тогда None)"""
+        if spec == BUILTIN_VERSION:
+            return None
+        if os.path.isfile(spec):
+            return TrainedModel.load(spec)
+        return self.load(conn, spec)
+
+    def sync(self, predictor, conn=None):
+        """Переключение предиктора на активную версию реестра; True, если модель заменена
+
+        Проверка - один запрос по индексу, поэтому выполняется перед каждым расчетом.
+        """
+        own_connection = conn is None
+        if own_connection:
+            conn = get_connection()
+        try:
+            version = self.active_version(conn)
+            current = predictor.model
+            if (current.version if current is not None else None) == version:
+                return False
+            predictor.set_model(self.load(conn, version) if version is not None else None)
+            return True
+        finally:
+            if own_connection:
+                conn.close()
+
+
+# Реестр процесса; каталог определяется по базе при обращении
+model_registry = ModelRegistry()
+
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Реестр версий обученных моделей прогноза")
+    parser.add_argument('--db', help="путь к базе данных (по умолчанию MEDICAL_DB_PATH или medical_system.db)")
+    parser.add_argument('--models-dir', help=f"каталог артефактов (по умолчанию {MODELS_DIR_ENV} или models "
+                                             f"рядом с базой)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="зарегистрированные версии")
+    register = commands.add_parser('register', help="регистрация модели из файла .npz (trained_model.py)")
+    register.add_argument('model', help="файл модели .npz")
+    register.add_argument('--description', help="описание версии")
+    register.add_argument('--activate', action='store_true', help="сразу сделать версию активной")
+    activate = commands.add_parser('activate', help="назначение активной версии")
+    activate.add_argument('version', help=f"версия из реестра или {BUILTIN_VERSION} - веса сетей")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db:
+        configure(args.db)
+    registry = ModelRegistry(args.models_dir)
+
+    conn = get_connection()
+    try:
+        migrate(conn)
+        if args.command == 'list':
+            for version, description, created_date, active in registry.list_versions(conn):
+                print(f"{'*' if active else ' '} {version}  {created_date}  {description or ''}".rstrip())
+            if registry.active_version(conn) is None:
+                print(f"* {BUILTIN_VERSION}  (веса сетей)")
+        elif args.command == 'register':
+            version = registry.register(conn, TrainedModel.load(args.model), args.description, args.activate)
+            print(f"Зарегистрирована версия {version}" + (" (активна)" if args.activate else ""), file=sys.stderr)
+        else:
+            version = None if args.version == BUILTIN_VERSION else args.version
+            registry.activate(conn, version)
+            print(f"Активная версия: {args.version}", file=sys.stderr)
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
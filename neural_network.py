@@ -1,11 +1,108 @@
+import zlib
 import numpy as np
-import sqlite3
+from database import get_connection
 from datetime import datetime
-import random
+from patient_snapshot import load_snapshot, load_snapshots
+from row_mapping import RecordMapping
+from trend_features import TREND_FEATURE_NAMES, load_trend_features
+
+# Версия модели прогнозирования. Сохраненные прогнозы привязаны к версии:
+# при изменении весов, факторов или правил их расчета версию нужно увеличить
+MODEL_VERSION = 'nn-sim-3'
+
+# seed детерминированного режима, используемый экраном прогноза и пакетным расчетом
+DEFAULT_SEED = 0
+
+# Порядок бинарных факторов риска в матрице признаков когорты
+FACTOR_NAMES = [
+    'age_over_45', 'age_over_50', 'age_over_60', 'age_over_65',
+    'fatigue', 'headaches', 'dyspnea', 'cough', 'chest_pain', 'heart_palpitations',
+    'hypertension', 'diabetes', 'obesity',
+    'high_cholesterol', 'high_glucose',
+    'covid_severe', 'covid_pneumonia',
+    'hemoglobin_falling', 'inflammation_rising', 'anemia'
+]
+
+# Пороги факторов динамики анализов крови (наклоны - изменение за 30 дней)
+HEMOGLOBIN_FALLING_SLOPE = -2.0
+SOE_RISING_SLOPE = 1.0
+LEUKOCYTES_RISING_SLOPE = 0.5
+ANEMIA_HEMOGLOBIN = 120.0
+
+# Столбцы, которые читает прогноз: поле снимка -> таблица и столбцы по именам.
+# Столбцов palpitations, cholesterol и glucose в схеме нет - их поля равны None
+PREDICTION_MAPPINGS = {
+    'patient': RecordMapping('patients', ['id', 'birth_date']),
+    'anamnesis': RecordMapping('anamnesis_extended',
+                               ['fatigue', 'headache', 'dyspnea', 'cough', 'chest_pain', 'palpitations']),
+    # other_pathologies - отметка "ГБ", pathology_stage - отметка "СД" карты пациента
+    'comorbidities': RecordMapping('comorbidities', ['other_pathologies', 'pathology_stage', 'obesity']),
+    'blood_tests': RecordMapping('blood_tests', ['cholesterol', 'glucose'])
+}
+
+
+def _splitmix64(values):
+    """Хеш-функция splitmix64 для массива uint64 (переполнение при умножении - по модулю 2^64)"""
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def seeded_uniforms(seed, patient_ids, streams):
+    """Детерминированные равномерные числа [0, 1) для каждого пациента и потока
+
+    Число зависит только от (seed, id пациента, имя потока), поэтому прогноз
+    пациента не зависит от состава когорты и порядка расчета. streams - имя
+    потока или список имен (тогда результат - матрица пациенты x потоки).
+    """
+    single = isinstance(streams, str)
+    stream_keys = np.array([zlib.crc32(name.encode('utf-8')) for name in ([streams] if single else streams)],
+                           dtype=np.uint64)
+    seed_key = _splitmix64(np.array([seed & 0xFFFFFFFFFFFFFFFF], dtype=np.uint64))
+    patient_keys = _splitmix64(np.asarray(patient_ids, dtype=np.int64).astype(np.uint64) ^ seed_key)
+    bits = _splitmix64(patient_keys[:, np.newaxis] ^ stream_keys[np.newaxis, :])
+    # Старшие 53 бита - мантисса числа двойной точности
+    uniforms = (bits >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+    return uniforms[:, 0] if single else uniforms
+
+
+def _flag_column(rows, field):
+    """Столбец булевых флагов по имени поля записей"""
+    return np.fromiter(
+        (bool(getattr(row, field)) if row is not None else False for row in rows),
+        dtype=bool, count=len(rows))
+
+
+def _trend_column(trends, name):
+    """Столбец матрицы признаков динамики по имени"""
+    return trends[:, TREND_FEATURE_NAMES.index(name)]
+
+
+def _float_column(rows, field, default):
+    """Столбец числовых значений по имени поля; некорректные значения - NaN"""
+    values = np.full(len(rows), np.nan)
+    for i, row in enumerate(rows):
+        if row is None:
+            continue
+        value = getattr(row, field)
+        try:
+            values[i] = float(value) if value else default
+        except (TypeError, ValueError):
+            pass
+    return values
+
 
 class NeuralNetworkPredictor:
-    def __init__(self):
-        """Инициализация модуля нейронных сетей для прогнозирования"""
+    def __init__(self, seed=None, model=None):
+        """Инициализация модуля нейронных сетей для прогнозирования
+
+        seed=None - прежний режим со случайными допущениями и шумом при каждом
+        расчете. С заданным seed прогноз пациента детерминирован: одинаковые
+        данные и seed всегда дают одинаковый результат. model - обученная
+        модель (trained_model.TrainedModel), которая рассчитывает риски вместо
+        весов сетей; None - расчет по весам сетей.
+        """
         # Симуляция 8 нейронных сетей из Статистика10 с улучшенными показателями
         self.networks = {
             'cardiovascular': {
@@ -18,7 +115,9 @@ class NeuralNetworkPredictor:
                     'age_over_60': 0.30,
                     'covid_severe': 0.40,
                     'fatigue': 0.15,
-                    'headaches': 0.20
+                    'headaches': 0.20,
+                    'hemoglobin_falling': 0.15,
+                    'anemia': 0.15
                 }
             },
             'diabetes': {
@@ -61,7 +160,9 @@ class NeuralNetworkPredictor:
                     'hypertension': 0.40,
                     'diabetes': 0.45,
                     'age_over_60': 0.30,
-                    'covid_severe': 0.35
+                    'covid_severe': 0.35,
+                    'hemoglobin_falling': 0.20,
+                    'anemia': 0.15
                 }
             },
             'immune_disorders': {
@@ -71,7 +172,8 @@ class NeuralNetworkPredictor:
                     'covid_severe': 0.40,
                     'fatigue': 0.35,
                     'age_over_50': 0.20,
-                    'headaches': 0.25
+                    'headaches': 0.25,
+                    'inflammation_rising': 0.30
                 }
             },
             'metabolic_disorders': {
@@ -95,43 +197,50 @@ class NeuralNetworkPredictor:
                 }
             }
         }
+        
+        self.seed = seed
+        self.rng = np.random.default_rng()
+        self.set_model(model)
+    
+    def set_model(self, model):
+        """Атомарная замена обученной модели (None - веса сетей) без перезапуска программы
+
+        Модель и ее версия заменяются одним присваиванием: прогноз, начатый до
+        замены, досчитывается и сохраняется с прежней моделью и версией.
+        """
+        if model is not None and not set(model.networks) <= set(self.networks):
+            raise ValueError("Модель рассчитывает риски неизвестных сетей")
+        # Прогнозы с разным seed различаются и у обученной модели: допущения факторов
+        # (draw_uniforms) - ее входы, поэтому сохраняются как разные версии модели
+        base_version = model.version if model is not None else MODEL_VERSION
+        self.active = (model, base_version if self.seed is None else f"{base_version}/seed={self.seed}")
+    
+    @property
+    def model(self):
+        """Текущая обученная модель или None"""
+        return self.active[0]
+    
+    @property
+    def model_version(self):
+        """Версия текущей модели, под которой сохраняются прогнозы"""
+        return self.active[1]
     
     def get_patient_data(self, patient_id):
         """Получение данных пациента из базы данных"""
-        conn = sqlite3.connect('medical_system.db')
-        cursor = conn.cursor()
-        
-        # Получаем основные данные пациента
-        cursor.execute("SELECT * FROM patients WHERE id = ?", (patient_id,))
-        patient = cursor.fetchone()
+        conn = get_connection()
+        snapshot = load_snapshot(conn, patient_id, PREDICTION_MAPPINGS)
+        trends = load_trend_features(conn, [patient_id]) if snapshot else None
+        conn.close()
         
-        if not patient:
-            conn.close()
+        if not snapshot:
             return None
         
-        # Получаем анамнез
-        cursor.execute("SELECT * FROM anamnesis_extended WHERE patient_id = ?", (patient_id,))
-        anamnesis = cursor.fetchone()
-        
-        # Получаем коморбидности
-        cursor.execute("SELECT * FROM comorbidities WHERE patient_id = ?", (patient_id,))
-        comorbidities = cursor.fetchone()
-        
-        # Получаем данные анализов
-        cursor.execute("SELECT * FROM blood_tests WHERE patient_id = ?", (patient_id,))
-        blood_tests = cursor.fetchone()
-        
-        cursor.execute("SELECT * FROM urine_tests WHERE patient_id = ?", (patient_id,))
-        urine_tests = cursor.fetchone()
-        
-        conn.close()
-        
         return {
-            'patient': patient,
-            'anamnesis': anamnesis,
-            'comorbidities': comorbidities,
-            'blood_tests': blood_tests,
-            'urine_tests': urine_tests
+            'patient': snapshot.patient,
+            'anamnesis': snapshot.anamnesis,
+            'comorbidities': snapshot.comorbidities,
+            'blood_tests': snapshot.blood_tests,
+            'trends': trends[0]
         }
     
     def calculate_risk_factors(self, patient_data):
@@ -139,118 +248,221 @@ class NeuralNetworkPredictor:
         if not patient_data or not patient_data['patient']:
             return {}
         
-        patient = patient_data['patient']
-        anamnesis = patient_data['anamnesis']
-        comorbidities = patient_data['comorbidities']
-        blood_tests = patient_data['blood_tests']
-        urine_tests = patient_data['urine_tests']
+        cohort_rows = {
+            'patients': [patient_data['patient']],
+            'anamnesis': [patient_data['anamnesis']],
+            'comorbidities': [patient_data['comorbidities']],
+            'blood_tests': [patient_data['blood_tests']],
+            'trends': patient_data['trends'][np.newaxis, :]
+        }
+        features, ages, imputed = self.build_feature_matrix(cohort_rows)
+        
+        factors = dict(zip(FACTOR_NAMES, features[0].tolist()))
+        if not np.isnan(ages[0]):
+            factors['age'] = int(ages[0])
+        return factors
+    
+    def get_cohort_data(self, patient_ids, mappings=PREDICTION_MAPPINGS):
+        """Пакетная загрузка данных когорты пациентов (по одному запросу на таблицу)"""
+        conn = get_connection()
+        snapshots = load_snapshots(conn, patient_ids, mappings)
+        # Пациенты, отсутствующие в базе, в когорту не попадают
+        ids = list(snapshots)
+        trends = load_trend_features(conn, ids)
+        conn.close()
+        
+        cohort_rows = {
+            'patients': [snapshot.patient for snapshot in snapshots.values()],
+            'anamnesis': [snapshot.anamnesis for snapshot in snapshots.values()],
+            'comorbidities': [snapshot.comorbidities for snapshot in snapshots.values()],
+            'blood_tests': [snapshot.blood_tests for snapshot in snapshots.values()],
+            'data_versions': [snapshot.data_version for snapshot in snapshots.values()],
+            'trends': trends
+        }
+        return ids, cohort_rows
+    
+    def draw_uniforms(self, patient_ids, streams):
+        """Равномерные числа [0, 1) для допущений и шума: детерминированные при заданном seed"""
+        if self.seed is not None:
+            return seeded_uniforms(self.seed, patient_ids, streams)
+        shape = (len(patient_ids),) if isinstance(streams, str) else (len(patient_ids), len(streams))
+        return self.rng.random(shape)
+    
+    def build_feature_matrix(self, cohort_rows):
+        """Построение булевой матрицы факторов риска (пациенты x FACTOR_NAMES)
+        
+        Возвращает (факторы, возраст, допущения); допущения - булева матрица
+        того же размера, отмечающая факторы, предположенные без данных пациента.
+        """
+        patients = cohort_rows['patients']
+        anamnesis = cohort_rows['anamnesis']
+        comorbidities = cohort_rows['comorbidities']
+        blood_tests = cohort_rows['blood_tests']
         
-        factors = {}
+        n = len(patients)
+        patient_ids = np.fromiter((patient.id for patient in patients), dtype=np.int64, count=n)
+        column = {name: i for i, name in enumerate(FACTOR_NAMES)}
+        features = np.zeros((n, len(FACTOR_NAMES)), dtype=bool)
+        imputed = np.zeros((n, len(FACTOR_NAMES)), dtype=bool)
         
         # Возраст
-        if patient[6]:  # birth_date
-            try:
-                birth_year = int(patient[6].split('-')[0])
-                current_year = datetime.now().year
-                age = current_year - birth_year
-                factors['age'] = age
-                factors['age_over_45'] = age > 45
-                factors['age_over_50'] = age > 50
-                factors['age_over_60'] = age > 60
-                factors['age_over_65'] = age > 65
-            except:
-                factors['age'] = 50
-                factors['age_over_45'] = True
-                factors['age_over_50'] = True
-        
-        # Анамнез - улучшенная обработка
-        if anamnesis:
-            factors['fatigue'] = bool(anamnesis[3]) if len(anamnesis) > 3 else False
-            factors['headaches'] = bool(anamnesis[16]) if len(anamnesis) > 16 else False
-            factors['dyspnea'] = bool(anamnesis[21]) if len(anamnesis) > 21 else False
-            factors['cough'] = bool(anamnesis[8]) if len(anamnesis) > 8 else False
-            
-            # Дополнительные факторы из анамнеза
-            factors['chest_pain'] = bool(anamnesis[13]) if len(anamnesis) > 13 else False
-            factors['heart_palpitations'] = bool(anamnesis[14]) if len(anamnesis) > 14 else False
-        else:
-            # Если нет данных анамнеза, предполагаем наличие некоторых симптомов
-            factors['fatigue'] = True
-            factors['headaches'] = random.choice([True, False])
-            factors['dyspnea'] = random.choice([True, False])
-            factors['cough'] = random.choice([True, False])
-        
-        # Коморбидности
-        if comorbidities:
-            factors['hypertension'] = bool(comorbidities[11]) if len(comorbidities) > 11 else False
-            factors['diabetes'] = bool(comorbidities[2]) if len(comorbidities) > 2 else False
-            factors['obesity'] = bool(comorbidities[8]) if len(comorbidities) > 8 else False
-        else:
-            # Если нет данных коморбидностей, предполагаем их наличие с вероятностью
-            factors['hypertension'] = random.choice([True, False, False])  # 33% вероятность
-            factors['diabetes'] = random.choice([True, False, False, False])  # 25% вероятность
-            factors['obesity'] = random.choice([True, False, False])  # 33% вероятность
-        
-        # Анализы крови - дополнительные факторы риска
-        if blood_tests:
-            # Высокий холестерин
-            try:
-                cholesterol = float(blood_tests[8]) if blood_tests[8] else 5.0
-                factors['high_cholesterol'] = cholesterol > 6.0
-            except:
-                factors['high_cholesterol'] = False
-            
-            # Высокий сахар
-            try:
-                glucose = float(blood_tests[9]) if blood_tests[9] else 5.5
-                factors['high_glucose'] = glucose > 6.1
-            except:
-                factors['high_glucose'] = False
-        
-        # COVID-19 тяжесть - более реалистичное моделирование
-        # Предполагаем, что у большинства пациентов была COVID-19 инфекция
-        factors['covid_severe'] = random.choice([True, True, False])  # 67% вероятность
-        factors['covid_pneumonia'] = random.choice([True, False, False])  # 33% вероятность
+        ages = np.full(n, np.nan)
+        invalid_dates = np.zeros(n, dtype=bool)
+        current_year = datetime.now().year
+        for i, patient in enumerate(patients):
+            if patient.birth_date:
+                try:
+                    ages[i] = current_year - int(patient.birth_date.split('-')[0])
+                except:
+                    invalid_dates[i] = True
         
-        return factors
+        known_ages = np.nan_to_num(ages)
+        for name, limit in (('age_over_45', 45), ('age_over_50', 50), ('age_over_60', 60), ('age_over_65', 65)):
+            features[:, column[name]] = known_ages > limit
+        
+        # Некорректная дата рождения: считаем возраст равным 50
+        ages[invalid_dates] = 50
+        for name in ('age_over_45', 'age_over_50'):
+            features[invalid_dates, column[name]] = True
+            imputed[invalid_dates, column[name]] = True
+        
+        # Анамнез; если данных нет, предполагаем наличие некоторых симптомов
+        has_anamnesis = np.fromiter((row is not None for row in anamnesis), dtype=bool, count=n)
+        for name, field, probability in (('fatigue', 'fatigue', 1.0), ('headaches', 'headache', 0.5),
+                                         ('dyspnea', 'dyspnea', 0.5), ('cough', 'cough', 0.5)):
+            guess = self.draw_uniforms(patient_ids, name) < probability
+            features[:, column[name]] = np.where(has_anamnesis, _flag_column(anamnesis, field), guess)
+            imputed[:, column[name]] = ~has_anamnesis
+        features[:, column['chest_pain']] = _flag_column(anamnesis, 'chest_pain')
+        features[:, column['heart_palpitations']] = _flag_column(anamnesis, 'palpitations')
+        
+        # Коморбидности; если данных нет, предполагаем их наличие с вероятностью
+        has_comorbidities = np.fromiter((row is not None for row in comorbidities), dtype=bool, count=n)
+        for name, field, probability in (('hypertension', 'other_pathologies', 1 / 3),
+                                         ('diabetes', 'pathology_stage', 1 / 4), ('obesity', 'obesity', 1 / 3)):
+            guess = self.draw_uniforms(patient_ids, name) < probability
+            features[:, column[name]] = np.where(has_comorbidities, _flag_column(comorbidities, field), guess)
+            imputed[:, column[name]] = ~has_comorbidities
+        
+        # Анализы крови - высокий холестерин и сахар
+        with np.errstate(invalid='ignore'):
+            features[:, column['high_cholesterol']] = _float_column(blood_tests, 'cholesterol', 5.0) > 6.0
+            features[:, column['high_glucose']] = _float_column(blood_tests, 'glucose', 5.5) > 6.1
+        
+        # COVID-19 тяжесть: предполагаем, что у большинства пациентов была инфекция
+        features[:, column['covid_severe']] = self.draw_uniforms(patient_ids, 'covid_severe') < 2 / 3
+        features[:, column['covid_pneumonia']] = self.draw_uniforms(patient_ids, 'covid_pneumonia') < 1 / 3
+        imputed[:, column['covid_severe']] = True
+        imputed[:, column['covid_pneumonia']] = True
+        
+        # Динамика анализов крови по истории визитов; без истории факторы не отмечаются
+        trends = cohort_rows.get('trends')
+        if trends is not None:
+            with np.errstate(invalid='ignore'):
+                features[:, column['hemoglobin_falling']] = (
+                    _trend_column(trends, 'hemoglobin_slope') < HEMOGLOBIN_FALLING_SLOPE)
+                features[:, column['inflammation_rising']] = (
+                    (_trend_column(trends, 'soe_slope') > SOE_RISING_SLOPE) |
+                    (_trend_column(trends, 'leukocytes_slope') > LEUKOCYTES_RISING_SLOPE))
+                features[:, column['anemia']] = _trend_column(trends, 'hemoglobin_mean') < ANEMIA_HEMOGLOBIN
+        
+        return features, ages, imputed
     
-    def predict_disease_risk(self, patient_id):
-        """Основная функция прогнозирования рисков заболеваний"""
-        patient_data = self.get_patient_data(patient_id)
-        if not patient_data:
-            return None
+    def build_weight_matrix(self):
+        """Сборка 8 сетей в матрицу весов (сети x FACTOR_NAMES) и вектор базовых рисков"""
+        network_names = list(self.networks)
+        column = {name: i for i, name in enumerate(FACTOR_NAMES)}
+        weights = np.zeros((len(network_names), len(FACTOR_NAMES)))
+        base_risks = np.empty(len(network_names))
+        
+        for row, network_name in enumerate(network_names):
+            network = self.networks[network_name]
+            base_risks[row] = network['base_risk']
+            for factor_name, factor_weight in network['factors'].items():
+                if factor_name in column:
+                    weights[row, column[factor_name]] = factor_weight
+        
+        return network_names, base_risks, weights
+    
+    def score_features(self, features, patient_ids, ages=None, trends=None, model=None):
+        """Расчет рисков всех сетей для матрицы факторов одной матричной операцией
+
+        model - обученная модель расчета; None - веса сетей.
+        """
+        if model is not None:
+            # Обученная модель: множитель шума не применяется (допущения факторов по seed
+            # остаются во входах), возраст и динамика анализов - входы модели
+            return model.networks, model.predict_risks(features, ages, trends)
+        
+        network_names, base_risks, weights = self.build_weight_matrix()
+        
+        risk_multipliers = 1.0 + features.astype(np.float64) @ weights.T
+        
+        # Добавляем небольшую случайность для реалистичности (множитель от 0.9 до 1.1)
+        noise_streams = ['noise:' + network_name for network_name in network_names]
+        random_factors = 0.9 + 0.2 * self.draw_uniforms(patient_ids, noise_streams)
         
-        risk_factors = self.calculate_risk_factors(patient_data)
+        # Риск ограничен сверху 98%, а минимальный риск не должен быть слишком низким
+        risks = np.clip(base_risks * risk_multipliers * random_factors, 0.25, 0.98)
+        return network_names, risks
+    
+    def predict_cohort(self, patient_ids, active=None):
+        """Пакетное прогнозирование рисков для когорты пациентов
+
+        active - (модель, версия), снятые с self.active до расчета; по
+        умолчанию текущие. Версия возвращается вместе с рисками.
+        """
+        model, model_version = active or self.active
+        ids, cohort_rows = self.get_cohort_data(patient_ids)
+        ids = np.array(ids, dtype=np.int64)
+        features, ages, imputed = self.build_feature_matrix(cohort_rows)
+        network_names, risks = self.score_features(features, ids, ages, cohort_rows['trends'], model)
+        
+        return {
+            'patient_ids': ids,
+            'networks': network_names,
+            'features': features,
+            'imputed': imputed,
+            'risks': risks,
+            'data_versions': np.array(cohort_rows['data_versions'], dtype=np.int64),
+            'model_version': model_version,
+            # Признаки динамики (пациенты x TREND_FEATURE_NAMES)
+            'trends': cohort_rows['trends']
+        }
+    
+    def get_cohort_predictions(self, cohort, index):
+        """Результаты когорты для одного пациента в формате predict_disease_risk"""
+        features = dict(zip(FACTOR_NAMES, cohort['features'][index].tolist()))
+        imputed = dict(zip(FACTOR_NAMES, cohort['imputed'][index].tolist()))
         predictions = {}
         
-        for network_name, network in self.networks.items():
-            base_risk = network['base_risk']
-            risk_multiplier = 1.0
-            active_factors = []
-            
-            # Применяем факторы риска
-            for factor_name, factor_weight in network['factors'].items():
-                if risk_factors.get(factor_name, False):
-                    risk_multiplier += factor_weight
-                    active_factors.append(factor_name)
-            
-            # Добавляем небольшую случайность для реалистичности
-            random_factor = random.uniform(0.9, 1.1)
-            final_risk = min(base_risk * risk_multiplier * random_factor, 0.98)
-            
-            # Минимальный риск не должен быть слишком низким
-            final_risk = max(final_risk, 0.25)
+        for network_index, network_name in enumerate(cohort['networks']):
+            network = self.networks[network_name]
+            final_risk = float(cohort['risks'][index, network_index])
+            active_factors = [factor_name for factor_name in network['factors']
+                              if features.get(factor_name, False)]
             
             predictions[network_name] = {
                 'disease': network['name'],
                 'risk_percentage': round(final_risk * 100, 1),
                 'risk_level': self.get_risk_level(final_risk),
                 'recommendations': self.get_recommendations(network_name),
-                'active_factors': active_factors
+                'active_factors': active_factors,
+                # Факторы сети, предположенные без данных пациента
+                'imputed_factors': [factor_name for factor_name in network['factors']
+                                    if imputed.get(factor_name, False)]
             }
         
         return predictions
     
+    def predict_disease_risk(self, patient_id):
+        """Основная функция прогнозирования рисков заболеваний"""
+        cohort = self.predict_cohort([patient_id])
+        if not len(cohort['patient_ids']):
+            return None
+        
+        return self.get_cohort_predictions(cohort, 0)
+    
     def get_risk_level(self, risk):
         """Определение уровня риска"""
         if risk < 0.30:
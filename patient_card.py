@@ -1,9 +1,80 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-import sqlite3
+from tkinter import ttk, messagebox, filedialog
+from database import get_connection
+from prediction_cache import invalidate_patient, prediction_cache
 from datetime import datetime
 import random
 from medical_functions import MedicalDataManager
+from patient_import import import_file
+from patient_picker import ask_patient
+from row_mapping import RecordMapping, fetch_patient_record
+from visit_history import parse_visit_date, patient_visit_dates, today_visit_date
+
+# Поля вкладки "Файл" по именам столбцов таблицы patients
+PATIENT_MAPPING = RecordMapping('patients', [
+    'id', 'card_number', 'policy_number', 'surname', 'name', 'patronymic',
+    'birth_date', 'gender', 'address', 'phone', 'passport',
+    'series', 'number', 'issued_by', 'snils', 'workplace',
+    'disability_group', 'blood_group'
+])
+
+# Поля, по которым находится повторно заведенный пациент (оба проиндексированы)
+PATIENT_UNIQUE_FIELDS = [('card_number', "номером карты"), ('snils', "СНИЛС")]
+
+
+def changed_patient_fields(record, values):
+    """Поля формы, значения которых отличаются от сохраненной записи пациента"""
+    return {name: value for name, value in values.items()
+            if (getattr(record, name) or '') != (value or '')}
+
+
+def find_duplicate_patient(conn, values, patient_id=None):
+    """Другой пациент с тем же номером карты или СНИЛС: (поле, ID) или None"""
+    for field_name, label in PATIENT_UNIQUE_FIELDS:
+        if not values.get(field_name):
+            continue
+        row = conn.execute(f"SELECT id FROM patients WHERE {field_name} = ? AND id IS NOT ? LIMIT 1",
+                           (values[field_name], patient_id)).fetchone()
+        if row is not None:
+            return label, row[0]
+    return None
+
+
+def save_patient(conn, patient_id, values):
+    """Запись карты пациента; возвращает (ID, измененные поля)
+
+    Новый пациент (patient_id=None) вставляется. У существующего обновляются
+    только поля, отличающиеся от сохраненных: триггеры поиска и версии данных
+    прогноза срабатывают лишь при изменении своих столбцов.
+    """
+    if patient_id is None:
+        changed = dict(values, created_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    else:
+        record = fetch_patient_record(conn, PATIENT_MAPPING, patient_id, key='id')
+        if record is None:
+            raise ValueError(f"Пациент с ID {patient_id} не найден")
+        changed = changed_patient_fields(record, values)
+        if not changed:
+            return patient_id, {}
+    
+    duplicate = find_duplicate_patient(conn, changed, patient_id)
+    if duplicate is not None:
+        raise ValueError(f"Пациент с таким {duplicate[0]} уже есть (ID {duplicate[1]})")
+    
+    columns = list(changed)
+    try:
+        if patient_id is None:
+            cursor = conn.execute(f"INSERT INTO patients ({', '.join(columns)}) "
+                                  f"VALUES ({', '.join('?' for _ in columns)})", [changed[name] for name in columns])
+            patient_id = cursor.lastrowid
+        else:
+            conn.execute(f"UPDATE patients SET {', '.join(f'{name} = ?' for name in columns)} WHERE id = ?",
+                         [changed[name] for name in columns] + [patient_id])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return patient_id, changed
 
 class PatientCard:
     def __init__(self, parent_app):
@@ -28,32 +99,141 @@ class PatientCard:
         tk.Label(header_frame, text="Карта пациента", 
                 font=('Arial', 20, 'bold')).pack(side='left')
         
+        # Дата визита: вкладки измерений показывают последний визит не позже
+        # этой даты и сохраняют данные в визит с этой датой
+        visit_frame = tk.Frame(header_frame)
+        visit_frame.pack(side='left', padx=30)
+        tk.Label(visit_frame, text="Дата визита:", font=('Arial', 14)).pack(side='left')
+        self.visit_date = today_visit_date()
+        self.visit_date_var = tk.StringVar(value=self.visit_date)
+        self.visit_combo = ttk.Combobox(visit_frame, textvariable=self.visit_date_var,
+                                        font=('Arial', 14), width=12)
+        self.visit_combo.pack(side='left', padx=5)
+        self.visit_combo.bind('<<ComboboxSelected>>', self.on_visit_date_changed)
+        self.visit_combo.bind('<Return>', self.on_visit_date_changed)
+        self.visit_combo.bind('<FocusOut>', self.on_visit_date_changed)
+        
         # Кнопки управления
         btn_frame = tk.Frame(header_frame)
         btn_frame.pack(side='right')
         
+        tk.Button(btn_frame, text="Импорт", font=('Arial', 14),
+                 command=self.import_patients).pack(side='left', padx=5)
         tk.Button(btn_frame, text="Печать", font=('Arial', 14),
                  command=self.parent_app.print_module.print_patient_data).pack(side='left', padx=5)
         tk.Button(btn_frame, text="Выход", font=('Arial', 14),
                  command=self.parent_app.create_main_window).pack(side='left', padx=5)
         
         # Создание notebook для вкладок
-        notebook = ttk.Notebook(main_frame)
-        notebook.pack(fill='both', expand=True, padx=10, pady=5)
-        
-        # Вкладки
-        self.create_file_tab(notebook)
-        self.create_anamnesis_tab(notebook)
-        self.create_comorbidities_tab(notebook)
-        self.create_blood_test_tab(notebook)
-        self.create_urine_test_tab(notebook)
-        self.create_ecg_tab(notebook)
-        self.create_echo_tab(notebook)
+        self.notebook = ttk.Notebook(main_frame)
+        self.notebook.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        # Вкладки добавляются пустыми: содержимое строится при первом выборе
+        # вкладки, и тогда же загружаются ее данные
+        # Последний элемент - данные вкладки относятся к визиту
+        tabs = [
+            ("Файл", self.create_file_tab, self.load_patient_fields, False),
+            ("Анамнез", self.create_anamnesis_tab, self.medical_manager.load_anamnesis_data, True),
+            ("Коморбидные состояния", self.create_comorbidities_tab, self.medical_manager.load_comorbidities_data, False),
+            ("Анализ крови", self.create_blood_test_tab, self.medical_manager.load_blood_test_data, True),
+            ("Анализ мочи", self.create_urine_test_tab, self.medical_manager.load_urine_test_data, True),
+            ("ЭКГ", self.create_ecg_tab, self.medical_manager.load_ecg_data, True),
+            ("ЭХО-КГ", self.create_echo_tab, self.medical_manager.load_echo_data, True)
+        ]
+        self.tabs = {}
+        for title, create, load, per_visit in tabs:
+            tab_frame = ttk.Frame(self.notebook)
+            self.notebook.add(tab_frame, text=title)
+            # Пациент, данные которого загружены во вкладку; None - вкладка еще не построена
+            self.tabs[str(tab_frame)] = {'frame': tab_frame, 'create': create, 'load': load,
+                                         'per_visit': per_visit, 'built': False, 'patient_id': None}
+        
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.on_tab_changed()
+        self.load_visit_dates()
+    
+    def on_tab_changed(self, event=None):
+        """Построение выбранной вкладки при первом показе и загрузка данных текущего пациента"""
+        tab = self.tabs.get(self.notebook.select())
+        if tab is None:
+            return
+        
+        patient_id = self.parent_app.current_patient_id
+        if tab['built'] and tab['patient_id'] not in (None, patient_id):
+            # Вкладка заполнена данными другого пациента: строим ее заново с пустыми полями
+            for widget in tab['frame'].winfo_children():
+                widget.destroy()
+            tab['built'] = False
+        
+        if not tab['built']:
+            tab['create'](tab['frame'])
+            tab['built'] = True
+            tab['patient_id'] = None
+        
+        if patient_id and tab['patient_id'] != patient_id:
+            tab['patient_id'] = patient_id
+            tab['load'](quiet=True)
+    
+    def reload_tabs(self, per_visit_only=False):
+        """Сброс загруженных данных вкладок: выбранная перечитывается сразу, остальные - при показе"""
+        for tab in self.tabs.values():
+            if tab['built'] and (tab['per_visit'] or not per_visit_only):
+                # Вкладка строится заново с пустыми полями: у визита может не быть данных этой вкладки
+                for widget in tab['frame'].winfo_children():
+                    widget.destroy()
+                tab['built'] = False
+            tab['patient_id'] = None
+        self.on_tab_changed()
+    
+    def get_visit_date(self, quiet=False):
+        """Дата визита из заголовка в формате базы; None, если дата введена неверно"""
+        try:
+            return parse_visit_date(self.visit_date_var.get())
+        except ValueError as e:
+            if not quiet:
+                messagebox.showerror("Ошибка", str(e))
+            return None
     
-    def create_file_tab(self, notebook):
+    def on_visit_date_changed(self, event=None):
+        """Смена даты визита: вкладки измерений перечитываются на новую дату"""
+        visit_date = self.get_visit_date(quiet=True)
+        if visit_date is None:
+            return
+        self.visit_date_var.set(visit_date)
+        if visit_date != self.visit_date:
+            self.visit_date = visit_date
+            self.reload_tabs(per_visit_only=True)
+    
+    def load_visit_dates(self):
+        """Список визитов текущего пациента в поле даты визита"""
+        patient_id = self.parent_app.current_patient_id
+        if not patient_id:
+            self.visit_combo.config(values=[])
+            return
+        
+        def fetch(task):
+            conn = get_connection()
+            try:
+                return patient_visit_dates(conn, patient_id)
+            finally:
+                conn.close()
+        
+        def show(visit_dates):
+            if patient_id == self.parent_app.current_patient_id:
+                # Новые визиты сверху
+                self.visit_combo.config(values=list(reversed(visit_dates)))
+        
+        self.parent_app.task_runner.submit(fetch, "Загрузка списка визитов", on_success=show,
+                                           owner=self.visit_combo, show_progress=False)
+    
+    def mark_tab_loaded(self, patient_id):
+        """Отметка, что поля выбранной вкладки уже соответствуют пациенту"""
+        tab = self.tabs.get(self.notebook.select())
+        if tab is not None:
+            tab['patient_id'] = patient_id
+    
+    def create_file_tab(self, file_frame):
         """Создание вкладки с основными данными пациента"""
-        file_frame = ttk.Frame(notebook)
-        notebook.add(file_frame, text="Файл")
         
         # Левая панель с данными пациента
         left_frame = tk.Frame(file_frame, width=400)
@@ -142,10 +322,8 @@ class PatientCard:
                  font=('Arial', 16), bg='lightgreen',
                  command=self.show_disease_prediction).pack(pady=20)
     
-    def create_anamnesis_tab(self, notebook):
+    def create_anamnesis_tab(self, anamnesis_frame):
         """Создание вкладки анамнеза"""
-        anamnesis_frame = ttk.Frame(notebook)
-        notebook.add(anamnesis_frame, text="Анамнез")
         
         # Левая панель с изображением врача
         left_frame = tk.Frame(anamnesis_frame, width=300)
@@ -286,10 +464,8 @@ class PatientCard:
                  font=('Arial', 14), bg='lightcoral',
                  command=self.clear_anamnesis_data).pack(side='left', padx=5)
     
-    def create_comorbidities_tab(self, notebook):
+    def create_comorbidities_tab(self, comorbidities_frame):
         """Создание вкладки коморбидных состояний"""
-        comorbidities_frame = ttk.Frame(notebook)
-        notebook.add(comorbidities_frame, text="Коморбидные состояния")
         
         # Левая панель - список заболеваний
         left_frame = tk.Frame(comorbidities_frame)
@@ -386,10 +562,8 @@ class PatientCard:
         
         tk.Label(image_frame, text="🫁", font=('Arial', 64), bg='lightblue').pack(expand=True)
     
-    def create_blood_test_tab(self, notebook):
+    def create_blood_test_tab(self, blood_frame):
         """Создание вкладки анализа крови"""
-        blood_frame = ttk.Frame(notebook)
-        notebook.add(blood_frame, text="Анализ крови")
         
         # Левая панель с изображением
         left_frame = tk.Frame(blood_frame, width=300)
@@ -471,10 +645,8 @@ class PatientCard:
                  font=('Arial', 14), bg='lightcoral',
                  command=self.clear_blood_test_data).pack(side='left', padx=5)
     
-    def create_urine_test_tab(self, notebook):
+    def create_urine_test_tab(self, urine_frame):
         """Создание вкладки анализа мочи"""
-        urine_frame = ttk.Frame(notebook)
-        notebook.add(urine_frame, text="Анализ мочи")
         
         # Левая панель с изображением
         left_frame = tk.Frame(urine_frame, width=400)
@@ -555,10 +727,8 @@ class PatientCard:
                  font=('Arial', 14), bg='lightcoral',
                  command=self.clear_urine_test_data).pack(side='left', padx=5)
     
-    def create_ecg_tab(self, notebook):
+    def create_ecg_tab(self, ecg_frame):
         """Создание вкладки ЭКГ"""
-        ecg_frame = ttk.Frame(notebook)
-        notebook.add(ecg_frame, text="ЭКГ")
         
         # Левая панель
         left_frame = tk.Frame(ecg_frame)
@@ -628,10 +798,8 @@ class PatientCard:
         image_frame.pack_propagate(False)
         tk.Label(image_frame, text="📈", font=('Arial', 64), bg='lightgreen').pack(expand=True)
     
-    def create_echo_tab(self, notebook):
+    def create_echo_tab(self, echo_frame):
         """Создание вкладки ЭХО-КГ"""
-        echo_frame = ttk.Frame(notebook)
-        notebook.add(echo_frame, text="ЭХО-КГ")
         
         # Основной фрейм для параметров
         main_frame = tk.Frame(echo_frame)
@@ -685,106 +853,147 @@ class PatientCard:
                  command=self.clear_echo_data).pack(side='left', padx=5)
     
     def save_patient_data(self):
-        """Сохранение данных пациента в БД"""
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Проверка заполнения обязательных полей
-            if not self.patient_fields.get("surname").get().strip():
-                messagebox.showerror("Ошибка", "Фамилия является обязательным полем!")
-                return
-            
-            # Подготовка данных для сохранения
-            patient_data = {}
-            for field_name, field_widget in self.patient_fields.items():
-                if hasattr(field_widget, 'get'):
-                    patient_data[field_name] = field_widget.get()
-                else:
-                    patient_data[field_name] = ""
-            
-            # Добавление даты создания
-            patient_data['created_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Создание нового пациента
-            insert_query = """
-                INSERT INTO patients (
-                    card_number, policy_number, surname, name, patronymic,
-                    birth_date, gender, address, phone, passport,
-                    series, number, issued_by, snils, workplace,
-                    disability_group, blood_group, created_date
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-            cursor.execute(insert_query, (
-                patient_data.get('card_number', ''),
-                patient_data.get('policy_number', ''),
-                patient_data.get('surname', ''),
-                patient_data.get('name', ''),
-                patient_data.get('patronymic', ''),
-                patient_data.get('birth_date', ''),
-                patient_data.get('gender', ''),
-                patient_data.get('address', ''),
-                patient_data.get('phone', ''),
-                patient_data.get('passport', ''),
-                patient_data.get('series', ''),
-                patient_data.get('number', ''),
-                patient_data.get('issued_by', ''),
-                patient_data.get('snils', ''),
-                patient_data.get('workplace', ''),
-                patient_data.get('disability_group', ''),
-                patient_data.get('blood_group', ''),
-                patient_data.get('created_date', '')
-            ))
-            self.parent_app.current_patient_id = cursor.lastrowid
-            messagebox.showinfo("Успех", f"Пациент сохранен! ID: {self.parent_app.current_patient_id}")
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении: {str(e)}")
+        """Сохранение данных пациента в БД: новый пациент или изменение текущего"""
+        # Проверка заполнения обязательных полей
+        if not self.patient_fields.get("surname").get().strip():
+            messagebox.showerror("Ошибка", "Фамилия является обязательным полем!")
+            return
+        
+        # Подготовка данных для сохранения
+        patient_data = {}
+        for field_name, field_widget in self.patient_fields.items():
+            if hasattr(field_widget, 'get'):
+                patient_data[field_name] = field_widget.get()
+            else:
+                patient_data[field_name] = ""
+        # Пустые номер карты и СНИЛС хранятся как NULL и не считаются повтором
+        for field_name, label in PATIENT_UNIQUE_FIELDS:
+            patient_data[field_name] = patient_data[field_name].strip() or None
+        
+        patient_id = self.parent_app.current_patient_id
+        
+        def save(task):
+            conn = get_connection()
+            try:
+                result = save_patient(conn, patient_id, patient_data)
+            finally:
+                conn.close()
+            if result[1]:
+                invalidate_patient(result[0])
+            return result
+        
+        def show(result):
+            saved_id, changed = result
+            if patient_id is None:
+                self.parent_app.current_patient_id = saved_id
+                self.mark_tab_loaded(saved_id)
+                self.load_visit_dates()
+                messagebox.showinfo("Успех", f"Пациент сохранен! ID: {saved_id}")
+            elif changed:
+                messagebox.showinfo("Успех", f"Изменения сохранены (полей: {len(changed)})")
+            else:
+                messagebox.showinfo("Информация", "Данные пациента не изменились")
+        
+        self.parent_app.task_runner.submit(
+            save, "Сохранение пациента", on_success=show,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка при сохранении: {str(e)}"),
+            owner=self.notebook)
     
     def load_patient_data(self):
         """Загрузка данных пациента из БД"""
-        # Простой диалов для ввода ID пациента
-        patient_id = simpledialog.askstring("Загрузка пациента", "Введите ID пациента:")
-        if not patient_id:
+        patient_id = ask_patient(self.root, self.parent_app.task_runner, "Загрузка пациента")
+        if patient_id is None:
             return
         
-        try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM patients WHERE id=?", (patient_id,))
-            patient_data = cursor.fetchone()
-            
+        def show(patient_data):
             if patient_data:
-                # Заполнение полей данными из БД
-                fields_mapping = [
-                    'id', 'card_number', 'policy_number', 'surname', 'name', 'patronymic',
-                    'birth_date', 'gender', 'address', 'phone', 'passport',
-                    'series', 'number', 'issued_by', 'snils', 'workplace',
-                    'disability_group', 'blood_group', 'created_date'
-                ]
-                
-                for i, field_name in enumerate(fields_mapping[1:], 1):  # Пропускаем ID
-                    if field_name in self.patient_fields and i < len(patient_data):
-                        field_widget = self.patient_fields[field_name]
-                        if hasattr(field_widget, 'delete') and hasattr(field_widget, 'insert'):
-                            field_widget.delete(0, tk.END)
-                            field_widget.insert(0, patient_data[i] or "")
-                        elif hasattr(field_widget, 'set'):
-                            field_widget.set(patient_data[i] or "")
-                
-                self.parent_app.current_patient_id = patient_data[0]
+                self.apply_patient_fields(patient_data)
+                self.parent_app.current_patient_id = patient_data.id
+                self.mark_tab_loaded(patient_data.id)
+                self.load_visit_dates()
                 messagebox.showinfo("Успех", "Данные пациента загружены!")
             else:
                 messagebox.showwarning("Предупреждение", "Пациент с таким ID не найден!")
+        
+        self.fetch_patient(patient_id, show)
+    
+    def import_patients(self):
+        """Пакетный импорт пациентов и медицинских данных из файла CSV или JSONL"""
+        path = filedialog.askopenfilename(
+            title="Файл для импорта пациентов",
+            filetypes=[("CSV и JSONL", "*.csv *.jsonl *.json"), ("Все файлы", "*.*")])
+        if not path:
+            return
+        replace = messagebox.askyesnocancel(
+            "Повторяющиеся пациенты",
+            "Заменить данные пациентов, номера карт которых уже есть в базе?\n\n"
+            "Да - заменить, Нет - пропустить такие записи")
+        if replace is None:
+            return
+        on_duplicate = 'replace' if replace else 'skip'
+        
+        def run_import(task):
+            def progress(processed):
+                task.check_cancelled()
+                task.report_progress(processed, None, f"Обработано записей: {processed}")
             
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при загрузке: {str(e)}")
+            conn = get_connection()
+            try:
+                return import_file(conn, path, on_duplicate=on_duplicate, progress=progress)
+            finally:
+                conn.close()
+        
+        def show(result):
+            stats, errors = result
+            if stats['replaced']:
+                # Данные замененных пациентов изменились: их прогнозы в кэше устарели
+                prediction_cache.clear()
+                # Открытый пациент мог быть заменен: вкладки перечитываются при показе
+                self.reload_tabs()
+                self.load_visit_dates()
+            text = (f"Импортировано: {stats['imported']}\nЗаменено: {stats['replaced']}\n"
+                    f"Пропущено повторов: {stats['skipped']}\nОтклонено с ошибками: {stats['errors']}")
+            if errors:
+                text += "\n\n" + "\n".join(f"Строка {line_number}: {message}" for line_number, message in errors[:10])
+                if len(errors) > 10:
+                    text += f"\n... и еще {len(errors) - 10}"
+                messagebox.showwarning("Импорт завершен с ошибками", text)
+            else:
+                messagebox.showinfo("Импорт завершен", text)
+        
+        self.parent_app.task_runner.submit(
+            run_import, "Импорт пациентов", on_success=show,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка импорта: {str(e)}"),
+            owner=self.notebook)
+    
+    def load_patient_fields(self, quiet=False):
+        """Заполнение вкладки "Файл" данными текущего пациента при ее открытии"""
+        self.fetch_patient(self.parent_app.current_patient_id,
+                           lambda patient_data: patient_data and self.apply_patient_fields(patient_data))
+    
+    def fetch_patient(self, patient_id, on_success):
+        """Чтение записи пациента в рабочем потоке"""
+        def fetch(task):
+            conn = get_connection()
+            try:
+                return fetch_patient_record(conn, PATIENT_MAPPING, patient_id, key='id')
+            finally:
+                conn.close()
+        
+        self.parent_app.task_runner.submit(
+            fetch, "Загрузка пациента", on_success=on_success,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка при загрузке: {str(e)}"),
+            owner=self.notebook)
+    
+    def apply_patient_fields(self, patient_data):
+        """Заполнение полей вкладки "Файл" данными из БД"""
+        for field_name, field_widget in self.patient_fields.items():
+            value = getattr(patient_data, field_name, None) or ""
+            if hasattr(field_widget, 'delete') and hasattr(field_widget, 'insert'):
+                field_widget.delete(0, tk.END)
+                field_widget.insert(0, value)
+            elif hasattr(field_widget, 'set'):
+                field_widget.set(value)
     
     def clear_patient_data(self):
         """Очистка полей для нового пациента"""
@@ -795,6 +1004,8 @@ class PatientCard:
                 field_widget.set("")
         
         self.parent_app.current_patient_id = None
+        self.mark_tab_loaded(None)
+        self.load_visit_dates()
         messagebox.showinfo("Информация", "Поля очищены для нового пациента")
     
     def show_disease_prediction(self):
@@ -924,7 +1135,7 @@ class PatientCard:
             return
         
         try:
-            conn = sqlite3.connect('medical_system.db')
+            conn = get_connection()
             cursor = conn.cursor()
             
             # Удаляем старые данные если есть
@@ -968,6 +1179,7 @@ class PatientCard:
             
             conn.commit()
             conn.close()
+            invalidate_patient(self.parent_app.current_patient_id)
             messagebox.showinfo("Успех", "Анализ крови сохранен!")
             
         except Exception as e:
@@ -980,7 +1192,7 @@ class PatientCard:
             return
         
         try:
-            conn = sqlite3.connect('medical_system.db')
+            conn = get_connection()
             cursor = conn.cursor()
             
             cursor.execute("SELECT * FROM blood_tests WHERE patient_id=?", (self.parent_app.current_patient_id,))
@@ -1016,7 +1228,7 @@ class PatientCard:
             return
         
         try:
-            conn = sqlite3.connect('medical_system.db')
+            conn = get_connection()
             cursor = conn.cursor()
             
             # Удаляем старые данные если есть
@@ -1058,6 +1270,7 @@ class PatientCard:
             
             conn.commit()
             conn.close()
+            invalidate_patient(self.parent_app.current_patient_id)
             messagebox.showinfo("Успех", "Анализ мочи сохранен!")
             
         except Exception as e:
@@ -1070,7 +1283,7 @@ class PatientCard:
             return
         
         try:
-            conn = sqlite3.connect('medical_system.db')
+            conn = get_connection()
             cursor = conn.cursor()
             
             # Удаляем старые данные если есть
@@ -1100,6 +1313,7 @@ class PatientCard:
             
             conn.commit()
             conn.close()
+            invalidate_patient(self.parent_app.current_patient_id)
             messagebox.showinfo("Успех", "Данные ЭКГ сохранены!")
             
         except Exception as e:
@@ -1112,27 +1326,9 @@ class PatientCard:
             return
         
         try:
-            conn = sqlite3.connect('medical_system.db')
+            conn = get_connection()
             cursor = conn.cursor()
             
-            # Создаем таблицу для ЭХО-КГ если её нет
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS echo_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    lv_edd REAL,
-                    lv_esd REAL,
-                    lv_pw_thickness REAL,
-                    ivs_thickness REAL,
-                    lv_ef REAL,
-                    la_diameter REAL,
-                    rv_diameter REAL,
-                    aorta_diameter REAL,
-                    pa_systolic_pressure REAL,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )
-            ''')
-            
             # Удаляем старые данные если есть
             cursor.execute("DELETE FROM echo_data WHERE patient_id=?", (self.parent_app.current_patient_id,))
             
@@ -1161,6 +1357,7 @@ class PatientCard:
             
             conn.commit()
             conn.close()
+            invalidate_patient(self.parent_app.current_patient_id)
             messagebox.showinfo("Успех", "Данные ЭХО-КГ сохранены!")
             
         except Exception as e:
@@ -0,0 +1,459 @@
+"""Пакетный импорт пациентов и их медицинских данных из CSV или JSONL
+
+Пример запуска:
+    python3 patient_import.py patients.jsonl
+    python3 patient_import.py his_export.csv --on-duplicate replace --errors errors.txt
+
+JSONL: объект на пациента; поля карты пациента - на верхнем уровне, данные
+медицинских таблиц - во вложенных объектах с именем таблицы:
+    {"card_number": "123", "surname": "Иванов", "comorbidities": {"obesity": 1}}
+CSV: строка на пациента; столбцы медицинских таблиц записываются как
+"таблица.столбец", например comorbidities.obesity.
+
+Строки таблиц измерений (анализы, ЭКГ, ЭХО-КГ, анамнез) относятся к визиту
+с датой visit_date (по умолчанию - день импорта): импорт в новую дату
+добавляет визит в историю пациента, в ту же дату - заменяет его данные.
+
+Пациенты сопоставляются по номеру карты: уже существующие в базе
+пропускаются или заменяются (--on-duplicate), повторы внутри файла
+пропускаются с сообщением об ошибке. Записи со СНИЛС другого пациента
+(из базы или из файла) отклоняются с ошибкой.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+from datetime import datetime
+
+from database import configure, get_connection
+from migrations import PATIENT_SEARCH_COLUMNS, PATIENT_TABLES, migrate, upsert_sql
+from visit_history import parse_visit_date, today_visit_date
+
+# Пациентов в одной транзакции
+DEFAULT_BATCH_SIZE = 5000
+
+# Поведение при номере карты, который уже есть в базе
+DUPLICATE_POLICIES = ['skip', 'replace']
+
+REQUIRED_PATIENT_FIELDS = ['card_number', 'surname']
+
+
+class ImportRecordError(ValueError):
+    """Ошибка в записи импортируемого файла"""
+
+
+class TableSchema:
+    """Столбцы таблицы для вставки: порядок, объявленные типы и значения по умолчанию"""
+
+    def __init__(self, conn, table, parent_key=None):
+        self.table = table
+        self.columns = []
+        self.types = {}
+        self.defaults = {}
+        for cid, name, declared_type, notnull, default, pk in conn.execute(f"PRAGMA table_info({table})"):
+            if pk or name == parent_key:
+                continue
+            self.columns.append(name)
+            self.types[name] = declared_type.upper()
+            self.defaults[name] = self.parse_default(default)
+        if 'visit_date' in self.types:
+            # Строка таблицы измерений относится к визиту; без даты в файле - к визиту в день импорта.
+            # Дата визита стоит первой: вместе с id пациента она образует ключ строки
+            self.columns.remove('visit_date')
+            self.columns.insert(0, 'visit_date')
+            self.defaults['visit_date'] = today_visit_date()
+        # Строка, в которой каждое поле имеет значение по умолчанию; запись заменяет в ней только свои поля
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.default_row = [self.defaults[name] for name in self.columns]
+        if parent_key:
+            # Строка медицинской таблицы вставляется с id пациента первым параметром;
+            # существующая строка пациента (или его визита) обновляется на месте
+            if 'visit_date' in self.types:
+                self.insert_sql = upsert_sql(table, [parent_key, 'visit_date'], self.columns[1:])
+            else:
+                self.insert_sql = upsert_sql(table, [parent_key], self.columns)
+        else:
+            self.insert_sql = (f"INSERT INTO {table} ({', '.join(self.columns)}) "
+                               f"VALUES ({', '.join('?' for _ in self.columns)})")
+
+    @staticmethod
+    def parse_default(default):
+        """Значение DEFAULT из PRAGMA table_info: число, строка в кавычках или None"""
+        if default is None:
+            return None
+        if default.startswith("'") and default.endswith("'"):
+            return default[1:-1].replace("''", "'")
+        try:
+            return int(default)
+        except ValueError:
+            pass
+        try:
+            return float(default)
+        except ValueError:
+            return None
+
+    def convert(self, name, value):
+        """Значение поля по объявленному типу столбца; пустая строка - значение по умолчанию"""
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return self.defaults[name]
+        declared_type = self.types[name]
+        try:
+            if name == 'visit_date':
+                return parse_visit_date(value)
+            if 'INT' in declared_type:
+                if isinstance(value, bool):
+                    return int(value)
+                if isinstance(value, str):
+                    value = value.strip().replace(',', '.')
+                number = float(value)
+                if not math.isfinite(number) or number != int(number):
+                    raise ValueError
+                return int(number)
+            if 'REAL' in declared_type:
+                if isinstance(value, str):
+                    value = value.strip().replace(',', '.')
+                number = float(value)
+                if not math.isfinite(number):
+                    raise ValueError
+                return number
+        except (TypeError, ValueError):
+            raise ImportRecordError(f"{self.table}.{name}: недопустимое значение {value!r}")
+        return value if isinstance(value, str) else str(value)
+
+    def row(self, values):
+        """Кортеж значений для insert_sql; неизвестные поля - ошибка записи"""
+        row = self.default_row.copy()
+        index = self.index
+        for name, value in values.items():
+            i = index.get(name)
+            if i is None:
+                unknown = sorted(set(values) - set(index))
+                raise ImportRecordError(f"{self.table}: неизвестные поля {', '.join(unknown)}")
+            row[i] = self.convert(name, value)
+        return tuple(row)
+
+
+def read_jsonl(stream):
+    """Записи JSONL: (номер строки, словарь пациента с вложенными таблицами)"""
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ImportRecordError(f"некорректный JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield line_number, ImportRecordError("ожидается объект JSON")
+            continue
+        yield line_number, record
+
+
+def read_csv(stream):
+    """Записи CSV: столбцы "таблица.столбец" собираются во вложенные словари"""
+    reader = csv.DictReader(stream)
+    # Номер строки файла с учетом заголовка
+    for line_number, row in enumerate(reader, 2):
+        record = {}
+        for column, value in row.items():
+            if column is None:
+                yield line_number, ImportRecordError("лишние значения в строке")
+                break
+            if '.' in column:
+                table, field = column.split('.', 1)
+                record.setdefault(table, {})[field] = value
+            else:
+                record[column] = value
+        else:
+            yield line_number, record
+
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv
+}
+
+
+class PatientImporter:
+    """Импорт записей пакетами: одна транзакция и один executemany на таблицу для пакета"""
+
+    def __init__(self, conn, on_duplicate='skip', batch_size=DEFAULT_BATCH_SIZE):
+        if on_duplicate not in DUPLICATE_POLICIES:
+            raise ValueError(f"Неизвестный режим повторов: {on_duplicate}")
+        self.conn = conn
+        self.on_duplicate = on_duplicate
+        self.batch_size = batch_size
+        self.patients = TableSchema(conn, 'patients')
+        self.tables = {table: TableSchema(conn, table, parent_key='patient_id') for table in PATIENT_TABLES
+                       if conn.execute(f"PRAGMA table_info({table})").fetchone() is not None}
+        self.stats = {'imported': 0, 'replaced': 0, 'skipped': 0, 'errors': 0}
+        self.errors = []
+        # Номера карт, уже встреченные в файле
+        self.seen_cards = set()
+        # СНИЛС, уже встреченные в файле: {СНИЛС: номер карты}
+        self.seen_snils = {}
+
+    def prepare(self, record):
+        """Проверка записи: (номер карты, строка patients, {поле: значение} из записи, {таблица: строка})
+
+        Поля из записи - только присутствующие в ней столбцы карты: замена
+        существующего пациента обновляет их и не трогает остальные.
+        """
+        record = dict(record)
+        tables = {}
+        for table in [key for key, value in record.items() if isinstance(value, dict)]:
+            if table not in self.tables:
+                raise ImportRecordError(f"неизвестная таблица {table}")
+            values = record.pop(table)
+            # Раздел без единого значения (пустые столбцы CSV) не создает строку таблицы
+            if any(value not in (None, '') for value in values.values()):
+                tables[table] = self.tables[table].row(values)
+
+        record.pop('id', None)
+        for field in REQUIRED_PATIENT_FIELDS:
+            if not str(record.get(field) or '').strip():
+                raise ImportRecordError(f"не заполнено обязательное поле {field}")
+        record['card_number'] = str(record['card_number']).strip()
+        # Дата создания карты существующего пациента при замене не меняется
+        supplied = set(record) - {'created_date'}
+        if not record.get('created_date'):
+            record['created_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        patient_row = self.patients.row(record)
+        fields = {name: value for name, value in zip(self.patients.columns, patient_row) if name in supplied}
+        return record['card_number'], patient_row, fields, tables
+
+    def run(self, records, progress=None):
+        """Импорт последовательности (номер строки, запись или ImportRecordError)
+
+        progress(обработано записей) вызывается после каждого пакета и может
+        прервать импорт исключением; уже зафиксированные пакеты остаются в базе.
+        """
+        processed = 0
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                break
+            checked = []
+            for line_number, record in batch:
+                try:
+                    if isinstance(record, ImportRecordError):
+                        raise record
+                    checked.append((line_number, self.prepare(record)))
+                except ImportRecordError as e:
+                    self.reject(line_number, e)
+            self.write_batch(checked)
+            processed += len(batch)
+            if progress:
+                progress(processed)
+        return self.stats
+
+    def reject(self, line_number, error):
+        """Запись отклонена: сообщение в список ошибок"""
+        self.errors.append((line_number, str(error)))
+        self.stats['errors'] += 1
+
+    def accept(self, checked):
+        """Записи пакета без повторов номера карты и СНИЛС: [(номер строки, запись)] -> [запись]
+
+        СНИЛС сверяются с уже прочитанными записями файла и одним запросом -
+        с базой; СНИЛС пациента с тем же номером карты повтором не считается.
+        """
+        snils_owners = self.existing_snils([entry[2].get('snils') for line_number, entry in checked])
+        accepted = []
+        for line_number, entry in checked:
+            card_number, snils = entry[0], entry[2].get('snils')
+            try:
+                if card_number in self.seen_cards:
+                    raise ImportRecordError(f"номер карты {card_number} повторяется в файле")
+                if snils is not None and self.seen_snils.get(snils, card_number) != card_number:
+                    raise ImportRecordError(f"СНИЛС {snils} повторяется в файле "
+                                            f"(номер карты {self.seen_snils[snils]})")
+                if snils is not None and snils_owners.get(snils, card_number) != card_number:
+                    raise ImportRecordError(f"СНИЛС {snils} уже есть в базе "
+                                            f"у пациента с номером карты {snils_owners[snils]}")
+            except ImportRecordError as e:
+                self.reject(line_number, e)
+                continue
+            self.seen_cards.add(card_number)
+            if snils is not None:
+                self.seen_snils[snils] = card_number
+            accepted.append(entry)
+        return accepted
+
+    def existing_snils(self, snils_values):
+        """Пациенты базы с указанными СНИЛС: {СНИЛС: номер карты}"""
+        cursor = self.conn.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS import_snils (snils TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM temp.import_snils")
+        cursor.executemany("INSERT OR IGNORE INTO temp.import_snils (snils) VALUES (?)",
+                           ((snils,) for snils in snils_values if snils is not None))
+        cursor.execute("SELECT p.snils, p.card_number FROM patients p "
+                       "JOIN temp.import_snils s ON s.snils = p.snils")
+        owners = dict(cursor.fetchall())
+        cursor.execute("DELETE FROM temp.import_snils")
+        return owners
+
+    def existing_patients(self, card_numbers):
+        """Пациенты базы с указанными номерами карт: {номер карты: id}"""
+        cursor = self.conn.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS import_cards (card_number TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM temp.import_cards")
+        cursor.executemany("INSERT OR IGNORE INTO temp.import_cards (card_number) VALUES (?)",
+                           ((card_number,) for card_number in card_numbers))
+        cursor.execute("SELECT p.card_number, p.id FROM patients p "
+                       "JOIN temp.import_cards c ON c.card_number = p.card_number")
+        existing = dict(cursor.fetchall())
+        cursor.execute("DELETE FROM temp.import_cards")
+        return existing
+
+    def write_batch(self, checked):
+        """Запись пакета [(номер строки, запись)] одной транзакцией"""
+        if not checked:
+            return
+        conn = self.conn
+        if not conn.in_transaction:
+            # Блокировка на запись берется сразу: пакет не прерывается на середине чужой
+            # записью, а проверка повторов СНИЛС видит ту же базу, что и вставка
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            prepared = self.accept(checked)
+            existing = self.existing_patients([entry[0] for entry in prepared])
+            new = [entry for entry in prepared if entry[0] not in existing]
+            duplicates = [entry for entry in prepared if entry[0] in existing]
+
+            if self.on_duplicate == 'replace' and duplicates:
+                # В карте пациента обновляются только поля из записи, медицинские данные
+                # заменяются данными файла для таблиц, которые есть в записи, как при
+                # сохранении вкладки
+                updates = {}
+                for card_number, row, fields, tables in duplicates:
+                    updates.setdefault(tuple(fields), []).append(tuple(fields.values()) + (existing[card_number],))
+                for columns, params in updates.items():
+                    conn.executemany(
+                        f"UPDATE patients SET {', '.join(f'{name} = ?' for name in columns)} WHERE id = ?", params)
+                self.insert_tables(duplicates, existing)
+
+            if new:
+                self.insert_patients([entry[1] for entry in new])
+                ids = self.existing_patients([entry[0] for entry in new])
+                self.insert_tables(new, ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        self.stats['imported'] += len(new)
+        if self.on_duplicate == 'replace':
+            self.stats['replaced'] += len(duplicates)
+        else:
+            self.stats['skipped'] += len(duplicates)
+
+    def insert_patients(self, rows):
+        """Вставка карт пациентов пакета с одним пополнением поискового индекса
+
+        Триггер индекса FTS5 на время вставки снимается, а новые строки
+        добавляются в индекс одним запросом: это в несколько раз быстрее
+        построчного триггера. Снятие и восстановление триггера выполняются
+        в транзакции пакета, поэтому при ошибке откатываются вместе с ней.
+        """
+        conn = self.conn
+        trigger = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' "
+                               "AND name = 'trg_patients_fts_insert'").fetchone()
+        if trigger is None:
+            conn.executemany(self.patients.insert_sql, rows)
+            return
+
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM patients").fetchone()[0]
+        conn.execute("DROP TRIGGER trg_patients_fts_insert")
+        conn.executemany(self.patients.insert_sql, rows)
+        columns = ', '.join(PATIENT_SEARCH_COLUMNS)
+        conn.execute(f"INSERT INTO patients_fts (rowid, {columns}) SELECT id, {columns} FROM patients WHERE id > ?",
+                     (last_id,))
+        conn.execute(trigger[0])
+
+    def insert_tables(self, entries, ids):
+        """Вставка строк медицинских таблиц пакета: один executemany на таблицу"""
+        for table, schema in self.tables.items():
+            rows = [(ids[card_number],) + tables[table] for card_number, row, fields, tables in entries
+                    if table in tables]
+            if rows:
+                self.conn.executemany(schema.insert_sql, rows)
+
+
+def detect_format(path):
+    """Формат файла по расширению: .jsonl/.json - JSONL, иначе CSV"""
+    extension = os.path.splitext(path)[1].lower()
+    return 'jsonl' if extension in ('.jsonl', '.json', '.ndjson') else 'csv'
+
+
+def import_file(conn, path, file_format=None, on_duplicate='skip', batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Импорт файла; возвращает (счетчики, ошибки [(номер строки, текст)])"""
+    file_format = file_format or detect_format(path)
+    importer = PatientImporter(conn, on_duplicate, batch_size)
+    # utf-8-sig: выгрузки из Excel и МИС часто начинаются с BOM
+    with open(path, 'r', encoding='utf-8-sig', newline='') as stream:
+        importer.run(READERS[file_format](stream), progress)
+    return importer.stats, importer.errors
+
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Пакетный импорт пациентов и медицинских данных из CSV или JSONL")
+    parser.add_argument('input', help="файл CSV или JSONL")
+    parser.add_argument('--db', help="путь к базе данных (по умолчанию MEDICAL_DB_PATH или medical_system.db)")
+    parser.add_argument('--format', '-f', choices=sorted(READERS), help="формат файла (по умолчанию по расширению)")
+    parser.add_argument('--on-duplicate', choices=DUPLICATE_POLICIES, default='skip',
+                        help="пациент с номером карты, который уже есть в базе: пропустить (по умолчанию) "
+                             "или заменить его данные")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="количество пациентов в одной транзакции")
+    parser.add_argument('--errors', help="файл для списка отклоненных записей (по умолчанию stderr)")
+    parser.add_argument('--quiet', '-q', action='store_true', help="не выводить прогресс")
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size должен быть положительным")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db:
+        configure(args.db)
+
+    def progress(processed):
+        sys.stderr.write(f"\rОбработано записей: {processed}")
+        sys.stderr.flush()
+
+    conn = get_connection()
+    try:
+        migrate(conn)
+        stats, errors = import_file(conn, args.input, args.format, args.on_duplicate, args.batch_size,
+                                    None if args.quiet else progress)
+    except KeyboardInterrupt:
+        print("\nПрервано; пакеты, записанные до прерывания, сохранены", file=sys.stderr)
+        return 130
+    except OSError as e:
+        print(f"Ошибка чтения файла: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    if not args.quiet:
+        sys.stderr.write("\n")
+    if errors:
+        stream = open(args.errors, 'w', encoding='utf-8') if args.errors else sys.stderr
+        for line_number, message in errors:
+            stream.write(f"Строка {line_number}: {message}\n")
+        if args.errors:
+            stream.close()
+    print(f"Импортировано: {stats['imported']}, заменено: {stats['replaced']}, "
+          f"пропущено повторов: {stats['skipped']}, отклонено с ошибками: {stats['errors']}", file=sys.stderr)
+    return 0 if not errors else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Выбор пациента: поиск при вводе по ФИО и номерам документов с подгрузкой по страницам"""
+import re
+import tkinter as tk
+from database import get_connection
+from migrations import PATIENT_SEARCH_COLUMNS
+from row_mapping import RecordMapping, compile_mapping
+
+# Число пациентов, читаемых из базы за один запрос
+PAGE_SIZE = 50
+# Пауза после последнего нажатия клавиши до запуска поиска, мс
+SEARCH_DELAY = 250
+
+# Поля строки списка пациентов
+PICKER_MAPPING = RecordMapping('patients', ['id', 'surname', 'name', 'patronymic', 'birth_date', 'card_number'])
+
+
+def search_terms(text):
+    """Слова запроса: буквы и цифры, разделители (дефисы и пробелы СНИЛС) отбрасываются"""
+    return re.findall(r'\w+', text)
+
+
+def has_search_index(conn):
+    """Есть ли в базе индекс FTS5 (его нет, если SQLite собран без FTS5)"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'").fetchone() is not None
+
+
+def search_patients(conn, text, after_id=0, limit=PAGE_SIZE):
+    """Страница пациентов, подходящих под запрос, в порядке id
+
+    Каждое слово запроса ищется как начало слова в ФИО, номере карты, полиса
+    или СНИЛС. Возвращает (записи, after_id следующей страницы или None, если
+    страниц больше нет). Число из одних цифр дополнительно ищется как ID
+    пациента; такой пациент стоит первым на первой странице.
+    """
+    compiled = compile_mapping(conn, PICKER_MAPPING)
+    terms = search_terms(text)
+    select = compiled.select_list('p')
+
+    if not terms:
+        rows = conn.execute(f"SELECT {select} FROM patients p WHERE p.id > ? ORDER BY p.id LIMIT ?",
+                            (after_id, limit)).fetchall()
+    elif has_search_index(conn):
+        # Индекс отдает rowid по возрастанию, поэтому LIMIT останавливает поиск
+        # на первой странице, даже если под запрос подходят все пациенты
+        query = ' '.join(f'"{term}"*' for term in terms)
+        rows = conn.execute(f"""
+            SELECT {select} FROM patients_fts f JOIN patients p ON p.id = f.rowid
+            WHERE patients_fts MATCH ? AND f.rowid > ?
+            ORDER BY f.rowid LIMIT ?
+        """, (query, after_id, limit)).fetchall()
+    else:
+        conditions = []
+        params = []
+        for term in terms:
+            pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append('(' + ' OR '.join(f"p.{column} LIKE ? ESCAPE '\\'"
+                                                 for column in PATIENT_SEARCH_COLUMNS) + ')')
+            params.extend([pattern] * len(PATIENT_SEARCH_COLUMNS))
+        rows = conn.execute(f"SELECT {select} FROM patients p WHERE {' AND '.join(conditions)} AND p.id > ? "
+                            f"ORDER BY p.id LIMIT ?", params + [after_id, limit]).fetchall()
+
+    records = [compiled.make(row) for row in rows]
+    next_after = records[-1].id if len(records) == limit else None
+
+    if after_id == 0 and len(terms) == 1 and terms[0].isdigit():
+        row = conn.execute(f"SELECT {select} FROM patients p WHERE p.id = ?", (int(terms[0]),)).fetchone()
+        if row is not None:
+            by_id = compiled.make(row)
+            records = [by_id] + [record for record in records if record.id != by_id.id]
+
+    return records, next_after
+
+
+def format_patient(record):
+    """Строка списка: ID, ФИО, дата рождения и номер карты"""
+    text = f"{record.id} - " + ' '.join(part for part in (record.surname, record.name, record.patronymic) if part)
+    details = []
+    if record.birth_date:
+        details.append(record.birth_date)
+    if record.card_number:
+        details.append(f"карта {record.card_number}")
+    if details:
+        text += f" ({', '.join(details)})"
+    return text
+
+
+class PatientPicker:
+    """Поле поиска и список пациентов, дочитываемый при прокрутке до конца
+
+    Поиск и чтение страниц выполняются в рабочем потоке task_runner;
+    ответ на устаревший запрос (пользователь продолжил ввод) отбрасывается.
+    on_choose(patient_id) вызывается двойным щелчком или Enter в списке.
+    """
+
+    def __init__(self, parent, task_runner, on_choose=None, height=8):
+        self.task_runner = task_runner
+        self.on_choose = on_choose
+        self.records = []
+        self.query = ''
+        self.next_after = None
+        self.task = None
+        # Номер текущего запроса: страницы старых запросов не показываются
+        self.generation = 0
+        self.search_job = None
+
+        self.frame = tk.Frame(parent)
+
+        self.search_var = tk.StringVar()
+        self.entry = tk.Entry(self.frame, textvariable=self.search_var, font=('Arial', 14), width=50)
+        self.entry.pack(fill='x', pady=(0, 5))
+        self.entry.bind('<KeyRelease>', self.schedule_search)
+        self.entry.bind('<Return>', lambda event: self.search())
+        self.entry.bind('<Down>', lambda event: self.focus_list())
+
+        list_frame = tk.Frame(self.frame)
+        list_frame.pack(fill='both', expand=True)
+        scrollbar = tk.Scrollbar(list_frame)
+        scrollbar.pack(side='right', fill='y')
+        self.scrollbar = scrollbar
+        self.listbox = tk.Listbox(list_frame, font=('Arial', 14), height=height, exportselection=False,
+                                  yscrollcommand=self.on_scroll)
+        self.listbox.pack(side='left', fill='both', expand=True)
+        scrollbar.config(command=self.listbox.yview)
+        self.listbox.bind('<Double-Button-1>', self.choose)
+        self.listbox.bind('<Return>', self.choose)
+
+        self.status_label = tk.Label(self.frame, font=('Arial', 10), fg='gray', anchor='w')
+        self.status_label.pack(fill='x')
+
+        self.search()
+
+    def schedule_search(self, event=None):
+        """Отложенный поиск: запрос уходит в базу после паузы во вводе"""
+        if self.search_var.get().strip() == self.query:
+            return
+        if self.search_job is not None:
+            self.frame.after_cancel(self.search_job)
+        self.search_job = self.frame.after(SEARCH_DELAY, self.search)
+
+    def search(self):
+        """Новый поиск по тексту поля с первой страницы"""
+        self.search_job = None
+        self.query = self.search_var.get().strip()
+        self.generation += 1
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.records = []
+        self.next_after = None
+        self.listbox.delete(0, tk.END)
+        self.status_label.config(text="Поиск...")
+        self.load_page(0)
+
+    def load_page(self, after_id):
+        """Чтение следующей страницы текущего запроса"""
+        query = self.query
+        generation = self.generation
+
+        def fetch(task):
+            conn = get_connection()
+            try:
+                return search_patients(conn, query, after_id)
+            finally:
+                conn.close()
+
+        self.task = self.task_runner.submit(
+            fetch, "Поиск пациентов", on_success=lambda result: self.show_page(generation, result),
+            owner=self.listbox, show_progress=False)
+
+    def show_page(self, generation, result):
+        """Добавление страницы в список (в главном потоке)"""
+        if generation != self.generation:
+            return
+        self.task = None
+        records, self.next_after = result
+        for record in records:
+            self.records.append(record)
+            self.listbox.insert(tk.END, format_patient(record))
+
+        if not self.records:
+            self.status_label.config(text="Пациенты не найдены")
+        elif self.next_after is not None:
+            self.status_label.config(text=f"Показано {len(self.records)}, прокрутите список вниз для продолжения")
+        else:
+            self.status_label.config(text=f"Найдено: {len(self.records)}")
+
+        # Список короче окна: прокрутки не будет, поэтому следующая страница читается сразу
+        self.on_scroll(*self.listbox.yview())
+
+    def on_scroll(self, first, last):
+        """Прокрутка списка до конца подгружает следующую страницу"""
+        self.scrollbar.set(first, last)
+        if float(last) >= 1.0 and self.next_after is not None and self.task is None:
+            self.load_page(self.next_after)
+
+    def focus_list(self):
+        """Переход из поля поиска к списку"""
+        if self.records:
+            self.listbox.focus_set()
+            if not self.listbox.curselection():
+                self.listbox.selection_set(0)
+                self.listbox.activate(0)
+
+    def get_patient_id(self):
+        """ID выбранного пациента или None"""
+        selection = self.listbox.curselection()
+        if not selection:
+            return None
+        return self.records[selection[0]].id
+
+    def choose(self, event=None):
+        patient_id = self.get_patient_id()
+        if patient_id is not None and self.on_choose is not None:
+            self.on_choose(patient_id)
+
+
+def ask_patient(parent, task_runner, title):
+    """Модальное окно выбора пациента; возвращает ID или None при отмене"""
+    dialog = tk.Toplevel(parent)
+    dialog.title(title)
+    dialog.transient(parent)
+    result = {'patient_id': None}
+
+    def choose(patient_id):
+        result['patient_id'] = patient_id
+        dialog.destroy()
+
+    tk.Label(dialog, text="Введите ФИО, номер карты, полиса, СНИЛС или ID:",
+             font=('Arial', 14)).pack(anchor='w', padx=10, pady=(10, 5))
+
+    picker = PatientPicker(dialog, task_runner, on_choose=choose)
+    picker.frame.pack(fill='both', expand=True, padx=10)
+
+    btn_frame = tk.Frame(dialog)
+    btn_frame.pack(fill='x', padx=10, pady=10)
+    tk.Button(btn_frame, text="Выбрать", font=('Arial', 14),
+              command=picker.choose).pack(side='left', padx=5)
+    tk.Button(btn_frame, text="Отмена", font=('Arial', 14),
+              command=dialog.destroy).pack(side='left', padx=5)
+
+    picker.entry.focus_set()
+    dialog.grab_set()
+    dialog.wait_window()
+    return result['patient_id']
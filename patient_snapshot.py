@@ -0,0 +1,152 @@
+from typing import NamedTuple, Optional
+
+from row_mapping import RecordMapping, compile_mapping, get_schema_key
+
+# Поле снимка -> таблица, из которой берется текущая запись пациента (последний визит)
+SNAPSHOT_TABLES = [
+    ('anamnesis', 'anamnesis_extended'),
+    ('anamnesis_legacy', 'anamnesis'),
+    ('comorbidities', 'comorbidities'),
+    ('blood_tests', 'blood_tests'),
+    ('blood_tests_extended', 'blood_tests_extended'),
+    ('urine_tests', 'urine_tests'),
+    ('ecg', 'ecg_data'),
+    ('echo', 'echo_data')
+]
+
+# Отображения по умолчанию: все столбцы всех таблиц снимка
+SNAPSHOT_MAPPINGS = dict([('patient', RecordMapping('patients'))] +
+                         [(field, RecordMapping(table)) for field, table in SNAPSHOT_TABLES])
+
+DATA_VERSION_MAPPING = RecordMapping('patient_data_versions', ['data_version'])
+
+
+class PatientSnapshot(NamedTuple):
+    """Снимок всех данных пациента, загруженный за один проход
+
+    Записи - именованные кортежи, поля которых названы по столбцам таблиц.
+    """
+    patient: tuple
+    anamnesis: Optional[tuple] = None
+    anamnesis_legacy: Optional[tuple] = None
+    comorbidities: Optional[tuple] = None
+    blood_tests: Optional[tuple] = None
+    blood_tests_extended: Optional[tuple] = None
+    urine_tests: Optional[tuple] = None
+    ecg: Optional[tuple] = None
+    echo: Optional[tuple] = None
+    data_version: int = 0
+
+
+def compile_snapshot_mappings(conn, mappings=None):
+    """Скомпилированные отображения снимка для текущей схемы: (отображение пациента, [(поле, отображение)], версия данных)
+
+    mappings - словарь поле снимка -> RecordMapping; загружаются только
+    перечисленные поля, None - все таблицы снимка со всеми столбцами.
+    Таблицы, которых нет в базе, пропускаются.
+    """
+    mappings = mappings or SNAPSHOT_MAPPINGS
+    schema_key = get_schema_key(conn)
+    patient = compile_mapping(conn, mappings.get('patient', SNAPSHOT_MAPPINGS['patient']), schema_key)
+    tables = []
+    for field, table in SNAPSHOT_TABLES:
+        if field in mappings:
+            compiled = compile_mapping(conn, mappings[field], schema_key)
+            if compiled.table_exists:
+                tables.append((field, compiled))
+    data_version = compile_mapping(conn, DATA_VERSION_MAPPING, schema_key)
+    return patient, tables, data_version.table_exists
+
+
+def current_row_query(compiled, patient_column):
+    """Подзапрос id текущей строки пациента: последний визит или первая запись таблицы"""
+    return (f"SELECT d.id FROM {compiled.table} d WHERE d.patient_id = {patient_column} "
+            f"ORDER BY {compiled.order_by('d')} LIMIT 1")
+
+
+def load_snapshot(conn, patient_id, mappings=None):
+    """Загрузка снимка одного пациента одним запросом с LEFT JOIN всех таблиц"""
+    patient, tables, has_versions = compile_snapshot_mappings(conn, mappings)
+
+    # Перед столбцами каждой таблицы стоит признак наличия записи: поля записи
+    # могут быть NULL и тогда, когда сама запись есть
+    columns = [patient.select_list('p')]
+    joins = []
+    for i, (field, compiled) in enumerate(tables):
+        columns.append(f't{i}.id IS NOT NULL')
+        columns.append(compiled.select_list(f't{i}'))
+        joins.append(f"LEFT JOIN {compiled.table} t{i} ON t{i}.id = "
+                     f"({current_row_query(compiled, 'p.id')})")
+
+    # Версия входных данных прогноза читается тем же запросом, что и сами данные
+    if has_versions:
+        columns.append("COALESCE((SELECT data_version FROM patient_data_versions "
+                       "WHERE patient_id = p.id), 0)")
+
+    query = f"SELECT {', '.join(columns)} FROM patients p {' '.join(joins)} WHERE p.id = ?"
+    row = conn.execute(query, (patient_id,)).fetchone()
+    if not row:
+        return None
+
+    # Строка результата делится обратно на записи по числу столбцов отображений
+    start = len(patient.fields)
+    records = {'patient': patient.make(row[:start])}
+    for field, compiled in tables:
+        end = start + 1 + len(compiled.fields)
+        records[field] = compiled.make(row[start + 1:end]) if row[start] else None
+        start = end
+    if has_versions:
+        records['data_version'] = row[-1]
+
+    return PatientSnapshot(**records)
+
+
+def load_snapshots(conn, patient_ids, mappings=None):
+    """Пакетная загрузка снимков: по одному запросу на таблицу для всего списка пациентов"""
+    patient, tables, has_versions = compile_snapshot_mappings(conn, mappings)
+    cursor = conn.cursor()
+    in_transaction = conn.in_transaction
+
+    # Список пациентов помещается во временную таблицу, чтобы каждая
+    # таблица данных читалась одним проходом, а не запросом на пациента
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS snapshot_ids (id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.snapshot_ids")
+    cursor.executemany("INSERT OR IGNORE INTO temp.snapshot_ids (id) VALUES (?)",
+                       ((int(patient_id),) for patient_id in patient_ids))
+
+    records = {}
+    cursor.execute(f"SELECT p.id, {patient.select_list('p')} FROM patients p "
+                   f"JOIN temp.snapshot_ids s ON s.id = p.id")
+    for row in cursor:
+        records[row[0]] = {'patient': patient.make(row[1:])}
+
+    for field, compiled in tables:
+        # Для каждого пациента читается одна строка через индекс, а не вся история визитов
+        cursor.execute(f"SELECT s.id, {compiled.select_list('t')} FROM temp.snapshot_ids s "
+                       f"JOIN {compiled.table} t ON t.id = ({current_row_query(compiled, 's.id')})")
+        for row in cursor:
+            patient_records = records.get(row[0])
+            if patient_records is not None:
+                patient_records[field] = compiled.make(row[1:])
+
+    # Все чтения выполняются в одной транзакции, открытой записью во временную
+    # таблицу, поэтому версия данных соответствует прочитанным записям
+    if has_versions:
+        cursor.execute("SELECT v.patient_id, v.data_version FROM patient_data_versions v "
+                       "JOIN temp.snapshot_ids s ON s.id = v.patient_id")
+        for patient_id, data_version in cursor:
+            if patient_id in records:
+                records[patient_id]['data_version'] = data_version
+
+    cursor.execute("DELETE FROM temp.snapshot_ids")
+    if not in_transaction:
+        # Завершаем неявную транзакцию, открытую записью во временную таблицу
+        conn.commit()
+
+    # Порядок результата совпадает с порядком запрошенных идентификаторов
+    snapshots = {}
+    for patient_id in patient_ids:
+        patient_id = int(patient_id)
+        if patient_id in records and patient_id not in snapshots:
+            snapshots[patient_id] = PatientSnapshot(**records[patient_id])
+    return snapshots
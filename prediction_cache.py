@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Размер и время жизни кэша по умолчанию: прогноз пересчитывается не реже чем раз в 10 минут
+DEFAULT_MAX_SIZE = 256
+DEFAULT_TTL = 600.0
+
+
+class PredictionCache:
+    """LRU-кэш прогнозов пациентов в памяти процесса с ограничением размера и времени жизни"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, patient_id, model_version):
+        """Прогноз из кэша или None; устаревшая запись удаляется"""
+        key = (patient_id, model_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, patient_id, model_version, predictions):
+        """Сохранение прогноза; при переполнении вытесняется давно не использованная запись"""
+        key = (patient_id, model_version)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), predictions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, patient_id):
+        """Удаление прогнозов пациента для всех версий модели"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == patient_id]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def clear(self):
+        """Очистка кэша без сброса счетчиков"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Счетчики кэша для настройки размера и времени жизни"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+# Общий кэш процесса: экран прогноза читает его, методы сохранения данных пациента сбрасывают
+prediction_cache = PredictionCache()
+
+
+def invalidate_patient(patient_id):
+    """Сброс кэшированных прогнозов пациента после изменения его данных"""
+    if patient_id is not None:
+        prediction_cache.invalidate(int(patient_id))
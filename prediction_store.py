@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+
+from database import get_connection
+from neural_network import FACTOR_NAMES, MODEL_VERSION
+
+# Веса битов маски факторов риска: бит i соответствует FACTOR_NAMES[i]
+FACTOR_BITS = np.left_shift(np.int64(1), np.arange(len(FACTOR_NAMES), dtype=np.int64))
+
+# Условие "прогноза нет или он устарел" для запроса с псевдонимами
+# pt (patients), v (patient_data_versions) и pr (predictions)
+STALE_JOIN = ("LEFT JOIN patient_data_versions v ON v.patient_id = pt.id "
+              "LEFT JOIN predictions pr ON pr.patient_id = pt.id AND pr.model_version = ?")
+STALE_CONDITION = "(pr.patient_id IS NULL OR pr.data_version != COALESCE(v.data_version, 0))"
+
+
+class PredictionStore:
+    """Хранилище рассчитанных прогнозов: таблица predictions с ключом (пациент, версия модели)"""
+
+    def __init__(self, model_version=MODEL_VERSION):
+        self.model_version = model_version
+
+    def save_cohort(self, conn, cohort):
+        """Сохранение прогнозов когорты вместе с версиями данных, по которым они рассчитаны
+
+        Версия модели берется из когорты (модель, которая рассчитала риски),
+        а если ее там нет - версия хранилища.
+        """
+        model_version = cohort.get('model_version', self.model_version)
+        networks = cohort['networks']
+        masks = cohort['features'].astype(np.int64) @ FACTOR_BITS
+        imputed_masks = cohort['imputed'].astype(np.int64) @ FACTOR_BITS
+        rows = (
+            (patient_id, model_version, data_version,
+             json.dumps(dict(zip(networks, patient_risks))), mask, imputed_mask)
+            for patient_id, data_version, patient_risks, mask, imputed_mask in zip(
+                cohort['patient_ids'].tolist(), cohort['data_versions'].tolist(),
+                cohort['risks'].tolist(), masks.tolist(), imputed_masks.tolist())
+        )
+        conn.executemany("""
+            INSERT OR REPLACE INTO predictions (patient_id, model_version, data_version, risks, factors, imputed)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+
+    def load(self, conn, patient_id, model_version=None):
+        """Актуальный сохраненный прогноз пациента в формате predict_cohort или None
+
+        Один запрос по первичным ключам predictions и patient_data_versions;
+        прогноз, рассчитанный по старой версии данных, не возвращается.
+        """
+        row = conn.execute("""
+            SELECT pr.data_version, pr.risks, pr.factors, pr.imputed FROM predictions pr
+            LEFT JOIN patient_data_versions v ON v.patient_id = pr.patient_id
+            WHERE pr.patient_id = ? AND pr.model_version = ?
+              AND pr.data_version = COALESCE(v.data_version, 0)
+        """, (patient_id, model_version or self.model_version)).fetchone()
+        if not row:
+            return None
+
+        data_version, risks, mask, imputed_mask = row
+        risks = json.loads(risks)
+        networks = list(risks)
+        return {
+            'patient_ids': np.array([patient_id], dtype=np.int64),
+            'networks': networks,
+            'features': ((mask & FACTOR_BITS) != 0)[np.newaxis, :],
+            'imputed': ((imputed_mask & FACTOR_BITS) != 0)[np.newaxis, :],
+            'risks': np.array([[risks[network] for network in networks]]),
+            'data_versions': np.array([data_version], dtype=np.int64),
+            'model_version': model_version or self.model_version
+        }
+
+    def predict(self, predictor, patient_id, active=None):
+        """Прогноз пациента: сохраненный, если данные не менялись, иначе новый расчет с сохранением
+
+        Прогноз ищется и рассчитывается для модели predictor.active (или
+        переданной active), поэтому замена модели не требует нового хранилища.
+        """
+        active = active or predictor.active
+        conn = get_connection()
+        try:
+            cohort = self.load(conn, patient_id, active[1])
+            if cohort is None:
+                cohort = predictor.predict_cohort([patient_id], active)
+                if not len(cohort['patient_ids']):
+                    return None
+                self.save_cohort(conn, cohort)
+                conn.commit()
+        finally:
+            conn.close()
+
+        return predictor.get_cohort_predictions(cohort, 0)
@@ -1,8 +1,14 @@
 import tkinter as tk
-from tkinter import messagebox, filedialog
-import sqlite3
+from tkinter import messagebox, filedialog, simpledialog
+from database import get_connection
 from datetime import datetime
+import multiprocessing
 import os
+from bulk_export import export_reports, parse_id_spec, select_ids_by_spec
+from data_export import export_tables
+from patient_snapshot import load_snapshot
+from report_writer import (PRINT_MAPPINGS, iter_export_report, iter_full_report, iter_medical_data,
+                           iter_patient_card, render, snapshot_report_data, write_report)
 
 class PrintModule:
     def __init__(self, parent_app):
@@ -51,456 +57,68 @@ class PrintModule:
                  font=('Arial', 16), width=25, height=2,
                  command=print_window.destroy).pack(pady=10)
     
-    def get_patient_data(self):
-        """Получение данных пациента из БД"""
+    def get_patient_data(self, patient_id):
+        """Получение данных пациента из БД (выполняется в рабочем потоке)"""
+        conn = get_connection()
         try:
-            conn = sqlite3.connect('medical_system.db')
-            cursor = conn.cursor()
-            
-            # Основные данные пациента
-            cursor.execute("SELECT * FROM patients WHERE id=?", (self.parent_app.current_patient_id,))
-            patient_data = cursor.fetchone()
-            
-            if not patient_data:
-                return None
-            
-            # Данные анамнеза (новая таблица)
-            cursor.execute("SELECT * FROM anamnesis_extended WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            anamnesis_data = cursor.fetchone()
-            
-            # Если нет в новой таблице, проверяем старую
-            if not anamnesis_data:
-                cursor.execute("SELECT * FROM anamnesis WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            anamnesis_data = cursor.fetchone()
-            
-            # Коморбидные состояния
-            cursor.execute("SELECT * FROM comorbidities WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            comorbidities_data = cursor.fetchone()
-            
-            # Анализы крови (пробуем загрузить из расширенной таблицы)
-            cursor.execute("SELECT * FROM blood_tests_extended WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            blood_data = cursor.fetchone()
-            
-            # Если нет в расширенной таблице, проверяем старую
-            if not blood_data:
-                cursor.execute("SELECT * FROM blood_tests WHERE patient_id=?", (self.parent_app.current_patient_id,))
-                blood_data = cursor.fetchone()
-            
-            # Анализы мочи
-            cursor.execute("SELECT * FROM urine_tests WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            urine_data = cursor.fetchone()
-            
-            # ЭКГ данные
-            cursor.execute("SELECT * FROM ecg_data WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            ecg_data = cursor.fetchone()
-            
-            # ЭХО-КГ данные
-            cursor.execute("SELECT * FROM echo_data WHERE patient_id=?", (self.parent_app.current_patient_id,))
-            echo_data = cursor.fetchone()
-            
+            snapshot = load_snapshot(conn, patient_id, PRINT_MAPPINGS)
+        finally:
             conn.close()
-            
-            return {
-                'patient': patient_data,
-                'anamnesis': anamnesis_data,
-                'comorbidities': comorbidities_data,
-                'blood': blood_data,
-                'urine': urine_data,
-                'ecg': ecg_data,
-                'echo': echo_data
-            }
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при получении данных: {str(e)}")
+        
+        if not snapshot:
             return None
+        
+        return snapshot_report_data(snapshot)
+    
+    def run_report(self, build_report, title, on_success=None, error_message="Ошибка при получении данных"):
+        """Загрузка данных и сборка отчета в рабочем потоке, показ результата в главном"""
+        patient_id = self.parent_app.current_patient_id
+        
+        def build(task):
+            data = self.get_patient_data(patient_id)
+            if not data:
+                return None
+            task.check_cancelled()
+            return build_report(data)
+        
+        def show(report):
+            if report is None:
+                return
+            if on_success is not None:
+                on_success(report)
+            else:
+                self.show_print_preview(report, title)
+        
+        self.parent_app.task_runner.submit(
+            build, f"Подготовка отчета: {title}", on_success=show,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"{error_message}: {str(e)}"))
     
     def print_patient_card(self, parent_window):
         """Печать карты пациента (основные данные)"""
         parent_window.destroy()
-        
-        data = self.get_patient_data()
-        if not data or not data['patient']:
-            return
-        
-        patient = data['patient']
-        
-        # Создание отчета
-        report = f"""
-╔══════════════════════════════════════════════════════════════════════════════╗
-║                            КАРТА ПАЦИЕНТА                                    ║
-╚══════════════════════════════════════════════════════════════════════════════╝
-
-ЛИЧНЫЕ ДАННЫЕ:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-Номер карты:        {patient[1] or 'Не указан'}
-Номер полиса:       {patient[2] or 'Не указан'}
-ФИО:               {(patient[3] or '') + ' ' + (patient[4] or '') + ' ' + (patient[5] or '')}
-Дата рождения:      {patient[6] or 'Не указана'}
-Пол:               {patient[7] or 'Не указан'}
-Адрес:             {patient[8] or 'Не указан'}
-Телефон:           {patient[9] or 'Не указан'}
-Паспорт:           {patient[10] or 'Не указан'}
-Серия и номер:      {(patient[11] or '') + ' ' + (patient[12] or '')}
-Выдан:             {patient[13] or 'Не указано'}
-СНИЛС:             {patient[14] or 'Не указан'}
-Место работы:       {patient[15] or 'Не указано'}
-Группа инвалидности: {patient[16] or 'Не указана'}
-Группа крови:       {patient[17] or 'Не указана'}
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-Дата создания карты: {patient[18] or 'Не указана'}
-Дата печати:        {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
-╔══════════════════════════════════════════════════════════════════════════════╗
-║       СИСТЕМА ДИАГНОСТИКИ ЗАБОЛЕВАНИЙ ПОСЛЕ COVID-ИНФЕКЦИИ                  ║
-║       Разработчик: ст. мБС-231                                              ║
-╚══════════════════════════════════════════════════════════════════════════════╝
-"""
-        
-        self.show_print_preview(report, "Карта пациента")
+        self.run_report(self.build_patient_card, "Карта пациента")
+    
+    def build_patient_card(self, data):
+        """Текст отчета "Карта пациента" по данным get_patient_data"""
+        return render(iter_patient_card(data))
     
     def print_medical_data(self, parent_window):
         """Печать медицинских данных"""
         parent_window.destroy()
-        
-        data = self.get_patient_data()
-        if not data:
-            return
-        
-        patient = data['patient']
-        
-        report = f"""
-╔══════════════════════════════════════════════════════════════════════════════╗
-║                        МЕДИЦИНСКИЕ ДАННЫЕ ПАЦИЕНТА                          ║
-╚══════════════════════════════════════════════════════════════════════════════╝
-
-ПАЦИЕНТ: {(patient[3] or '') + ' ' + (patient[4] or '') + ' ' + (patient[5] or '')}
-НОМЕР КАРТЫ: {patient[1] or 'Не указан'}
-
-АНАМНЕЗ:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-"""
-        
-        if data['anamnesis']:
-            anamnesis = data['anamnesis']
-            symptoms = []
-            
-            # Обработка данных из новой расширенной таблицы анамнеза
-            if len(anamnesis) > 20:  # Если это новая расширенная таблица
-                symptom_mapping = [
-                    (2, "Слабость"),
-                    (3, "Утомляемость"),
-                    (4, "Потеря веса"),
-                    (5, "Бледность"),
-                    (6, "Температура"),
-                    (7, "Насморк"),
-                    (8, "Потливость"),
-                    (9, "Кашель"),
-                    (10, "Наличие мокроты"),
-                    (11, "Гнойная мокрота"),
-                    (12, "Кровяная мокрота"),
-                    (13, "Слизистая мокрота"),
-                    (14, "Перенесенный COVID-19"),
-                    (15, "Кровохаркание"),
-                    (16, "Рвота"),
-                    (17, "Головные боли"),
-                    (18, "Запор"),
-                    (19, "Диарея"),
-                    (20, "Боли в груди"),
-                    (21, "Кровь в каловых массах"),
-                    (22, "Одышка")
-                ]
-                
-                for index, symptom_name in symptom_mapping:
-                    if index < len(anamnesis) and anamnesis[index]:
-                        symptoms.append(symptom_name)
-                
-                # Добавляем информацию о тяжести COVID-19
-                if len(anamnesis) > 23 and anamnesis[23]:  # covid_severity поле
-                    covid_severity = anamnesis[23]
-                    if covid_severity and covid_severity.strip():
-                        symptoms.append(f"Тяжесть COVID-19: {covid_severity}")
-            else:
-                # Обработка старой таблицы
-             if anamnesis[2]: symptoms.append("COVID-19")
-            if anamnesis[3]: symptoms.append("Тяжесть заболевания")
-            if anamnesis[4]: symptoms.append("Утомляемость")
-            if anamnesis[5]: symptoms.append("Нарушения глюкозы")
-            if anamnesis[6]: symptoms.append("Повышенный креатинин")
-            if anamnesis[7]: symptoms.append("Низкий гемоглобин")
-            
-            if symptoms:
-                report += "Выявленные симптомы и отклонения:\n"
-                for symptom in symptoms:
-                    report += f"  • {symptom}\n"
-            else:
-                report += "Патологических изменений в анамнезе не выявлено.\n"
-        else:
-            report += "Данные анамнеза не заполнены.\n"
-        
-        report += "\nКОМОРБИДНЫЕ СОСТОЯНИЯ:\n"
-        report += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        
-        if data['comorbidities']:
-            comorbidities = data['comorbidities']
-            conditions = []
-            
-            # Полный список всех коморбидных состояний
-            comorbidities_mapping = [
-                (2, "Заболевания позвоночника"),
-                (3, "Атеросклероз артерий"),
-                (4, "Заболевания желудка"),
-                (5, "Стенокардия"),
-                (6, "Заболевания щитовидной железы"),
-                (7, "Хроническая сердечная недостаточность"),
-                (8, "Дыхательная недостаточность"),
-                (9, "Ожирение"),
-                (10, "Риск сердечно-сосудистых осложнений"),
-                (11, "Сосудистые заболевания"),
-                (12, "Степень НТ"),
-                (13, "Заболевания легочной ткани"),
-                (14, "Другие кардиологические заболевания"),
-                (15, "Заболевания дыхательных путей"),
-                (16, "ИБС"),
-                (17, "СД"),
-                (18, "ГБ")
-            ]
-            
-            for index, condition_name in comorbidities_mapping:
-                if index < len(comorbidities) and comorbidities[index]:
-                    conditions.append(condition_name)
-            
-            if conditions:
-                report += "Выявленные коморбидные состояния:\n"
-                for condition in conditions:
-                    report += f"  • {condition}\n"
-            else:
-                report += "Коморбидных состояний не выявлено.\n"
-        else:
-            report += "Данные о коморбидных состояниях не заполнены.\n"
-        
-        report += f"\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        report += f"Дата печати: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        report += f"Врач: _________________________     Подпись: _________________\n"
-        
-        self.show_print_preview(report, "Медицинские данные")
+        self.run_report(self.build_medical_data, "Медицинские данные")
+    
+    def build_medical_data(self, data):
+        """Текст отчета "Медицинские данные" по данным get_patient_data"""
+        return render(iter_medical_data(data))
     
     def print_full_report(self, parent_window):
         """Печать полного отчета"""
         parent_window.destroy()
-        
-        data = self.get_patient_data()
-        if not data:
-            return
-        
-        patient = data['patient']
-        
-        report = f"""
-╔══════════════════════════════════════════════════════════════════════════════╗
-║                          ПОЛНЫЙ МЕДИЦИНСКИЙ ОТЧЕТ                           ║
-╚══════════════════════════════════════════════════════════════════════════════╝
-
-ПАЦИЕНТ: {(patient[3] or '') + ' ' + (patient[4] or '') + ' ' + (patient[5] or '')}
-ДАТА РОЖДЕНИЯ: {patient[6] or 'Не указана'}
-НОМЕР КАРТЫ: {patient[1] or 'Не указан'}
-
-1. АНАМНЕЗ:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-"""
-        
-        # Добавляем данные анамнеза
-        if data['anamnesis']:
-            anamnesis = data['anamnesis']
-            symptoms = []
-            
-            # Обработка данных из новой расширенной таблицы анамнеза
-            if len(anamnesis) > 20:  # Если это новая расширенная таблица
-                symptom_mapping = [
-                    (2, "Слабость"), (3, "Утомляемость"), (4, "Потеря веса"), (5, "Бледность"),
-                    (6, "Температура"), (7, "Насморк"), (8, "Потливость"), (9, "Кашель"),
-                    (10, "Наличие мокроты"), (11, "Гнойная мокрота"), (12, "Кровяная мокрота"),
-                    (13, "Слизистая мокрота"), (14, "Перенесенный COVID-19"), (15, "Кровохаркание"), 
-                    (16, "Рвота"), (17, "Головные боли"), (18, "Запор"), (19, "Диарея"), 
-                    (20, "Боли в груди"), (21, "Кровь в каловых массах"), (22, "Одышка")
-                ]
-                
-                for index, symptom_name in symptom_mapping:
-                    if index < len(anamnesis) and anamnesis[index]:
-                        symptoms.append(symptom_name)
-                
-                # Добавляем информацию о тяжести COVID-19
-                if len(anamnesis) > 15 and anamnesis[15]:  # covid_severity поле
-                    covid_severity = anamnesis[15]
-                    if covid_severity and covid_severity.strip():
-                        symptoms.append(f"Тяжесть COVID-19: {covid_severity}")
-                
-                # Добавляем информацию о АД
-                if len(anamnesis) > 24 and anamnesis[24]:  # ad_value поле
-                    ad_value = anamnesis[24]
-                    if ad_value and ad_value.strip():
-                        symptoms.append(f"АД: {ad_value} мм.рт.ст.")
-            
-            if symptoms:
-                report += "Выявленные симптомы:\n"
-                for symptom in symptoms:
-                    report += f"  • {symptom}\n"
-            else:
-                report += "Патологических изменений в анамнезе не выявлено.\n"
-        else:
-            report += "Данные анамнеза не заполнены.\n"
-        
-        report += "\n2. КОМОРБИДНЫЕ СОСТОЯНИЯ:\n"
-        report += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        
-        # Добавляем коморбидные состояния
-        if data['comorbidities']:
-            comorbidities = data['comorbidities']
-            conditions = []
-            
-            comorbidities_mapping = [
-                (2, "Заболевания позвоночника"), (3, "Атеросклероз артерий"),
-                (4, "Заболевания желудка"), (5, "Стенокардия"),
-                (6, "Заболевания щитовидной железы"), (7, "Хроническая сердечная недостаточность"),
-                (8, "Дыхательная недостаточность"), (9, "Ожирение"),
-                (10, "Риск сердечно-сосудистых осложнений"), (11, "Сосудистые заболевания"),
-                (12, "Степень НТ"), (13, "Заболевания легочной ткани"),
-                (14, "Другие кардиологические заболевания"), (15, "Заболевания дыхательных путей"),
-                (16, "ИБС"), (17, "СД"), (18, "ГБ")
-            ]
-            
-            for index, condition_name in comorbidities_mapping:
-                if index < len(comorbidities) and comorbidities[index]:
-                    conditions.append(condition_name)
-            
-            if conditions:
-                report += "Выявленные коморбидные состояния:\n"
-                for condition in conditions:
-                    report += f"  • {condition}\n"
-            else:
-                report += "Коморбидных состояний не выявлено.\n"
-        else:
-            report += "Данные о коморбидных состояниях не заполнены.\n"
-        
-        report += "\n3. АНАЛИЗЫ КРОВИ:\n"
-        report += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        
-        if data['blood']:
-            blood = data['blood']
-            
-            # Основные показатели
-            report += "Основные показатели:\n"
-            report += f"  • Эритроциты: {blood[2] or 'Не указано'} (*10^12/л)\n"
-            report += f"  • Лейкоциты: {blood[3] or 'Не указано'} (*10^9/л)\n"
-            report += f"  • Гемоглобин: {blood[4] or 'Не указано'} (г/л)\n"
-            report += f"  • СОЭ: {blood[5] or 'Не указано'} (мм/ч)\n"
-            report += f"  • Лимфоциты: {blood[6] or 'Не указано'} (%)\n"
-            
-            # Дополнительные показатели с чекбоксами и значениями
-            report += "\nДополнительные показатели:\n"
-            
-            # СРБ
-            if blood[7]:  # srb_normal
-                srb_value = blood[13] if len(blood) > 13 and blood[13] else "не указано"
-                report += f"  • СРБ в норме: {srb_value} (мг/л)\n"
-            if blood[8]:  # srb_elevated
-                srb_value = blood[14] if len(blood) > 14 and blood[14] else "не указано"
-                report += f"  • СРБ повышен: {srb_value} (мг/л)\n"
-            
-            # D-димер
-            if blood[9]:  # d_dimer_normal
-                d_dimer_value = blood[15] if len(blood) > 15 and blood[15] else "не указано"
-                report += f"  • D-димер в норме: {d_dimer_value} (нг/мл)\n"
-            if blood[10]:  # d_dimer_elevated
-                d_dimer_value = blood[16] if len(blood) > 16 and blood[16] else "не указано"
-                report += f"  • D-димер повышен: {d_dimer_value} (нг/мл)\n"
-            
-            # Тромбоциты
-            if blood[11]:  # thrombocytes_normal
-                thrombocytes_value = blood[17] if len(blood) > 17 and blood[17] else "не указано"
-                report += f"  • Тромбоциты в норме: {thrombocytes_value} (*10^9/л)\n"
-            if blood[12]:  # thrombocytes_low
-                thrombocytes_value = blood[18] if len(blood) > 18 and blood[18] else "не указано"
-                report += f"  • Тромбоциты понижены: {thrombocytes_value} (*10^9/л)\n"
-                
-        else:
-            report += "Данные анализов крови не заполнены.\n"
-        
-        report += "\n4. АНАЛИЗЫ МОЧИ:\n"
-        report += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        
-        if data['urine']:
-            urine = data['urine']
-            if urine[2]: report += "  • Анализ не проводился\n"
-            if urine[3]: report += "  • Прозрачная моча\n"
-            if urine[4]: report += "  • Мутная моча\n"
-            if urine[5]: report += "  • Светло-желтая моча\n"
-            if urine[6]: report += "  • Темно-желтая моча\n"
-            if urine[7]: report += f"  • Белок: {urine[7]} (г/л)\n"
-            if urine[8]: report += f"  • Лейкоциты: {urine[8]} (в п/зр)\n"
-        else:
-            report += "Данные анализов мочи не заполнены.\n"
-        
-        report += "\n5. ЭКГ:\n"
-        report += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        
-        if data['ecg']:
-            ecg = data['ecg']
-            ecg_findings = []
-            if ecg[2]: ecg_findings.append("G1 отклонение")
-            if ecg[3]: ecg_findings.append("G2 (лж) отклонение")
-            if ecg[4]: ecg_findings.append("G3 отклонение")
-            if ecg[5]: ecg_findings.append("G3 (лж) отклонение")
-            if ecg[6]: ecg_findings.append("G6 (лж) отклонение")
-            if ecg[7]: ecg_findings.append("G7 отклонение")
-            if ecg[8]: ecg_findings.append("G9 отклонение")
-            if ecg[10]: ecg_findings.append("QRS отклонение")
-            if ecg[11]: ecg_findings.append("Q-T отклонение")
-            if ecg[12]: ecg_findings.append("PQ отклонение")
-            if ecg[13]: ecg_findings.append("P отклонение")
-            if ecg[15]: ecg_findings.append("ВСР отклонение")
-            
-            if ecg_findings:
-                report += "Выявленные отклонения на ЭКГ:\n"
-                for finding in ecg_findings:
-                    report += f"  • {finding}\n"
-            else:
-                report += "Патологических изменений на ЭКГ не выявлено.\n"
-        else:
-            report += "Данные ЭКГ не заполнены.\n"
-        
-        report += "\n6. ЭХО-КГ:\n"
-        report += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        
-        if data['echo']:
-            echo = data['echo']
-            
-            def format_value(value):
-                """Форматирование значения для отображения"""
-                if value is None or value == '' or (isinstance(value, (int, float)) and value == 0):
-                    return 'Не указано'
-                return str(value)
-            
-            report += f"  • Аорта: {format_value(echo[2])} мм\n"
-            report += f"  • Левое предсердие: {format_value(echo[3])} мм\n"
-            report += f"  • КДР ЛЖ: {format_value(echo[4])} мм\n"
-            report += f"  • КСР ЛЖ: {format_value(echo[5])} мм\n"
-            report += f"  • ТМЖП: {format_value(echo[6])} мм\n"
-            report += f"  • ТЗСЛЖ: {format_value(echo[7])} мм\n"
-            report += f"  • ФВ ЛЖ: {format_value(echo[8])} %\n"
-            report += f"  • Правый желудочек: {format_value(echo[9])} мм\n"
-            report += f"  • СТЛА: {format_value(echo[11])} мм рт.ст.\n"
-        else:
-            report += "Данные ЭХО-КГ не заполнены.\n"
-        
-        report += f"\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        report += f"ЗАКЛЮЧЕНИЕ:\n"
-        report += f"Рекомендуется дальнейшее наблюдение и коррекция терапии согласно\n"
-        report += f"выявленным нарушениям и коморбидным состояниям.\n\n"
-        report += f"Дата печати: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        report += f"Лечащий врач: _________________________     Подпись: _________________\n"
-        
-        self.show_print_preview(report, "Полный отчет")
+        self.run_report(self.build_full_report, "Полный отчет")
+    
+    def build_full_report(self, data):
+        """Текст отчета "Полный отчет" по данным get_patient_data"""
+        return render(iter_full_report(data))
     
     def export_to_file(self, parent_window):
         """Экспорт данных в файл"""
@@ -519,220 +137,112 @@ class PrintModule:
         if not filename:
             return
         
-        data = self.get_patient_data()
-        if not data:
-            return
-        
-        patient = data['patient']
+        # Разделы пишутся в файл в рабочем потоке по мере сборки отчета
+        def export(data):
+            with open(filename, 'w', encoding='utf-8') as f:
+                write_report(iter_export_report(data), f)
+            return filename
         
-        # Создаем полный отчет для экспорта
-        report = f"""МЕДИЦИНСКАЯ СИСТЕМА ДИАГНОСТИКИ
-Анализ и алгоритмизация лечебно-профилактических мероприятий
-у коморбидных пациентов после перенесенной COVID-инфекции
-
-═══════════════════════════════════════════════════════════════════════════════
-                            ОТЧЕТ О ПАЦИЕНТЕ
-═══════════════════════════════════════════════════════════════════════════════
-
-ДАТА СОЗДАНИЯ ОТЧЕТА: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
-ЛИЧНЫЕ ДАННЫЕ:
-─────────────────────────────────────────────────────────────────────────────
-ФИО: {(patient[3] or '') + ' ' + (patient[4] or '') + ' ' + (patient[5] or '')}
-Дата рождения: {patient[6] or 'Не указана'}
-Пол: {patient[7] or 'Не указан'}
-Номер карты: {patient[1] or 'Не указан'}
-Номер полиса: {patient[2] or 'Не указан'}
-Адрес: {patient[8] or 'Не указан'}
-Телефон: {patient[9] or 'Не указан'}
-СНИЛС: {patient[14] or 'Не указан'}
-Место работы: {patient[15] or 'Не указано'}
-Группа крови: {patient[17] or 'Не указана'}
-
-МЕДИЦИНСКИЕ ДАННЫЕ:
-─────────────────────────────────────────────────────────────────────────────
-"""
-        
-        # Добавляем все медицинские данные
-        if data['anamnesis']:
-            anamnesis = data['anamnesis']
-            report += "\nАНАМНЕЗ:\n"
-            report += "─────────────────────────────────────────────────────────────────────────────\n"
-            
-            symptoms = []
-            if len(anamnesis) > 20:  # Новая таблица
-                symptom_mapping = [
-                    (2, "Слабость"), (3, "Утомляемость"), (4, "Потеря веса"), (5, "Бледность"),
-                    (6, "Температура"), (7, "Насморк"), (8, "Потливость"), (9, "Кашель"),
-                    (10, "Наличие мокроты"), (11, "Гнойная мокрота"), (12, "Кровяная мокрота"),
-                    (13, "Слизистая мокрота"), (14, "Перенесенный COVID-19"), (15, "Кровохаркание"), 
-                    (16, "Рвота"), (17, "Головные боли"), (18, "Запор"), (19, "Диарея"), 
-                    (20, "Боли в груди"), (21, "Кровь в каловых массах"), (22, "Одышка")
-                ]
-                for index, symptom_name in symptom_mapping:
-                    if index < len(anamnesis) and anamnesis[index]:
-                        symptoms.append(symptom_name)
-                
-                # Добавляем информацию о тяжести COVID-19
-                if len(anamnesis) > 23 and anamnesis[23]:  # covid_severity поле
-                    covid_severity = anamnesis[23]
-                    if covid_severity and covid_severity.strip():
-                        symptoms.append(f"Тяжесть COVID-19: {covid_severity}")
-                
-                # Добавляем информацию о АД
-                if len(anamnesis) > 24 and anamnesis[24]:  # ad_value поле
-                    ad_value = anamnesis[24]
-                    if ad_value and ad_value.strip():
-                        symptoms.append(f"АД: {ad_value} мм.рт.ст.")
-            
-            if symptoms:
-                report += "Выявленные симптомы:\n"
-                for symptom in symptoms:
-                    report += f"  • {symptom}\n"
-            else:
-                report += "Патологических изменений в анамнезе не выявлено.\n"
+        self.run_report(export, "Экспорт в файл",
+                        on_success=self.show_export_result,
+                        error_message="Ошибка при сохранении файла")
+    
+    def bulk_export(self):
+        """Пакетный экспорт отчетов многих пациентов в один архив ZIP или файл JSONL"""
+        spec = simpledialog.askstring(
+            "Пакетный экспорт",
+            "ID пациентов и диапазоны через запятую (например 1, 5, 10-200).\n"
+            "Оставьте пустым для экспорта всех пациентов:")
+        if spec is None:
+            return
+        try:
+            ids, ranges = parse_id_spec(spec)
+        except ValueError:
+            messagebox.showerror("Ошибка", "Укажите целые числа и диапазоны через запятую")
+            return
         
-        # Коморбидные состояния
-        if data['comorbidities']:
-            report += "\nКОМОРБИДНЫЕ СОСТОЯНИЯ:\n"
-            report += "─────────────────────────────────────────────────────────────────────────────\n"
-            
-            comorbidities = data['comorbidities']
-            conditions = []
-            comorbidities_mapping = [
-                (2, "Заболевания позвоночника"), (3, "Атеросклероз артерий"),
-                (4, "Заболевания желудка"), (5, "Стенокардия"),
-                (6, "Заболевания щитовидной железы"), (7, "Хроническая сердечная недостаточность"),
-                (8, "Дыхательная недостаточность"), (9, "Ожирение"),
-                (10, "Риск сердечно-сосудистых осложнений"), (11, "Сосудистые заболевания"),
-                (12, "Степень НТ"), (13, "Заболевания легочной ткани"),
-                (14, "Другие кардиологические заболевания"), (15, "Заболевания дыхательных путей"),
-                (16, "ИБС"), (17, "СД"), (18, "ГБ")
+        filename = filedialog.asksaveasfilename(
+            title="Сохранить отчеты как",
+            defaultextension=".zip",
+            filetypes=[
+                ("Архив ZIP (файл на пациента)", "*.zip"),
+                ("JSON Lines (строка на пациента)", "*.jsonl"),
+                ("Все файлы", "*.*")
             ]
-            
-            for index, condition_name in comorbidities_mapping:
-                if index < len(comorbidities) and comorbidities[index]:
-                    conditions.append(condition_name)
-            
-            if conditions:
-                for condition in conditions:
-                    report += f"  • {condition}\n"
-            else:
-                report += "Коморбидных состояний не выявлено.\n"
+        )
+        if not filename:
+            return
+        export_format = 'jsonl' if filename.lower().endswith('.jsonl') else 'zip'
         
-        # Анализы крови
-        if data['blood']:
-            report += "\nАНАЛИЗЫ КРОВИ:\n"
-            report += "─────────────────────────────────────────────────────────────────────────────\n"
-            blood = data['blood']
-            
-            # Основные показатели
-            report += "Основные показатели:\n"
-            report += f"  • Эритроциты: {blood[2] or 'Не указано'} (*10^12/л)\n"
-            report += f"  • Лейкоциты: {blood[3] or 'Не указано'} (*10^9/л)\n"
-            report += f"  • Гемоглобин: {blood[4] or 'Не указано'} (г/л)\n"
-            report += f"  • СОЭ: {blood[5] or 'Не указано'} (мм/ч)\n"
-            report += f"  • Лимфоциты: {blood[6] or 'Не указано'} (%)\n"
-            
-            # Дополнительные показатели с значениями
-            report += "\nДополнительные показатели:\n"
-            
-            # СРБ
-            if blood[7]:  # srb_normal
-                srb_value = blood[13] if len(blood) > 13 and blood[13] else "не указано"
-                report += f"  • СРБ в норме: {srb_value} (мг/л)\n"
-            if blood[8]:  # srb_elevated
-                srb_value = blood[14] if len(blood) > 14 and blood[14] else "не указано"
-                report += f"  • СРБ повышен: {srb_value} (мг/л)\n"
-            
-            # D-димер
-            if blood[9]:  # d_dimer_normal
-                d_dimer_value = blood[15] if len(blood) > 15 and blood[15] else "не указано"
-                report += f"  • D-димер в норме: {d_dimer_value} (нг/мл)\n"
-            if blood[10]:  # d_dimer_elevated
-                d_dimer_value = blood[16] if len(blood) > 16 and blood[16] else "не указано"
-                report += f"  • D-димер повышен: {d_dimer_value} (нг/мл)\n"
-            
-            # Тромбоциты
-            if blood[11]:  # thrombocytes_normal
-                thrombocytes_value = blood[17] if len(blood) > 17 and blood[17] else "не указано"
-                report += f"  • Тромбоциты в норме: {thrombocytes_value} (*10^9/л)\n"
-            if blood[12]:  # thrombocytes_low
-                thrombocytes_value = blood[18] if len(blood) > 18 and blood[18] else "не указано"
-                report += f"  • Тромбоциты понижены: {thrombocytes_value} (*10^9/л)\n"
-        
-        # Анализы мочи
-        if data['urine']:
-            report += "\nАНАЛИЗЫ МОЧИ:\n"
-            report += "─────────────────────────────────────────────────────────────────────────────\n"
-            urine = data['urine']
-            if urine[2]: report += "  • Анализ не проводился\n"
-            if urine[3]: report += "  • Прозрачная моча\n"
-            if urine[4]: report += "  • Мутная моча\n"
-            if urine[5]: report += "  • Светло-желтая моча\n"
-            if urine[6]: report += "  • Темно-желтая моча\n"
-            if urine[7]: report += f"  • Белок: {urine[7]} (г/л)\n"
-            if urine[8]: report += f"  • Лейкоциты: {urine[8]} (в п/зр)\n"
-        
-        # ЭКГ
-        if data['ecg']:
-            report += "\nЭКГ:\n"
-            report += "─────────────────────────────────────────────────────────────────────────────\n"
-            ecg = data['ecg']
-            ecg_findings = []
-            if ecg[2]: ecg_findings.append("G1 отклонение")
-            if ecg[3]: ecg_findings.append("G2 (лж) отклонение")
-            if ecg[4]: ecg_findings.append("G3 отклонение")
-            if ecg[5]: ecg_findings.append("G3 (лж) отклонение")
-            if ecg[6]: ecg_findings.append("G6 (лж) отклонение")
-            if ecg[7]: ecg_findings.append("G7 отклонение")
-            if ecg[8]: ecg_findings.append("G9 отклонение")
-            if ecg[10]: ecg_findings.append("QRS отклонение")
-            if ecg[11]: ecg_findings.append("Q-T отклонение")
-            if ecg[12]: ecg_findings.append("PQ отклонение")
-            if ecg[13]: ecg_findings.append("P отклонение")
-            if ecg[15]: ecg_findings.append("ВСР отклонение")
-            
-            if ecg_findings:
-                for finding in ecg_findings:
-                    report += f"  • {finding}\n"
+        def export(task):
+            conn = get_connection()
+            try:
+                if ids or ranges:
+                    patient_ids = select_ids_by_spec(conn, ids, ranges)
+                else:
+                    patient_ids = [row[0] for row in conn.execute("SELECT id FROM patients ORDER BY id")]
+            finally:
+                conn.close()
+            if not patient_ids:
+                return filename, 0
+            
+            def progress(done, total):
+                task.check_cancelled()
+                task.report_progress(done, total, f"сегментов {done} из {total}")
+            
+            exported = export_reports(patient_ids, filename, export_format, progress=progress,
+                                      mp_context=multiprocessing.get_context('spawn'))
+            return filename, exported
+        
+        def show(result):
+            filename, exported = result
+            if exported:
+                messagebox.showinfo("Успех", f"Выгружено отчетов: {exported}\nФайл: {filename}")
             else:
-                report += "Патологических изменений на ЭКГ не выявлено.\n"
+                messagebox.showwarning("Предупреждение", "Пациенты не найдены")
         
-        # ЭХО-КГ
-        if data['echo']:
-            report += "\nЭХО-КГ:\n"
-            report += "─────────────────────────────────────────────────────────────────────────────\n"
-            echo = data['echo']
-            
-            def format_value(value):
-                """Форматирование значения для отображения"""
-                if value is None or value == '' or (isinstance(value, (int, float)) and value == 0):
-                    return 'Не указано'
-                return str(value)
-            
-            report += f"  • Аорта: {format_value(echo[2])} мм\n"
-            report += f"  • Левое предсердие: {format_value(echo[3])} мм\n"
-            report += f"  • КДР ЛЖ: {format_value(echo[4])} мм\n"
-            report += f"  • КСР ЛЖ: {format_value(echo[5])} мм\n"
-            report += f"  • ТМЖП: {format_value(echo[6])} мм\n"
-            report += f"  • ТЗСЛЖ: {format_value(echo[7])} мм\n"
-            report += f"  • ФВ ЛЖ: {format_value(echo[8])} %\n"
-            report += f"  • Правый желудочек: {format_value(echo[9])} мм\n"
-            report += f"  • СТЛА: {format_value(echo[11])} мм рт.ст.\n"
+        self.parent_app.task_runner.submit(
+            export, "Пакетный экспорт", on_success=show,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка пакетного экспорта: {str(e)}"))
+    
+    def export_data(self):
+        """Выгрузка пациентов, медицинских данных и прогнозов в CSV или JSONL для анализа"""
+        output_dir = filedialog.askdirectory(title="Каталог для выгрузки данных")
+        if not output_dir:
+            return
+        use_csv = messagebox.askyesnocancel(
+            "Формат выгрузки", "Выгрузить таблицы в CSV?\n\nДа - CSV, Нет - JSONL (строка JSON на запись)")
+        if use_csv is None:
+            return
+        export_format = 'csv' if use_csv else 'jsonl'
         
-        try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(report)
+        def export(task):
+            def progress(table, count):
+                task.check_cancelled()
+                task.report_progress(count, None, f"{table}: {count} строк")
             
-            messagebox.showinfo("Успех", f"Отчет успешно сохранен в файл:\n{filename}")
-            
-            # Предложить открыть файл
-            if messagebox.askyesno("Открыть файл", "Открыть сохраненный файл?"):
-                os.startfile(filename) if os.name == 'nt' else os.system(f'open "{filename}"')
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении файла:\n{str(e)}")
+            conn = get_connection()
+            try:
+                return export_tables(conn, output_dir, export_format, progress=progress)
+            finally:
+                conn.close()
+        
+        def show(manifest):
+            rows = sum(table['rows'] for table in manifest['tables'])
+            messagebox.showinfo("Успех", f"Выгружено таблиц: {len(manifest['tables'])}, строк: {rows}\n"
+                                         f"Каталог: {output_dir}")
+        
+        self.parent_app.task_runner.submit(
+            export, "Выгрузка данных", on_success=show,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Ошибка выгрузки данных: {str(e)}"))
+    
+    def show_export_result(self, filename):
+        """Сообщение о сохраненном файле отчета"""
+        messagebox.showinfo("Успех", f"Отчет успешно сохранен в файл:\n{filename}")
+        
+        # Предложить открыть файл
+        if messagebox.askyesno("Открыть файл", "Открыть сохраненный файл?"):
+            os.startfile(filename) if os.name == 'nt' else os.system(f'open "{filename}"')
     
     def show_print_preview(self, text, title):
         """Показ предварительного просмотра для печати"""
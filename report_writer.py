@@ -0,0 +1,418 @@
+"""Потоковая сборка текстовых отчетов о пациенте
+
+Отчет собирается генератором фрагментов текста: при экспорте разделы пишутся
+в файл по мере сборки, без накопления всего отчета в одной строке. Разметка
+отчетов задана шаблонами, которые компилируются один раз при импорте модуля.
+"""
+from datetime import datetime
+from string import Template
+from row_mapping import RecordMapping
+
+# Подписи симптомов расширенной таблицы анамнеза
+ANAMNESIS_SYMPTOMS = [
+    ('weakness', "Слабость"), ('fatigue', "Утомляемость"), ('weight_loss', "Потеря веса"),
+    ('pallor', "Бледность"), ('temperature', "Температура"), ('runny_nose', "Насморк"),
+    ('sweating', "Потливость"), ('cough', "Кашель"), ('sputum', "Наличие мокроты"),
+    ('purulent_sputum', "Гнойная мокрота"), ('bloody_sputum', "Кровяная мокрота"),
+    ('mucous_sputum', "Слизистая мокрота"), ('covid19', "Перенесенный COVID-19"),
+    ('hemoptysis', "Кровохаркание"), ('vomiting', "Рвота"), ('headache', "Головные боли"),
+    ('constipation', "Запор"), ('diarrhea', "Диарея"), ('chest_pain', "Боли в груди"),
+    ('blood_in_stool', "Кровь в каловых массах"), ('dyspnea', "Одышка")
+]
+
+# Подписи старой таблицы анамнеза
+LEGACY_ANAMNESIS_SYMPTOMS = [
+    ('covid19', "COVID-19"), ('severity', "Тяжесть заболевания"), ('fatigue', "Утомляемость"),
+    ('glucose', "Нарушения глюкозы"), ('creatinine', "Повышенный креатинин"),
+    ('hemoglobin', "Низкий гемоглобин")
+]
+
+# Подписи коморбидных состояний в порядке карты пациента
+COMORBIDITY_LABELS = [
+    ('spinal_diseases', "Заболевания позвоночника"), ('atherosclerosis', "Атеросклероз артерий"),
+    ('gastric_diseases', "Заболевания желудка"), ('stenosis', "Стенокардия"),
+    ('thyroid_diseases', "Заболевания щитовидной железы"),
+    ('chronic_heart_failure', "Хроническая сердечная недостаточность"),
+    ('respiratory_failure', "Дыхательная недостаточность"), ('obesity', "Ожирение"),
+    ('cardiovascular_diseases', "Риск сердечно-сосудистых осложнений"),
+    ('joint_diseases', "Сосудистые заболевания"), ('iht', "Степень НТ"),
+    ('cerebrovascular_diseases', "Заболевания легочной ткани"),
+    ('brain_diseases', "Другие кардиологические заболевания"),
+    ('muscle_diseases', "Заболевания дыхательных путей"), ('pneumonia', "ИБС"),
+    ('pathology_stage', "СД"), ('other_pathologies', "ГБ")
+]
+
+# Показатели анализа крови: (поле, подпись, единицы)
+BLOOD_VALUES = [
+    ('erythrocytes', "Эритроциты", "*10^12/л"), ('leukocytes', "Лейкоциты", "*10^9/л"),
+    ('hemoglobin', "Гемоглобин", "г/л"), ('soe', "СОЭ", "мм/ч"), ('lymphocytes', "Лимфоциты", "%")
+]
+
+# Отметки анализа крови; значение хранится в поле с суффиксом _value
+BLOOD_MARKERS = [
+    ('srb_normal', "СРБ в норме", "мг/л"), ('srb_elevated', "СРБ повышен", "мг/л"),
+    ('d_dimer_normal', "D-димер в норме", "нг/мл"), ('d_dimer_elevated', "D-димер повышен", "нг/мл"),
+    ('thrombocytes_normal', "Тромбоциты в норме", "*10^9/л"),
+    ('thrombocytes_low', "Тромбоциты понижены", "*10^9/л")
+]
+
+URINE_FLAGS = [
+    ('analysis_not_performed', "Анализ не проводился"), ('transparent_urine', "Прозрачная моча"),
+    ('cloudy_urine', "Мутная моча"), ('light_yellow_urine', "Светло-желтая моча"),
+    ('dark_yellow_urine', "Темно-желтая моча")
+]
+
+ECG_FINDINGS = [
+    ('g1_deviation', "G1 отклонение"), ('g2_lzh_deviation', "G2 (лж) отклонение"),
+    ('g3_deviation', "G3 отклонение"), ('g3_lzh_deviation', "G3 (лж) отклонение"),
+    ('g6_lzh_deviation', "G6 (лж) отклонение"), ('g7_deviation', "G7 отклонение"),
+    ('g9_deviation', "G9 отклонение"), ('qrs_deviation', "QRS отклонение"),
+    ('qt_deviation', "Q-T отклонение"), ('pq_deviation', "PQ отклонение"),
+    ('p_deviation', "P отклонение"), ('bcp_deviation', "ВСР отклонение")
+]
+
+ECHO_VALUES = [
+    ('aorta', "Аорта", "мм"), ('left_atrium', "Левое предсердие", "мм"), ('lv_kdr', "КДР ЛЖ", "мм"),
+    ('lv_ksr', "КСР ЛЖ", "мм"), ('tmgp', "ТМЖП", "мм"), ('tzsgl', "ТЗСЛЖ", "мм"),
+    ('fv', "ФВ ЛЖ", "%"), ('rv', "Правый желудочек", "мм"), ('stla', "СТЛА", "мм рт.ст.")
+]
+
+PATIENT_FIELDS = ['card_number', 'policy_number', 'surname', 'name', 'patronymic', 'birth_date',
+                  'gender', 'address', 'phone', 'passport', 'series', 'number', 'issued_by', 'snils',
+                  'workplace', 'disability_group', 'blood_group', 'created_date']
+BLOOD_FIELDS = ([field for field, label, unit in BLOOD_VALUES] +
+                [field for field, label, unit in BLOOD_MARKERS] +
+                [field + '_value' for field, label, unit in BLOOD_MARKERS])
+
+# Столбцы, которые читают отчеты; в старой таблице анализов крови полей *_value нет
+PRINT_MAPPINGS = {
+    'patient': RecordMapping('patients', PATIENT_FIELDS),
+    'anamnesis': RecordMapping('anamnesis_extended',
+                               [field for field, label in ANAMNESIS_SYMPTOMS] + ['covid_severity', 'ad_value']),
+    'anamnesis_legacy': RecordMapping('anamnesis', [field for field, label in LEGACY_ANAMNESIS_SYMPTOMS]),
+    'comorbidities': RecordMapping('comorbidities', [field for field, label in COMORBIDITY_LABELS]),
+    'blood_tests': RecordMapping('blood_tests', BLOOD_FIELDS),
+    'blood_tests_extended': RecordMapping('blood_tests_extended', BLOOD_FIELDS),
+    'urine_tests': RecordMapping('urine_tests', [field for field, label in URINE_FLAGS] +
+                                 ['protein_presence', 'leukocytes_presence']),
+    'ecg': RecordMapping('ecg_data', [field for field, label in ECG_FINDINGS]),
+    'echo': RecordMapping('echo_data', [field for field, label, unit in ECHO_VALUES])
+}
+
+
+def full_name(patient):
+    """ФИО пациента одной строкой"""
+    return (patient.surname or '') + ' ' + (patient.name or '') + ' ' + (patient.patronymic or '')
+
+
+def flagged_labels(record, labels):
+    """Подписи отмеченных полей записи"""
+    return [label for field, label in labels if getattr(record, field)]
+
+
+def snapshot_report_data(snapshot):
+    """Данные отчетов из снимка пациента (load_snapshot с PRINT_MAPPINGS)"""
+    return {
+        'patient': snapshot.patient,
+        'anamnesis': snapshot.anamnesis,
+        'anamnesis_legacy': snapshot.anamnesis_legacy,
+        'comorbidities': snapshot.comorbidities,
+        # Анализы крови: расширенная таблица, если нет - старая
+        'blood': snapshot.blood_tests_extended or snapshot.blood_tests,
+        'urine': snapshot.urine_tests,
+        'ecg': snapshot.ecg,
+        'echo': snapshot.echo
+    }
+
+
+HEAVY_RULE = "━" * 84 + "\n"
+LIGHT_RULE = "─" * 77 + "\n"
+
+
+def box(*lines):
+    """Рамка заголовка отчета"""
+    return ("╔" + "═" * 78 + "╗\n" +
+            "".join(f"║{line}║\n" for line in lines) +
+            "╚" + "═" * 78 + "╝\n")
+
+
+# Шаблоны разметки; значения подставляются через substitute()
+PATIENT_CARD_TEMPLATE = Template("\n" + box("                            КАРТА ПАЦИЕНТА                                    ") + """
+ЛИЧНЫЕ ДАННЫЕ:
+""" + HEAVY_RULE + """
+Номер карты:        $card_number
+Номер полиса:       $policy_number
+ФИО:               $full_name
+Дата рождения:      $birth_date
+Пол:               $gender
+Адрес:             $address
+Телефон:           $phone
+Паспорт:           $passport
+Серия и номер:      $series_number
+Выдан:             $issued_by
+СНИЛС:             $snils
+Место работы:       $workplace
+Группа инвалидности: $disability_group
+Группа крови:       $blood_group
+
+""" + HEAVY_RULE + """Дата создания карты: $created_date
+Дата печати:        $printed_at
+
+""" + box("       СИСТЕМА ДИАГНОСТИКИ ЗАБОЛЕВАНИЙ ПОСЛЕ COVID-ИНФЕКЦИИ                  ",
+          "       Разработчик: ст. мБС-231                                              "))
+
+MEDICAL_DATA_HEADER = Template("\n" + box("                        МЕДИЦИНСКИЕ ДАННЫЕ ПАЦИЕНТА                          ") + """
+ПАЦИЕНТ: $full_name
+НОМЕР КАРТЫ: $card_number
+
+АНАМНЕЗ:
+""" + HEAVY_RULE)
+
+MEDICAL_DATA_FOOTER = Template("\n" + HEAVY_RULE + """Дата печати: $printed_at
+Врач: _________________________     Подпись: _________________
+""")
+
+FULL_REPORT_HEADER = Template("\n" + box("                          ПОЛНЫЙ МЕДИЦИНСКИЙ ОТЧЕТ                           ") + """
+ПАЦИЕНТ: $full_name
+ДАТА РОЖДЕНИЯ: $birth_date
+НОМЕР КАРТЫ: $card_number
+
+1. АНАМНЕЗ:
+""" + HEAVY_RULE)
+
+FULL_REPORT_FOOTER = Template("\n" + HEAVY_RULE + """ЗАКЛЮЧЕНИЕ:
+Рекомендуется дальнейшее наблюдение и коррекция терапии согласно
+выявленным нарушениям и коморбидным состояниям.
+
+Дата печати: $printed_at
+Лечащий врач: _________________________     Подпись: _________________
+""")
+
+EXPORT_HEADER = Template("""МЕДИЦИНСКАЯ СИСТЕМА ДИАГНОСТИКИ
+Анализ и алгоритмизация лечебно-профилактических мероприятий
+у коморбидных пациентов после перенесенной COVID-инфекции
+
+""" + "═" * 79 + """
+                            ОТЧЕТ О ПАЦИЕНТЕ
+""" + "═" * 79 + """
+
+ДАТА СОЗДАНИЯ ОТЧЕТА: $printed_at
+
+ЛИЧНЫЕ ДАННЫЕ:
+""" + LIGHT_RULE + """ФИО: $full_name
+Дата рождения: $birth_date
+Пол: $gender
+Номер карты: $card_number
+Номер полиса: $policy_number
+Адрес: $address
+Телефон: $phone
+СНИЛС: $snils
+Место работы: $workplace
+Группа крови: $blood_group
+
+МЕДИЦИНСКИЕ ДАННЫЕ:
+""" + LIGHT_RULE)
+
+# Подстановки для незаполненных полей карты пациента
+NOT_SPECIFIED = {
+    'card_number': 'Не указан', 'policy_number': 'Не указан', 'birth_date': 'Не указана',
+    'gender': 'Не указан', 'address': 'Не указан', 'phone': 'Не указан', 'passport': 'Не указан',
+    'issued_by': 'Не указано', 'snils': 'Не указан', 'workplace': 'Не указано',
+    'disability_group': 'Не указана', 'blood_group': 'Не указана', 'created_date': 'Не указана'
+}
+
+
+def patient_values(patient):
+    """Значения полей карты пациента для шаблонов"""
+    values = {field: getattr(patient, field) or default for field, default in NOT_SPECIFIED.items()}
+    values['full_name'] = full_name(patient)
+    values['series_number'] = (patient.series or '') + ' ' + (patient.number or '')
+    values['printed_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return values
+
+
+def get_anamnesis_symptoms(data, include_ad=True):
+    """Список симптомов анамнеза: новая таблица, если нет - старая; None, если данных нет"""
+    if data['anamnesis']:
+        anamnesis = data['anamnesis']
+        symptoms = [label for field, label in ANAMNESIS_SYMPTOMS if getattr(anamnesis, field)]
+        
+        # Добавляем информацию о тяжести COVID-19
+        if anamnesis.covid_severity and anamnesis.covid_severity.strip():
+            symptoms.append(f"Тяжесть COVID-19: {anamnesis.covid_severity}")
+        
+        # Добавляем информацию о АД
+        if include_ad and anamnesis.ad_value and anamnesis.ad_value.strip():
+            symptoms.append(f"АД: {anamnesis.ad_value} мм.рт.ст.")
+        return symptoms
+    
+    if data['anamnesis_legacy']:
+        anamnesis = data['anamnesis_legacy']
+        return [label for field, label in LEGACY_ANAMNESIS_SYMPTOMS if getattr(anamnesis, field)]
+    
+    return None
+
+
+def iter_items(items, heading=None, empty_text=None):
+    """Пункты списка; heading - строка перед непустым списком, empty_text - вместо пустого"""
+    if items:
+        if heading:
+            yield heading
+        for item in items:
+            yield f"  • {item}\n"
+    elif empty_text:
+        yield empty_text
+
+
+def iter_blood(blood):
+    """Строки отчета с показателями анализа крови"""
+    yield "Основные показатели:\n"
+    for field, label, unit in BLOOD_VALUES:
+        yield f"  • {label}: {getattr(blood, field) or 'Не указано'} ({unit})\n"
+    
+    # Дополнительные показатели с чекбоксами и значениями
+    yield "\nДополнительные показатели:\n"
+    for field, label, unit in BLOOD_MARKERS:
+        if getattr(blood, field):
+            value = getattr(blood, field + '_value') or "не указано"
+            yield f"  • {label}: {value} ({unit})\n"
+
+
+def iter_urine(urine):
+    """Строки отчета с анализом мочи"""
+    yield from iter_items(flagged_labels(urine, URINE_FLAGS))
+    if urine.protein_presence:
+        yield f"  • Белок: {urine.protein_presence} (г/л)\n"
+    if urine.leukocytes_presence:
+        yield f"  • Лейкоциты: {urine.leukocytes_presence} (в п/зр)\n"
+
+
+def format_echo_value(value):
+    """Форматирование значения ЭХО-КГ для отображения"""
+    if value is None or value == '' or (isinstance(value, (int, float)) and value == 0):
+        return 'Не указано'
+    return str(value)
+
+
+def iter_echo(echo):
+    """Строки отчета с показателями ЭХО-КГ"""
+    for field, label, unit in ECHO_VALUES:
+        yield f"  • {label}: {format_echo_value(getattr(echo, field))} {unit}\n"
+
+
+def iter_patient_card(data):
+    """Отчет "Карта пациента" по данным snapshot_report_data"""
+    yield PATIENT_CARD_TEMPLATE.substitute(patient_values(data['patient']))
+
+
+def iter_medical_data(data):
+    """Отчет "Медицинские данные" по данным snapshot_report_data"""
+    values = patient_values(data['patient'])
+    yield MEDICAL_DATA_HEADER.substitute(values)
+    
+    symptoms = get_anamnesis_symptoms(data, include_ad=False)
+    if symptoms is not None:
+        yield from iter_items(symptoms, "Выявленные симптомы и отклонения:\n",
+                              "Патологических изменений в анамнезе не выявлено.\n")
+    else:
+        yield "Данные анамнеза не заполнены.\n"
+    
+    yield "\nКОМОРБИДНЫЕ СОСТОЯНИЯ:\n" + HEAVY_RULE
+    if data['comorbidities']:
+        yield from iter_items(flagged_labels(data['comorbidities'], COMORBIDITY_LABELS),
+                              "Выявленные коморбидные состояния:\n", "Коморбидных состояний не выявлено.\n")
+    else:
+        yield "Данные о коморбидных состояниях не заполнены.\n"
+    
+    yield MEDICAL_DATA_FOOTER.substitute(values)
+
+
+def iter_full_report(data):
+    """Отчет "Полный отчет" по данным snapshot_report_data"""
+    values = patient_values(data['patient'])
+    yield FULL_REPORT_HEADER.substitute(values)
+    
+    symptoms = get_anamnesis_symptoms(data)
+    if symptoms is not None:
+        yield from iter_items(symptoms, "Выявленные симптомы:\n",
+                              "Патологических изменений в анамнезе не выявлено.\n")
+    else:
+        yield "Данные анамнеза не заполнены.\n"
+    
+    yield "\n2. КОМОРБИДНЫЕ СОСТОЯНИЯ:\n" + HEAVY_RULE
+    if data['comorbidities']:
+        yield from iter_items(flagged_labels(data['comorbidities'], COMORBIDITY_LABELS),
+                              "Выявленные коморбидные состояния:\n", "Коморбидных состояний не выявлено.\n")
+    else:
+        yield "Данные о коморбидных состояниях не заполнены.\n"
+    
+    yield "\n3. АНАЛИЗЫ КРОВИ:\n" + HEAVY_RULE
+    if data['blood']:
+        yield from iter_blood(data['blood'])
+    else:
+        yield "Данные анализов крови не заполнены.\n"
+    
+    yield "\n4. АНАЛИЗЫ МОЧИ:\n" + HEAVY_RULE
+    if data['urine']:
+        yield from iter_urine(data['urine'])
+    else:
+        yield "Данные анализов мочи не заполнены.\n"
+    
+    yield "\n5. ЭКГ:\n" + HEAVY_RULE
+    if data['ecg']:
+        yield from iter_items(flagged_labels(data['ecg'], ECG_FINDINGS),
+                              "Выявленные отклонения на ЭКГ:\n", "Патологических изменений на ЭКГ не выявлено.\n")
+    else:
+        yield "Данные ЭКГ не заполнены.\n"
+    
+    yield "\n6. ЭХО-КГ:\n" + HEAVY_RULE
+    if data['echo']:
+        yield from iter_echo(data['echo'])
+    else:
+        yield "Данные ЭХО-КГ не заполнены.\n"
+    
+    yield FULL_REPORT_FOOTER.substitute(values)
+
+
+def iter_export_report(data):
+    """Отчет для экспорта в файл; разделы без данных пропускаются"""
+    yield EXPORT_HEADER.substitute(patient_values(data['patient']))
+    
+    symptoms = get_anamnesis_symptoms(data)
+    if symptoms is not None:
+        yield "\nАНАМНЕЗ:\n" + LIGHT_RULE
+        yield from iter_items(symptoms, "Выявленные симптомы:\n",
+                              "Патологических изменений в анамнезе не выявлено.\n")
+    
+    if data['comorbidities']:
+        yield "\nКОМОРБИДНЫЕ СОСТОЯНИЯ:\n" + LIGHT_RULE
+        yield from iter_items(flagged_labels(data['comorbidities'], COMORBIDITY_LABELS),
+                              empty_text="Коморбидных состояний не выявлено.\n")
+    
+    if data['blood']:
+        yield "\nАНАЛИЗЫ КРОВИ:\n" + LIGHT_RULE
+        yield from iter_blood(data['blood'])
+    
+    if data['urine']:
+        yield "\nАНАЛИЗЫ МОЧИ:\n" + LIGHT_RULE
+        yield from iter_urine(data['urine'])
+    
+    if data['ecg']:
+        yield "\nЭКГ:\n" + LIGHT_RULE
+        yield from iter_items(flagged_labels(data['ecg'], ECG_FINDINGS),
+                              empty_text="Патологических изменений на ЭКГ не выявлено.\n")
+    
+    if data['echo']:
+        yield "\nЭХО-КГ:\n" + LIGHT_RULE
+        yield from iter_echo(data['echo'])
+
+
+def render(chunks):
+    """Отчет одной строкой (для предварительного просмотра)"""
+    return ''.join(chunks)
+
+
+def write_report(chunks, f):
+    """Запись отчета в открытый файл по мере сборки фрагментов"""
+    for chunk in chunks:
+        f.write(chunk)
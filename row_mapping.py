@@ -0,0 +1,115 @@
+import threading
+from collections import namedtuple
+
+
+class RecordMapping:
+    """Описание записи: таблица и нужные столбцы по именам (None - все столбцы таблицы)"""
+
+    def __init__(self, table, columns=None):
+        self.table = table
+        self.columns = tuple(columns) if columns is not None else None
+
+    def __eq__(self, other):
+        return isinstance(other, RecordMapping) and (self.table, self.columns) == (other.table, other.columns)
+
+    def __hash__(self):
+        return hash((self.table, self.columns))
+
+    def __repr__(self):
+        return f"RecordMapping({self.table!r}, {self.columns!r})"
+
+
+class CompiledMapping:
+    """Отображение, скомпилированное для конкретной версии схемы базы данных
+
+    Запрос выбирает только нужные столбцы; столбец, которого нет в схеме,
+    читается как NULL, поэтому поле записи равно None, а не сдвигает остальные.
+    """
+
+    def __init__(self, mapping, table_columns):
+        self.table = mapping.table
+        self.table_exists = bool(table_columns)
+        self.fields = mapping.columns if mapping.columns is not None else tuple(table_columns)
+        self.missing = tuple(field for field in self.fields if field not in table_columns)
+        # Таблица с историей визитов: у пациента несколько строк, текущая - последний визит
+        self.has_visits = 'visit_date' in table_columns
+        # namedtuple не хранит __dict__ у экземпляров: запись занимает столько же, сколько кортеж
+        type_name = ''.join(part.title() for part in mapping.table.split('_')) + 'Record'
+        self.record_type = namedtuple(type_name, self.fields)
+        self.make = self.record_type._make
+
+    def select_list(self, alias):
+        """Список выражений SELECT для псевдонима таблицы"""
+        return ', '.join('NULL' if field in self.missing else f'{alias}."{field}"' for field in self.fields)
+
+    def order_by(self, alias):
+        """Порядок строк пациента, в котором первой идет текущая: последний визит или первая запись"""
+        if self.has_visits:
+            return f'{alias}.visit_date DESC, {alias}.id DESC'
+        return f'{alias}.id'
+
+
+# Скомпилированные отображения: (файл базы, версия схемы, отображение) -> CompiledMapping
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def get_schema_key(conn):
+    """Файл базы и номер версии схемы; номер меняется SQLite при каждом изменении DDL"""
+    return conn.execute("SELECT (SELECT file FROM pragma_database_list WHERE name = 'main'), "
+                        "(SELECT schema_version FROM pragma_schema_version)").fetchone()
+
+
+def compile_mapping(conn, mapping, schema_key=None):
+    """Отображение для текущей схемы; компилируется один раз на версию схемы"""
+    if schema_key is None:
+        schema_key = get_schema_key(conn)
+    key = (schema_key, mapping)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        table_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({mapping.table})")]
+        compiled = CompiledMapping(mapping, table_columns)
+        with _compiled_lock:
+            _compiled[key] = compiled
+    return compiled
+
+
+def fetch_patient_record(conn, mapping, patient_id, key='patient_id', visit_date=None):
+    """Текущая запись пациента из таблицы отображения или None (key='id' - для самой таблицы patients)
+
+    Для таблицы с историей визитов - последний визит, а если задан
+    visit_date - последний визит не позже этой даты.
+    """
+    compiled = compile_mapping(conn, mapping)
+    if not compiled.table_exists:
+        return None
+    condition = f"t.{key} = ?"
+    params = [patient_id]
+    if visit_date is not None and compiled.has_visits:
+        condition += " AND t.visit_date <= ?"
+        params.append(visit_date)
+    row = conn.execute(f"SELECT {compiled.select_list('t')} FROM {compiled.table} t "
+                       f"WHERE {condition} ORDER BY {compiled.order_by('t')} LIMIT 1", params).fetchone()
+    return compiled.make(row) if row else None
+
+
+def fetch_patient_visits(conn, mapping, patient_id, date_from=None, date_to=None):
+    """Визиты пациента за период (границы включаются) в порядке дат
+
+    Читается только диапазон индекса (patient_id, visit_date), а не вся
+    история пациента. Для таблицы без истории визитов - пустой список.
+    """
+    compiled = compile_mapping(conn, mapping)
+    if not compiled.has_visits:
+        return []
+    conditions = ["t.patient_id = ?"]
+    params = [patient_id]
+    if date_from is not None:
+        conditions.append("t.visit_date >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("t.visit_date <= ?")
+        params.append(date_to)
+    rows = conn.execute(f"SELECT {compiled.select_list('t')} FROM {compiled.table} t "
+                        f"WHERE {' AND '.join(conditions)} ORDER BY t.visit_date, t.id", params).fetchall()
+    return [compiled.make(row) for row in rows]
@@ -0,0 +1,212 @@
+"""Многопроцессный конвейер прогнозирования по сегментам диапазона идентификаторов пациентов"""
+import itertools
+import json
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from database import configure, get_connection, get_db_path
+from neural_network import NeuralNetworkPredictor
+from model_registry import model_registry
+
+DEFAULT_SHARD_SIZE = 5000
+CHECKPOINT_VERSION = 1
+
+# Предиктор рабочего процесса создается один раз при запуске процесса
+_predictor = None
+# Следовать активной версии реестра: новая версия применяется со следующего сегмента
+_follow_registry = False
+
+
+def plan_shards(patient_ids, shard_size=DEFAULT_SHARD_SIZE, explicit=False):
+    """Разбиение упорядоченного списка пациентов на сегменты (номер, первый id, последний id, ids)
+
+    Сегмент описывается диапазоном идентификаторов, и рабочий процесс сам
+    выбирает пациентов диапазона. Список ids сохраняется только для явно
+    заданного набора пациентов, когда в диапазоне есть лишние.
+    """
+    shards = []
+    for index, start in enumerate(range(0, len(patient_ids), shard_size)):
+        chunk = patient_ids[start:start + shard_size]
+        shards.append((index, chunk[0], chunk[-1], list(chunk) if explicit else None))
+    return shards
+
+
+def _init_worker(db_path=None, seed=None, model_spec=None):
+    """Инициализация рабочего процесса: собственное соединение только для чтения и предиктор
+
+    model_spec - файл .npz или версия реестра; None - активная версия реестра,
+    которая проверяется перед каждым сегментом.
+    """
+    global _predictor, _follow_registry
+    if db_path is not None:
+        # Прерывание обрабатывает родительский процесс: он сохраняет контрольную точку
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        configure(db_path, read_only=True)
+    # Модель загружается в каждом процессе (артефакт реестра отображается
+    # в память), а не передается через pickle
+    _predictor = NeuralNetworkPredictor(seed)
+    _follow_registry = model_spec is None
+    conn = get_connection()
+    try:
+        if model_spec is not None:
+            _predictor.set_model(model_registry.resolve(conn, model_spec))
+        else:
+            model_registry.sync(_predictor, conn)
+    finally:
+        conn.close()
+
+
+def _score_shard(shard):
+    """Прогноз для одного сегмента; возвращается результат predict_cohort (массивы numpy)"""
+    index, first_id, last_id, patient_ids = shard
+    if patient_ids is None or _follow_registry:
+        conn = get_connection()
+        if _follow_registry:
+            model_registry.sync(_predictor, conn)
+        if patient_ids is None:
+            patient_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM patients WHERE id BETWEEN ? AND ? ORDER BY id", (first_id, last_id))]
+        conn.close()
+
+    return index, _predictor.predict_cohort(patient_ids)
+
+
+class Checkpoint:
+    """Файл контрольной точки: план сегментов, завершенные сегменты и позиция в файле результатов"""
+
+    def __init__(self, path, shards, settings):
+        self.path = path
+        self.shards = shards
+        self.settings = settings
+        self.completed = set()
+        self.position = None
+
+    @classmethod
+    def load(cls, path, settings):
+        """Загрузка контрольной точки; None, если файла нет или он от другого запуска"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != CHECKPOINT_VERSION or data.get('settings') != settings:
+            return None
+
+        checkpoint = cls(path, [tuple(shard) for shard in data['shards']], settings)
+        checkpoint.completed = set(data['completed'])
+        checkpoint.position = data.get('position')
+        return checkpoint
+
+    def mark_completed(self, index, position):
+        """Отметка завершенного сегмента, уже записанного в результаты"""
+        self.completed.add(index)
+        self.position = position
+        self.save()
+
+    def save(self):
+        """Атомарная запись файла: прерывание не оставляет его наполовину записанным"""
+        data = {
+            'version': CHECKPOINT_VERSION,
+            'settings': self.settings,
+            'shards': self.shards,
+            'completed': sorted(self.completed),
+            'position': self.position
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        """Удаление контрольной точки после успешного завершения"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ScoringPipeline:
+    """Прогнозирование по сегментам в пуле процессов с единственным писателем результатов"""
+
+    def __init__(self, workers=None, seed=None, max_pending=None, model_spec=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+        self.model_spec = model_spec
+        # Ограничение числа сегментов в работе, чтобы готовые результаты не копились в памяти
+        self.max_pending = max_pending or self.workers * 2
+
+    def iter_results(self, shards):
+        """Результаты сегментов в порядке готовности: (номер сегмента, когорта)"""
+        if self.workers == 1 or len(shards) <= 1:
+            _init_worker(seed=self.seed, model_spec=self.model_spec)
+            yield from map(_score_shard, shards)
+            return
+
+        # Рабочие процессы открывают собственные соединения, а не используют унаследованные
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                       initargs=(get_db_path(), self.seed, self.model_spec))
+        queue = iter(shards)
+        pending = {executor.submit(_score_shard, shard)
+                   for shard in itertools.islice(queue, self.max_pending)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                pending.update(executor.submit(_score_shard, shard)
+                               for shard in itertools.islice(queue, len(done)))
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    def run(self, shards, writer, checkpoint=None, progress=None):
+        """Прогноз по всем незавершенным сегментам с записью результатов одним писателем
+
+        writer.write_cohort(когорта) записывает результаты сегмента,
+        writer.commit() делает их долговечными и возвращает позицию для
+        контрольной точки. progress(готово, всего) вызывается после каждого сегмента.
+        """
+        if checkpoint is not None:
+            remaining = [shard for shard in shards if shard[0] not in checkpoint.completed]
+        else:
+            remaining = shards
+
+        total = len(shards)
+        done = total - len(remaining)
+        scored = 0
+        if progress:
+            progress(done, total)
+
+        for index, cohort in self.iter_results(remaining):
+            writer.write_cohort(cohort)
+            position = writer.commit()
+            if checkpoint is not None:
+                checkpoint.mark_completed(index, position)
+            done += 1
+            scored += len(cohort['patient_ids'])
+            if progress:
+                progress(done, total)
+
+        return scored
+
+
+class ProgressReporter:
+    """Вывод прогресса по сегментам в поток (обычно stderr)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.started = time.monotonic()
+        self.first_done = None
+
+    def __call__(self, done, total):
+        if self.first_done is None:
+            # Сегменты, завершенные до возобновления, не учитываются в скорости
+            self.first_done = done
+        elapsed = time.monotonic() - self.started
+        percent = done * 100 / total if total else 100.0
+        rate = (done - self.first_done) / elapsed if elapsed > 0 else 0.0
+        self.stream.write(f"\rОбработано сегментов: {done} из {total} ({percent:.1f}%), {rate:.1f} сегм./с")
+        self.stream.flush()
@@ -0,0 +1,167 @@
+"""Фоновое выполнение работы с базой данных и прогнозов вне главного потока Tk"""
+import threading
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox, ttk
+
+# Период опроса завершенных задач главным циклом Tk, мс
+POLL_INTERVAL = 50
+
+
+class TaskCancelled(Exception):
+    """Задача отменена пользователем"""
+
+
+class Task:
+    """Фоновая задача: отмена и прогресс передаются через этот объект
+
+    Функция задачи выполняется в рабочем потоке и не должна обращаться
+    к виджетам. Она может вызывать report_progress() и check_cancelled()
+    между шагами работы.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        self.future = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._progress = (0, None, None)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Отмена задачи: не начатая не запускается, результат начатой отбрасывается"""
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check_cancelled(self):
+        """Прерывание работы задачи, если ее отменили"""
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def report_progress(self, done, total=None, text=None):
+        """Сообщение о прогрессе из рабочего потока; total=None - объем работы неизвестен"""
+        with self._lock:
+            self._progress = (done, total, text)
+
+    def get_progress(self):
+        with self._lock:
+            return self._progress
+
+
+class ProgressIndicator:
+    """Полоса прогресса задачи с кнопкой отмены"""
+
+    def __init__(self, parent, task):
+        self.task = task
+        self.frame = tk.Frame(parent)
+        self.frame.pack(side='bottom', fill='x', padx=10, pady=5)
+
+        self.label = tk.Label(self.frame, text=task.description, font=('Arial', 12))
+        self.label.pack(side='left')
+
+        self.bar = ttk.Progressbar(self.frame, mode='indeterminate', length=300)
+        self.bar.pack(side='left', padx=10)
+        self.bar.start(15)
+
+        tk.Button(self.frame, text="Отмена", font=('Arial', 12),
+                  command=task.cancel).pack(side='left')
+
+    def update(self):
+        """Обновление полосы по последнему сообщению задачи"""
+        done, total, text = self.task.get_progress()
+        if total:
+            if str(self.bar['mode']) != 'determinate':
+                self.bar.stop()
+                self.bar.config(mode='determinate', maximum=total)
+            self.bar['value'] = done
+        if text:
+            self.label.config(text=f"{self.task.description}: {text}")
+
+    def close(self):
+        if self.frame.winfo_exists():
+            self.frame.destroy()
+
+
+class TaskRunner:
+    """Пул рабочих потоков для долгих операций графического интерфейса
+
+    Результаты передаются в главный поток опросом через root.after, поэтому
+    обработчики on_success и on_error могут работать с виджетами.
+    """
+
+    def __init__(self, root, max_workers=2):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ui-task')
+        self._active = []
+        self._polling = False
+
+    def submit(self, func, description, on_success=None, on_error=None, owner=None, indicator_parent=None,
+               show_progress=True):
+        """Запуск func(task) в рабочем потоке
+
+        on_success(результат) и on_error(исключение) вызываются в главном
+        потоке; без on_error ошибка показывается в окне сообщения. Если виджет
+        owner к моменту завершения уничтожен (пользователь ушел с экрана),
+        результат отбрасывается. Индикатор прогресса размещается в
+        indicator_parent (по умолчанию - в главном окне); для коротких частых
+        задач (поиск при вводе) индикатор отключается show_progress=False.
+        """
+        task = Task(description)
+        indicator = ProgressIndicator(indicator_parent or self.root, task) if show_progress else None
+        task.future = self.executor.submit(func, task)
+        self._active.append((task, indicator, on_success, on_error, owner))
+        if not self._polling:
+            self._polling = True
+            self.root.after(POLL_INTERVAL, self._poll)
+        return task
+
+    def _poll(self):
+        """Обработка завершенных задач и обновление индикаторов в главном потоке"""
+        active = []
+        finished = []
+        for entry in self._active:
+            task, indicator = entry[:2]
+            if task.future.done() or task.cancelled:
+                if indicator is not None:
+                    indicator.close()
+                finished.append(entry)
+            else:
+                if indicator is not None and indicator.frame.winfo_exists():
+                    indicator.update()
+                active.append(entry)
+
+        # Следующий опрос планируется до обработчиков: ошибка в обработчике не останавливает опрос
+        self._active = active
+        if active:
+            self.root.after(POLL_INTERVAL, self._poll)
+        else:
+            self._polling = False
+
+        for task, indicator, on_success, on_error, owner in finished:
+            if task.cancelled or (owner is not None and not owner.winfo_exists()):
+                continue
+            try:
+                result = task.future.result()
+            except TaskCancelled:
+                continue
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+                else:
+                    messagebox.showerror("Ошибка", f"{task.description}: {e}")
+                continue
+            if on_success is not None:
+                on_success(result)
+
+    def shutdown(self):
+        """Остановка рабочих потоков при закрытии приложения
+
+        Задачи в очереди выполняются до конца, чтобы начатое сохранение данных
+        не потерялось; их результаты уже не показываются.
+        """
+        self._active = []
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,477 @@
+"""Обучаемая модель рисков на numpy: логистическая регрессия или небольшой перцептрон
+
+Пример запуска:
+    python3 trained_model.py --output model.npz
+    python3 trained_model.py --output model.npz --hidden 0 --epochs 10 --limit 200000
+
+Модель обучается на таблицах базы, которые читаются мини-пакетами
+(training_loader) и целиком в память не загружаются. Для сетей, у которых в таблице
+коморбидностей есть отмеченные диагнозы (OUTCOME_COLUMNS), целевое значение -
+наличие диагноза у пациента с заполненной таблицей. Для остальных сетей и
+пациентов без коморбидностей целевое значение - риск правил
+NeuralNetworkPredictor (обучение по мягким меткам). Обученная модель
+сохраняется в сжатый файл .npz и подключается к предиктору параметром model:
+API predict_disease_risk не меняется.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+import zlib
+
+import numpy as np
+
+from database import configure, get_connection
+from migrations import migrate
+from neural_network import DEFAULT_SEED, FACTOR_NAMES, PREDICTION_MAPPINGS, NeuralNetworkPredictor
+from row_mapping import RecordMapping
+from training_loader import MiniBatchLoader, feature_statistics, plan_id_ranges, split_ranges
+from trend_features import TREND_FEATURE_NAMES
+
+# Входы модели: бинарные факторы, возраст и признаки динамики анализов
+INPUT_NAMES = FACTOR_NAMES + ['age'] + TREND_FEATURE_NAMES
+
+# Диагнозы таблицы коморбидностей, которые считаются исходом сети.
+# Столбцы, которые уже входят в факторы (ГБ, СД, ожирение), исходом не служат
+OUTCOME_COLUMNS = {
+    'cardiovascular': ['cardiovascular_diseases', 'chronic_heart_failure', 'iht', 'atherosclerosis'],
+    'respiratory': ['respiratory_failure', 'pneumonia'],
+    'neurological': ['cerebrovascular_diseases', 'brain_diseases'],
+    'metabolic_disorders': ['thyroid_diseases']
+}
+
+# Для обучения коморбидности читаются вместе со столбцами исходов
+TRAINING_MAPPINGS = dict(PREDICTION_MAPPINGS, comorbidities=RecordMapping(
+    'comorbidities', list(PREDICTION_MAPPINGS['comorbidities'].columns) +
+    [column for columns in OUTCOME_COLUMNS.values() for column in columns]))
+
+# Пациентов в одной порции чтения обучающих данных
+LOAD_CHUNK_SIZE = 5000
+
+# Строк в одной порции расчета прогноза
+INFERENCE_BATCH_SIZE = 65536
+
+DEFAULT_HIDDEN = 16
+DEFAULT_EPOCHS = 20
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_LEARNING_RATE = 0.01
+DEFAULT_L2 = 1e-4
+VALIDATION_FRACTION = 0.1
+
+# Описание модели в каталоге артефакта (save_artifact)
+ARTIFACT_METADATA = 'model.json'
+
+
+def check_input_names(input_names):
+    """ValueError, если модель обучена на других входах, чем INPUT_NAMES"""
+    if list(input_names) != INPUT_NAMES:
+        raise ValueError("Модель обучена на другом наборе признаков, ее нужно переобучить")
+
+
+def model_inputs(features, ages, trends):
+    """Матрица входов модели (пациенты x INPUT_NAMES) без нормализации; NaN - нет данных"""
+    n = len(features)
+    if trends is None:
+        trends = np.full((n, len(TREND_FEATURE_NAMES)), np.nan)
+    ages = np.full(n, np.nan) if ages is None else ages
+    return np.hstack([features.astype(np.float32), np.asarray(ages, dtype=np.float32)[:, np.newaxis],
+                      np.asarray(trends, dtype=np.float32)])
+
+
+def _sigmoid(logits):
+    """Логистическая функция без переполнения экспоненты"""
+    return np.exp(-np.logaddexp(0, -logits))
+
+
+class TrainedModel:
+    """Обученная модель: нормализация входов и слои (веса, смещения) с tanh между ними"""
+
+    def __init__(self, networks, mean, scale, layers, input_names=None, version=None):
+        self.networks = list(networks)
+        self.input_names = list(input_names) if input_names is not None else list(INPUT_NAMES)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.layers = [(np.asarray(weights, dtype=np.float32), np.asarray(biases, dtype=np.float32))
+                       for weights, biases in layers]
+        self.version = version or self.make_version()
+
+    @property
+    def hidden(self):
+        """Размер скрытого слоя; 0 - логистическая регрессия"""
+        return self.layers[0][0].shape[1] if len(self.layers) > 1 else 0
+
+    def make_version(self):
+        """Версия модели по содержимому весов: переобученная модель получает новую версию"""
+        checksum = 0
+        for weights, biases in self.layers:
+            checksum = zlib.crc32(biases.tobytes(), zlib.crc32(weights.tobytes(), checksum))
+        kind = f"mlp{self.hidden}" if self.hidden else "logreg"
+        return f"nn-trained-{kind}-{checksum:08x}"
+
+    def normalize(self, inputs):
+        """Нормализация входов; отсутствующие значения заменяются средним (0 после нормализации)"""
+        normalized = (inputs - self.mean) / self.scale
+        return np.nan_to_num(normalized, nan=0.0, posinf=0.0, neginf=0.0)
+
+    def logits(self, normalized):
+        """Выходы последнего слоя до логистической функции"""
+        hidden = normalized
+        for weights, biases in self.layers[:-1]:
+            hidden = np.tanh(hidden @ weights + biases)
+        weights, biases = self.layers[-1]
+        return hidden @ weights + biases
+
+    def predict(self, inputs, batch_size=INFERENCE_BATCH_SIZE):
+        """Риски сетей (пациенты x networks) для матрицы входов; расчет порциями по batch_size строк"""
+        risks = np.empty((len(inputs), len(self.networks)))
+        for start in range(0, len(inputs), batch_size):
+            batch = self.normalize(inputs[start:start + batch_size])
+            risks[start:start + batch_size] = _sigmoid(self.logits(batch))
+        return risks
+
+    def predict_risks(self, features, ages, trends):
+        """Риски сетей по матрице факторов, возрасту и признакам динамики когорты"""
+        return self.predict(model_inputs(features, ages, trends))
+
+    def save(self, path):
+        """Сохранение в сжатый .npz; файл заменяется атомарно, чтобы читатели не видели его частично"""
+        arrays = {
+            'version': np.array(self.version),
+            'networks': np.array(self.networks),
+            'input_names': np.array(self.input_names),
+            'mean': self.mean,
+            'scale': self.scale
+        }
+        for i, (weights, biases) in enumerate(self.layers):
+            arrays[f'weights_{i}'] = weights
+            arrays[f'biases_{i}'] = biases
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Загрузка модели из .npz; ValueError, если модель обучена на других входах"""
+        with np.load(path, allow_pickle=False) as data:
+            input_names = data['input_names'].tolist()
+            check_input_names(input_names)
+            layers = []
+            while f'weights_{len(layers)}' in data.files:
+                layers.append((data[f'weights_{len(layers)}'], data[f'biases_{len(layers)}']))
+            return cls(data['networks'].tolist(), data['mean'], data['scale'], layers,
+                       input_names, str(data['version']))
+
+    def save_artifact(self, directory):
+        """Сохранение в каталог: массив на файл .npy (их можно отобразить в память) и model.json"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'mean.npy'), self.mean)
+        np.save(os.path.join(directory, 'scale.npy'), self.scale)
+        for i, (weights, biases) in enumerate(self.layers):
+            np.save(os.path.join(directory, f'weights_{i}.npy'), weights)
+            np.save(os.path.join(directory, f'biases_{i}.npy'), biases)
+        metadata = {'version': self.version, 'networks': self.networks, 'input_names': self.input_names,
+                    'layers': len(self.layers)}
+        with open(os.path.join(directory, ARTIFACT_METADATA), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load_artifact(cls, directory, mmap_mode='r'):
+        """Загрузка модели из каталога save_artifact; массивы отображаются в память, а не читаются"""
+        with open(os.path.join(directory, ARTIFACT_METADATA), encoding='utf-8') as f:
+            metadata = json.load(f)
+        check_input_names(metadata['input_names'])
+
+        def array(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+
+        layers = [(array(f'weights_{i}'), array(f'biases_{i}')) for i in range(metadata['layers'])]
+        return cls(metadata['networks'], array('mean'), array('scale'), layers,
+                   metadata['input_names'], metadata['version'])
+
+
+class Adam:
+    """Оптимизатор Adam для списка массивов параметров (обновление на месте)"""
+
+    def __init__(self, parameters, learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        self.parameters = parameters
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.moments = [np.zeros_like(parameter) for parameter in parameters]
+        self.velocities = [np.zeros_like(parameter) for parameter in parameters]
+        self.steps = 0
+
+    def step(self, gradients):
+        """Шаг оптимизации по градиентам в порядке parameters"""
+        self.steps += 1
+        correction1 = 1 - self.beta1 ** self.steps
+        correction2 = 1 - self.beta2 ** self.steps
+        for parameter, gradient, moment, velocity in zip(self.parameters, gradients, self.moments, self.velocities):
+            moment *= self.beta1
+            moment += (1 - self.beta1) * gradient
+            velocity *= self.beta2
+            velocity += (1 - self.beta2) * gradient * gradient
+            parameter -= (self.learning_rate * (moment / correction1) /
+                          (np.sqrt(velocity / correction2) + self.epsilon))
+
+
+def cross_entropy(model, normalized, targets):
+    """Средняя перекрестная энтропия модели на нормализованных входах (мягкие метки допускаются)"""
+    logits = model.logits(normalized)
+    return float(np.mean(np.logaddexp(0, logits) - targets * logits))
+
+
+def new_model(n_inputs, networks, mean, scale, hidden=DEFAULT_HIDDEN, seed=DEFAULT_SEED):
+    """Модель со случайными начальными весами; столбец без разброса не масштабируется"""
+    rng = np.random.default_rng(seed)
+    mean = np.nan_to_num(np.asarray(mean, dtype=np.float32))
+    scale = np.nan_to_num(np.asarray(scale, dtype=np.float32))
+    scale[scale == 0] = 1
+
+    sizes = [n_inputs] + ([hidden] if hidden else []) + [len(networks)]
+    layers = []
+    for fan_in, fan_out in zip(sizes[:-1], sizes[1:]):
+        weights = rng.normal(0, np.sqrt(1.0 / fan_in), (fan_in, fan_out)).astype(np.float32)
+        layers.append((weights, np.zeros(fan_out, dtype=np.float32)))
+    return TrainedModel(networks, mean, scale, layers, version='training')
+
+
+def backpropagate(model, batch, targets, l2):
+    """Потеря мини-пакета и градиенты перекрестной энтропии по параметрам [веса, смещения, ...]"""
+    activations = [batch]
+    for weights, biases in model.layers[:-1]:
+        activations.append(np.tanh(activations[-1] @ weights + biases))
+    weights, biases = model.layers[-1]
+    logits = activations[-1] @ weights + biases
+    loss = float(np.mean(np.logaddexp(0, logits) - targets * logits))
+    error = (_sigmoid(logits) - targets) / len(batch)
+
+    gradients = []
+    for index in range(len(model.layers) - 1, -1, -1):
+        weights, biases = model.layers[index]
+        gradients.append((activations[index].T @ error + l2 * weights, error.sum(axis=0)))
+        if index:
+            error = (error @ weights.T) * (1 - activations[index] ** 2)
+    return loss, [array for layer in reversed(gradients) for array in layer]
+
+
+def fit_epoch(model, optimizer, batches, l2=DEFAULT_L2):
+    """Эпоха обучения по мини-пакетам (входы без нормализации, цели); возвращает среднюю потерю"""
+    total = 0.0
+    rows = 0
+    for inputs, targets in batches:
+        loss, gradients = backpropagate(model, model.normalize(inputs), targets, l2)
+        optimizer.step(gradients)
+        total += loss * len(inputs)
+        rows += len(inputs)
+    return total / rows if rows else None
+
+
+def evaluate(model, batches):
+    """Средняя перекрестная энтропия модели по мини-пакетам"""
+    total = 0.0
+    rows = 0
+    for inputs, targets in batches:
+        total += cross_entropy(model, model.normalize(inputs), targets) * len(inputs)
+        rows += len(inputs)
+    return total / rows if rows else None
+
+
+def train_model(inputs, targets, networks, hidden=DEFAULT_HIDDEN, epochs=DEFAULT_EPOCHS,
+                batch_size=DEFAULT_BATCH_SIZE, learning_rate=DEFAULT_LEARNING_RATE, l2=DEFAULT_L2,
+                seed=DEFAULT_SEED, progress=None):
+    """Обучение модели на данных в памяти (Adam, перекрестная энтропия); возвращает TrainedModel
+
+    inputs - матрица model_inputs, targets - целевые вероятности (пациенты x networks).
+    progress(эпоха, эпох, потеря обучения, потеря проверки) вызывается после каждой эпохи.
+    Для регистра, который не помещается в память, - train_streaming.
+    """
+    rng = np.random.default_rng(seed)
+    inputs = np.asarray(inputs, dtype=np.float32)
+    targets = np.asarray(targets, dtype=np.float32)
+
+    # Нормализация по обучающим данным (столбец динамики без данных у всех
+    # пациентов дает NaN и предупреждение numpy)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(inputs, axis=0)
+        scale = np.nanstd(inputs, axis=0)
+    model = new_model(inputs.shape[1], networks, mean, scale, hidden, seed)
+
+    # Часть пациентов откладывается для проверки
+    order = rng.permutation(len(inputs))
+    n_validation = int(len(inputs) * VALIDATION_FRACTION) if len(inputs) >= 100 else 0
+    validation, training = order[:n_validation], order[n_validation:]
+
+    def batches(rows):
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            yield inputs[batch], targets[batch]
+
+    optimizer = Adam([array for layer in model.layers for array in layer], learning_rate)
+    for epoch in range(1, epochs + 1):
+        rng.shuffle(training)
+        train_loss = fit_epoch(model, optimizer, batches(training), l2)
+        if progress:
+            validation_loss = evaluate(model, batches(validation)) if len(validation) else None
+            progress(epoch, epochs, train_loss, validation_loss)
+
+    return TrainedModel(networks, model.mean, model.scale, model.layers)
+
+
+def train_streaming(loader, networks, validation_loader=None, hidden=DEFAULT_HIDDEN, epochs=DEFAULT_EPOCHS,
+                    learning_rate=DEFAULT_LEARNING_RATE, l2=DEFAULT_L2, seed=DEFAULT_SEED, progress=None):
+    """Обучение по мини-пакетам загрузчика training_loader.MiniBatchLoader; возвращает TrainedModel
+
+    Нормализация считается отдельным проходом по загрузчику, затем каждая
+    эпоха читает базу заново: в памяти находятся только буферы загрузчика.
+    """
+    mean, scale = feature_statistics(loader)
+    if mean is None:
+        raise ValueError("Нет данных для обучения")
+    model = new_model(len(mean), networks, mean, scale, hidden, seed)
+
+    optimizer = Adam([array for layer in model.layers for array in layer], learning_rate)
+    for epoch in range(1, epochs + 1):
+        train_loss = fit_epoch(model, optimizer, loader.epoch(epoch), l2)
+        if progress:
+            validation_loss = evaluate(model, validation_loader.epoch()) if validation_loader else None
+            progress(epoch, epochs, train_loss, validation_loss)
+
+    return TrainedModel(networks, model.mean, model.scale, model.layers)
+
+
+def outcome_targets(networks, comorbidities, rule_risks):
+    """Целевые значения: диагноз из коморбидностей, где он известен, иначе риск правил"""
+    targets = rule_risks.copy()
+    has_comorbidities = np.fromiter((row is not None for row in comorbidities), dtype=bool, count=len(comorbidities))
+    for network_index, network_name in enumerate(networks):
+        columns = OUTCOME_COLUMNS.get(network_name)
+        if not columns:
+            continue
+        outcome = np.fromiter(
+            (row is not None and any(getattr(row, column) for column in columns) for row in comorbidities),
+            dtype=bool, count=len(comorbidities))
+        targets[has_comorbidities, network_index] = outcome[has_comorbidities]
+    return targets
+
+
+def training_chunk(predictor, patient_ids):
+    """Входы и целевые значения обучения для части пациентов: (входы, цели)
+
+    Риски правил рассчитываются предиктором без обученной модели.
+    """
+    ids, cohort_rows = predictor.get_cohort_data(patient_ids, TRAINING_MAPPINGS)
+    features, ages, imputed = predictor.build_feature_matrix(cohort_rows)
+    networks, rule_risks = predictor.score_features(features, np.array(ids, dtype=np.int64))
+    return (model_inputs(features, ages, cohort_rows['trends']),
+            outcome_targets(networks, cohort_rows['comorbidities'], rule_risks).astype(np.float32))
+
+
+def load_training_data(patient_ids, predictor=None, chunk_size=LOAD_CHUNK_SIZE, progress=None):
+    """Входы и целевые значения обучения для списка пациентов в памяти: (сети, входы, цели)
+
+    Данные читаются порциями по chunk_size пациентов детерминированным
+    предиктором. progress(прочитано пациентов, всего) вызывается после каждой порции.
+    """
+    predictor = predictor or NeuralNetworkPredictor(seed=DEFAULT_SEED)
+    network_names = list(predictor.networks)
+    inputs = []
+    targets = []
+    done = 0
+    for start in range(0, len(patient_ids), chunk_size):
+        chunk = patient_ids[start:start + chunk_size]
+        chunk_inputs, chunk_targets = training_chunk(predictor, chunk)
+        inputs.append(chunk_inputs)
+        targets.append(chunk_targets)
+        done += len(chunk)
+        if progress:
+            progress(done, len(patient_ids))
+
+    if not inputs:
+        return network_names, np.empty((0, len(INPUT_NAMES)), dtype=np.float32), np.empty((0, len(network_names)))
+    return network_names, np.vstack(inputs), np.vstack(targets)
+
+
+def streaming_loaders(conn, batch_size=DEFAULT_BATCH_SIZE, chunk_size=LOAD_CHUNK_SIZE, limit=None,
+                      predictor=None, seed=DEFAULT_SEED):
+    """Загрузчики мини-пакетов обучения и проверки по диапазонам id пациентов: (сети, обучение, проверка)"""
+    predictor = predictor or NeuralNetworkPredictor(seed=DEFAULT_SEED)
+    network_names = list(predictor.networks)
+    training, validation = split_ranges(plan_id_ranges(conn, chunk_size, limit), VALIDATION_FRACTION, seed)
+
+    def load_chunk(patient_ids):
+        return training_chunk(predictor, patient_ids)
+
+    loaders = [MiniBatchLoader(ranges, load_chunk, len(INPUT_NAMES), len(network_names), batch_size, chunk_size,
+                               shuffle=shuffle, seed=seed) if ranges else None
+               for ranges, shuffle in ((training, True), (validation, False))]
+    return network_names, loaders[0], loaders[1]
+
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Обучение модели рисков заболеваний на данных пациентов")
+    parser.add_argument('--db', help="путь к базе данных (по умолчанию MEDICAL_DB_PATH или medical_system.db)")
+    parser.add_argument('--output', '-o', required=True, help="файл модели .npz")
+    parser.add_argument('--hidden', type=int, default=DEFAULT_HIDDEN,
+                        help=f"нейронов скрытого слоя, 0 - логистическая регрессия (по умолчанию {DEFAULT_HIDDEN})")
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS, help="эпох обучения")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="пациентов в мини-пакете")
+    parser.add_argument('--learning-rate', type=float, default=DEFAULT_LEARNING_RATE, help="шаг обучения Adam")
+    parser.add_argument('--chunk-size', type=int, default=LOAD_CHUNK_SIZE,
+                        help="пациентов в одном диапазоне чтения из базы")
+    parser.add_argument('--limit', type=int, help="максимальное количество пациентов")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="seed разбиения и начальных весов")
+    parser.add_argument('--quiet', '-q', action='store_true', help="не выводить прогресс")
+    args = parser.parse_args(argv)
+    if args.hidden < 0:
+        parser.error("--hidden не может быть отрицательным")
+    if args.epochs < 1 or args.batch_size < 1 or args.chunk_size < 1:
+        parser.error("--epochs, --batch-size и --chunk-size должны быть положительными")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db:
+        configure(args.db)
+
+    conn = get_connection()
+    migrate(conn)
+    networks, loader, validation_loader = streaming_loaders(conn, args.batch_size, args.chunk_size, args.limit,
+                                                            seed=args.seed)
+    conn.close()
+    if loader is None:
+        print("Пациенты не найдены", file=sys.stderr)
+        return 1
+
+    def train_progress(epoch, epochs, train_loss, validation_loss):
+        line = f"Эпоха {epoch}/{epochs}: потеря {train_loss:.4f}"
+        if validation_loss is not None:
+            line += f", на проверке {validation_loss:.4f}"
+        print(line, file=sys.stderr)
+
+    started = time.monotonic()
+    try:
+        model = train_streaming(loader, networks, validation_loader, args.hidden, args.epochs, args.learning_rate,
+                                seed=args.seed, progress=None if args.quiet else train_progress)
+        model.save(args.output)
+    except KeyboardInterrupt:
+        print("\nПрервано", file=sys.stderr)
+        return 130
+    except OSError as e:
+        print(f"Ошибка записи файла модели: {e}", file=sys.stderr)
+        return 1
+
+    if not args.quiet:
+        print(f"Готово: модель {model.version}, {time.monotonic() - started:.1f} с", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
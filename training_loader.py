@@ -0,0 +1,226 @@
+"""Потоковая загрузка обучающих данных из базы мини-пакетами фиксированного размера
+
+Пациенты делятся на диапазоны rowid таблицы patients по chunk_size строк;
+в памяти хранятся только границы диапазонов. Фоновый поток читает диапазоны
+(в случайном порядке при перемешивании), собирает несколько диапазонов в
+заранее выделенный буфер перемешивания и раскладывает строки по мини-пакетам
+в кольцо заранее выделенных буферов. Весь набор данных в памяти не
+собирается: одновременно загружено не больше shuffle_chunks диапазонов.
+"""
+import queue
+import threading
+
+import numpy as np
+
+from database import get_pool
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_BATCH_SIZE = 512
+# Диапазонов, строки которых перемешиваются между собой
+DEFAULT_SHUFFLE_CHUNKS = 4
+# Готовых мини-пакетов, которые фоновый поток держит впереди обучения
+DEFAULT_PREFETCH = 4
+
+# Период проверки флага остановки фоновым потоком, с
+_POLL_INTERVAL = 0.1
+
+
+def plan_id_ranges(conn, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """Диапазоны идентификаторов пациентов по chunk_size строк: [(первый id, последний id)]
+
+    Идентификаторы читаются курсором по индексу первичного ключа, в список
+    попадают только границы диапазонов.
+    """
+    query = "SELECT id FROM patients ORDER BY id"
+    params = []
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    ranges = []
+    first = last = None
+    count = 0
+    for (patient_id,) in conn.execute(query, params):
+        if first is None:
+            first = patient_id
+        last = patient_id
+        count += 1
+        if count == chunk_size:
+            ranges.append((first, last))
+            first = None
+            count = 0
+    if first is not None:
+        ranges.append((first, last))
+    return ranges
+
+
+def split_ranges(ranges, fraction, seed=0):
+    """Случайная доля диапазонов для проверки: (обучающие, проверочные)"""
+    if len(ranges) < 2 or fraction <= 0:
+        return list(ranges), []
+    rng = np.random.default_rng(seed)
+    n_validation = min(len(ranges) - 1, max(1, int(round(len(ranges) * fraction))))
+    chosen = set(rng.choice(len(ranges), n_validation, replace=False).tolist())
+    return ([r for i, r in enumerate(ranges) if i not in chosen],
+            [r for i, r in enumerate(ranges) if i in chosen])
+
+
+class _LoaderStopped(Exception):
+    """Обучение прекратило чтение мини-пакетов: фоновый поток завершается"""
+
+
+class MiniBatchLoader:
+    """Мини-пакеты (входы, цели) из базы с перемешиванием между диапазонами и фоновой загрузкой
+
+    load_chunk(patient_ids) -> (входы, цели) строит матрицы для пациентов
+    одного диапазона. Выдаваемые массивы - представления буферов загрузчика:
+    они действительны до запроса следующего мини-пакета.
+    """
+
+    def __init__(self, ranges, load_chunk, n_inputs, n_outputs, batch_size=DEFAULT_BATCH_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE, shuffle=True, shuffle_chunks=DEFAULT_SHUFFLE_CHUNKS,
+                 prefetch=DEFAULT_PREFETCH, seed=0):
+        self.ranges = list(ranges)
+        self.load_chunk = load_chunk
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_chunks = max(1, shuffle_chunks)
+        self.seed = seed
+
+        # Буфер перемешивания: несколько диапазонов и остаток строк предыдущей группы
+        capacity = self.shuffle_chunks * chunk_size + batch_size
+        self.pool_inputs = np.empty((capacity, n_inputs), dtype=np.float32)
+        self.pool_targets = np.empty((capacity, n_outputs), dtype=np.float32)
+        # Кольцо буферов мини-пакетов: prefetch готовых, один у обучения, один заполняется
+        self.buffers = [(np.empty((batch_size, n_inputs), dtype=np.float32),
+                         np.empty((batch_size, n_outputs), dtype=np.float32))
+                        for _ in range(prefetch + 2)]
+
+    def __len__(self):
+        """Число диапазонов загрузчика"""
+        return len(self.ranges)
+
+    def epoch(self, number=0):
+        """Мини-пакеты одной эпохи; порядок перемешивания зависит от seed и номера эпохи"""
+        free = queue.Queue()
+        for buffer in self.buffers:
+            free.put(buffer)
+        ready = queue.Queue()
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(number, free, ready, stop),
+                                  name="training-loader", daemon=True)
+        thread.start()
+
+        current = None
+        try:
+            while True:
+                item = ready.get()
+                if current is not None:
+                    free.put(current)
+                    current = None
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                current, rows = item
+                yield current[0][:rows], current[1][:rows]
+        finally:
+            # Обучение могло прекратить чтение раньше конца эпохи
+            stop.set()
+            thread.join()
+
+    def _take_buffer(self, free, stop):
+        """Свободный буфер мини-пакета; ждет, пока обучение вернет использованный"""
+        while True:
+            if stop.is_set():
+                raise _LoaderStopped()
+            try:
+                return free.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+    def _emit(self, order, free, ready, stop):
+        """Строки буфера перемешивания в порядке order - в мини-пакеты; возвращает число выданных строк
+
+        Строки собираются np.take прямо в буфер мини-пакета, без промежуточных копий.
+        """
+        batch_size = self.batch_size
+        start = 0
+        while len(order) - start >= batch_size:
+            inputs, targets = self._take_buffer(free, stop)
+            rows = order[start:start + batch_size]
+            np.take(self.pool_inputs, rows, axis=0, out=inputs)
+            np.take(self.pool_targets, rows, axis=0, out=targets)
+            ready.put(((inputs, targets), batch_size))
+            start += batch_size
+        return start
+
+    def _produce(self, number, free, ready, stop):
+        """Фоновое чтение диапазонов: собственное соединение потока, результат - в очередь ready
+
+        Поток живет одну эпоху, поэтому его соединение по завершении закрывается,
+        а не остается в пуле.
+        """
+        rng = np.random.default_rng([self.seed, number])
+        pool = get_pool()
+        conn = pool.connection()
+        try:
+            order = rng.permutation(len(self.ranges)) if self.shuffle else np.arange(len(self.ranges))
+            carried = 0
+            for group_start in range(0, len(order), self.shuffle_chunks):
+                rows = carried
+                for range_index in order[group_start:group_start + self.shuffle_chunks]:
+                    first_id, last_id = self.ranges[range_index]
+                    patient_ids = [row[0] for row in conn.execute(
+                        "SELECT id FROM patients WHERE id BETWEEN ? AND ? ORDER BY id", (first_id, last_id))]
+                    if stop.is_set():
+                        raise _LoaderStopped()
+                    inputs, targets = self.load_chunk(patient_ids)
+                    self.pool_inputs[rows:rows + len(inputs)] = inputs
+                    self.pool_targets[rows:rows + len(inputs)] = targets
+                    rows += len(inputs)
+
+                # Строки группы выдаются в случайном порядке; остаток меньше
+                # мини-пакета переносится в начало буфера для следующей группы
+                row_order = rng.permutation(rows) if self.shuffle else np.arange(rows)
+                emitted = self._emit(row_order, free, ready, stop)
+                rest = row_order[emitted:]
+                carried = len(rest)
+                self.pool_inputs[:carried] = self.pool_inputs[rest]
+                self.pool_targets[:carried] = self.pool_targets[rest]
+
+            # Последний неполный мини-пакет
+            if carried:
+                inputs, targets = self._take_buffer(free, stop)
+                inputs[:carried] = self.pool_inputs[:carried]
+                targets[:carried] = self.pool_targets[:carried]
+                ready.put(((inputs, targets), carried))
+            ready.put(None)
+        except _LoaderStopped:
+            pass
+        except BaseException as e:
+            ready.put(e)
+        finally:
+            conn.close()
+            pool.close_thread_connection()
+
+
+def feature_statistics(loader):
+    """Среднее и стандартное отклонение входов одним проходом загрузчика (NaN пропускаются)"""
+    sums = counts = squares = None
+    for inputs, targets in loader.epoch():
+        known = ~np.isnan(inputs)
+        values = np.where(known, inputs, 0).astype(np.float64)
+        if sums is None:
+            sums = np.zeros(inputs.shape[1])
+            squares = np.zeros(inputs.shape[1])
+            counts = np.zeros(inputs.shape[1])
+        sums += values.sum(axis=0)
+        squares += (values * values).sum(axis=0)
+        counts += known.sum(axis=0)
+    if sums is None:
+        return None, None
+    safe_counts = np.maximum(counts, 1)
+    mean = sums / safe_counts
+    std = np.sqrt(np.maximum(squares / safe_counts - mean * mean, 0))
+    return mean, std
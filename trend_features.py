@@ -0,0 +1,179 @@
+"""Признаки динамики лабораторных показателей по истории визитов пациента
+
+Для каждого ряда (показатель таблицы измерений) по визитам пациента
+считаются последнее значение, изменение к предыдущему визиту, наклон
+линейного тренда за 30 дней и среднее последних визитов. Расчет
+векторизован: история всей когорты читается одним запросом на таблицу,
+а статистики по пациентам считаются группировкой массивов numpy без
+цикла по пациентам.
+"""
+import numpy as np
+
+# Ряды: (имя ряда, таблица, столбец). Таблица должна входить в
+# PREDICTION_INPUT_TABLES, чтобы новый визит делал сохраненный прогноз устаревшим
+TREND_SERIES = [
+    ('hemoglobin', 'blood_tests_extended', 'hemoglobin'),
+    ('leukocytes', 'blood_tests_extended', 'leukocytes'),
+    ('erythrocytes', 'blood_tests_extended', 'erythrocytes'),
+    ('soe', 'blood_tests_extended', 'soe'),
+    ('lymphocytes', 'blood_tests_extended', 'lymphocytes')
+]
+
+# Статистики ряда: последнее значение, изменение к предыдущему визиту,
+# наклон за 30 дней, скользящее среднее последних визитов, число визитов
+TREND_STATS = ['last', 'delta', 'slope', 'mean', 'visits']
+
+# Визитов в скользящем среднем
+ROLLING_VISITS = 3
+
+# Наклон тренда выражается в изменении за этот период, дней
+SLOPE_PERIOD = 30.0
+
+# Столбцы матрицы признаков: ряд_статистика
+TREND_FEATURE_NAMES = [f'{series}_{stat}' for series, table, column in TREND_SERIES for stat in TREND_STATS]
+
+
+def series_statistics(groups, days, values, n_groups):
+    """Статистики ряда по группам (матрица n_groups x TREND_STATS, NaN - нет данных)
+
+    groups - номер группы (пациента) каждой строки, days - день визита;
+    строки отсортированы по группе и дате. Значения NaN пропускаются.
+    """
+    result = np.full((n_groups, len(TREND_STATS)), np.nan)
+    result[:, TREND_STATS.index('visits')] = 0
+    valid = ~np.isnan(values)
+    groups, days, values = groups[valid], days[valid], values[valid]
+    if not len(values):
+        return result
+
+    counts = np.bincount(groups, minlength=n_groups)
+    present = counts > 0
+    # Последняя строка каждой группы: строки отсортированы, поэтому это конец отрезка группы
+    ends = np.cumsum(counts) - 1
+    last = np.full(n_groups, np.nan)
+    last[present] = values[ends[present]]
+
+    # Изменение к предыдущему визиту
+    delta = np.full(n_groups, np.nan)
+    repeated = counts > 1
+    delta[repeated] = values[ends[repeated]] - values[ends[repeated] - 1]
+
+    # Наклон по методу наименьших квадратов; дни центрируются по группе,
+    # чтобы суммы квадратов не теряли точность на юлианских датах
+    safe_counts = np.maximum(counts, 1)
+    mean_days = np.bincount(groups, days, n_groups) / safe_counts
+    mean_values = np.bincount(groups, values, n_groups) / safe_counts
+    centered_days = days - mean_days[groups]
+    sxx = np.bincount(groups, centered_days * centered_days, n_groups)
+    sxy = np.bincount(groups, centered_days * (values - mean_values[groups]), n_groups)
+    slope = np.full(n_groups, np.nan)
+    trend = repeated & (sxx > 0)
+    slope[trend] = sxy[trend] / sxx[trend] * SLOPE_PERIOD
+
+    # Скользящее среднее последних ROLLING_VISITS визитов
+    recent = (ends[groups] - np.arange(len(values))) < ROLLING_VISITS
+    recent_counts = np.bincount(groups[recent], minlength=n_groups)
+    mean = np.full(n_groups, np.nan)
+    mean[present] = (np.bincount(groups[recent], values[recent], n_groups)[present] /
+                     recent_counts[present])
+
+    result[:, TREND_STATS.index('last')] = last
+    result[:, TREND_STATS.index('delta')] = delta
+    result[:, TREND_STATS.index('slope')] = slope
+    result[:, TREND_STATS.index('mean')] = mean
+    result[:, TREND_STATS.index('visits')] = counts
+    return result
+
+
+def history_arrays(rows, n_columns):
+    """Строки истории (patient_id, день, значения...) в массивы; нечисловые значения - NaN"""
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty((0, n_columns))
+    data = np.array(rows, dtype=np.float64)
+    return data[:, 0].astype(np.int64), data[:, 1], data[:, 2:]
+
+
+def compute_trend_features(patient_ids, histories):
+    """Матрица признаков динамики (пациенты x TREND_FEATURE_NAMES) по прочитанной истории
+
+    histories - {таблица: (patient_id строк, дни, значения столбцов ряда)},
+    строки отсортированы по пациенту и дате. Пациенты без истории получают NaN
+    (число визитов - 0).
+    """
+    patient_ids = np.asarray(patient_ids, dtype=np.int64)
+    features = np.full((len(patient_ids), len(TREND_FEATURE_NAMES)), np.nan)
+    features[:, TREND_STATS.index('visits')::len(TREND_STATS)] = 0
+    if not len(patient_ids):
+        return features
+
+    # Статистики считаются в порядке возрастания id: строки истории отсортированы
+    # так же, поэтому строки каждого пациента идут подряд
+    order = np.argsort(patient_ids, kind='stable')
+    sorted_ids = patient_ids[order]
+    for table, (row_ids, days, values) in histories.items():
+        if not len(row_ids):
+            continue
+        groups = np.searchsorted(sorted_ids, row_ids)
+        known = (groups < len(sorted_ids)) & (sorted_ids[np.minimum(groups, len(sorted_ids) - 1)] == row_ids)
+        groups, days, values = groups[known], days[known], values[known]
+        table_series = [index for index, (series, series_table, column) in enumerate(TREND_SERIES)
+                        if series_table == table]
+        for value_index, series_index in enumerate(table_series):
+            start = series_index * len(TREND_STATS)
+            features[order, start:start + len(TREND_STATS)] = series_statistics(
+                groups, days, values[:, value_index], len(patient_ids))
+    return features
+
+
+def trend_tables():
+    """Таблицы рядов и их столбцы в порядке TREND_SERIES: {таблица: [столбцы]}"""
+    tables = {}
+    for series, table, column in TREND_SERIES:
+        tables.setdefault(table, []).append(column)
+    return tables
+
+
+def history_query(table, columns, source=None):
+    """Запрос истории таблицы по возрастанию пациента и даты визита (порядок индекса визитов)"""
+    # Текст и пустые строки в числовом столбце читаются как NULL
+    values = ', '.join(f"CASE WHEN typeof(t.{column}) IN ('integer', 'real') THEN t.{column} END"
+                       for column in columns)
+    query = f"SELECT t.patient_id, julianday(t.visit_date), {values} FROM {table} t "
+    if source:
+        query += f"JOIN {source} s ON s.id = t.patient_id "
+    return query + "WHERE t.visit_date IS NOT NULL ORDER BY t.patient_id, t.visit_date"
+
+
+def load_trend_features(conn, patient_ids):
+    """Признаки динамики для списка пациентов: один запрос на таблицу для всей когорты"""
+    cursor = conn.cursor()
+    in_transaction = conn.in_transaction
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    # Как и в load_snapshots, список пациентов передается временной таблицей
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS trend_ids (id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.trend_ids")
+    cursor.executemany("INSERT OR IGNORE INTO temp.trend_ids (id) VALUES (?)",
+                       ((int(patient_id),) for patient_id in patient_ids))
+    histories = {}
+    for table, columns in trend_tables().items():
+        if table in existing:
+            rows = cursor.execute(history_query(table, columns, 'temp.trend_ids')).fetchall()
+            histories[table] = history_arrays(rows, len(columns))
+    cursor.execute("DELETE FROM temp.trend_ids")
+    if not in_transaction:
+        conn.commit()
+
+    return compute_trend_features(patient_ids, histories)
+
+
+def load_all_trend_features(conn):
+    """Признаки динамики всех пациентов базы за один проход по каждой таблице: (id, матрица)"""
+    patient_ids = np.array([row[0] for row in conn.execute("SELECT id FROM patients ORDER BY id")], dtype=np.int64)
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    histories = {}
+    for table, columns in trend_tables().items():
+        if table in existing:
+            rows = conn.execute(history_query(table, columns)).fetchall()
+            histories[table] = history_arrays(rows, len(columns))
+    return patient_ids, compute_trend_features(patient_ids, histories)
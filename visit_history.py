@@ -0,0 +1,53 @@
+"""История визитов пациента: формат дат визитов и список визитов по всем таблицам измерений"""
+from datetime import date, datetime
+
+from migrations import VISIT_TABLES
+
+# Формат даты визита в базе: ISO, поэтому порядок строк совпадает с порядком дат
+VISIT_DATE_FORMAT = '%Y-%m-%d'
+
+# Форматы, в которых дату визита можно ввести
+INPUT_DATE_FORMATS = [VISIT_DATE_FORMAT, '%d.%m.%Y']
+
+
+def today_visit_date():
+    """Сегодняшняя дата в формате даты визита"""
+    return date.today().strftime(VISIT_DATE_FORMAT)
+
+
+def parse_visit_date(text):
+    """Дата визита из ввода (ГГГГ-ММ-ДД или ДД.ММ.ГГГГ) в формате базы; ValueError, если дата неверна"""
+    text = str(text).strip()
+    for date_format in INPUT_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime(VISIT_DATE_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"Неверная дата визита: {text!r} (ожидается ГГГГ-ММ-ДД или ДД.ММ.ГГГГ)")
+
+
+def patient_visit_dates(conn, patient_id, date_from=None, date_to=None):
+    """Даты визитов пациента за период по всем таблицам измерений, по возрастанию
+
+    Каждая таблица читается по диапазону индекса (patient_id, visit_date).
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    queries = []
+    params = []
+    for table in VISIT_TABLES:
+        if table not in tables:
+            continue
+        query = f"SELECT visit_date FROM {table} WHERE patient_id = ?"
+        params.append(patient_id)
+        if date_from is not None:
+            query += " AND visit_date >= ?"
+            params.append(date_from)
+        if date_to is not None:
+            query += " AND visit_date <= ?"
+            params.append(date_to)
+        queries.append(query)
+    if not queries:
+        return []
+    # UNION убирает повторы: в один визит обычно сохраняются несколько вкладок
+    rows = conn.execute(' UNION '.join(queries) + " ORDER BY 1", params).fetchall()
+    return [row[0] for row in rows if row[0] is not None]